@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+"""Micro-benchmark of the QR code formats of the POS payment links.
+
+Compares, for each format, the server time to render the QR code of a fresh
+URL (cache miss) and of a URL already rendered (cache hit), and the size of
+the RPC payload sent to the POS. Only `qrcode[pil]` is needed, not Odoo:
+
+    python benchmarks/bench_qr.py [--iterations 200]
+"""
+
+import argparse
+import importlib.util
+import json
+import statistics
+import time
+import uuid
+from pathlib import Path
+
+QR_MODULE_PATH = Path(__file__).resolve().parent.parent / 'pos_djomy' / 'qr.py'
+
+
+def load_qr_module():
+    # Load the module by path: importing `pos_djomy` would require Odoo.
+    spec = importlib.util.spec_from_file_location('pos_djomy_qr', QR_MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(samples, ratio):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * ratio))]
+
+
+def measure(render, urls):
+    timings = []
+    payload = None
+    for url in urls:
+        start = time.perf_counter()
+        payload = render(url)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, len(json.dumps(payload))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    qr = load_qr_module()
+    renderers = {
+        'png (legacy)': lambda url: {'qrCodeBase64': qr.render_png(url)},
+        'svg': lambda url: {'qrCodeBase64': qr.render_svg(url)},
+        'matrix (drawn by the POS)': lambda url: {'qrMatrix': qr.render_matrix(url)},
+    }
+
+    sizes = {}
+    print(f"{'format':<28}{'miss p50':>10}{'miss p95':>10}{'hit p50':>10}{'bytes':>8}")
+    for name, render in renderers.items():
+        for cached_function in (qr.get_matrix, qr.render_png, qr.render_svg, qr._pack_rows):
+            cached_function.cache_clear()
+        urls = [f'https://pay.djomy.africa/l/{uuid.uuid4()}' for _i in range(args.iterations)]
+        miss_timings, size = measure(render, urls)
+        sizes[name] = size
+        hit_timings, _size = measure(render, urls[-1:] * args.iterations)
+        print(
+            f"{name:<28}"
+            f"{statistics.median(miss_timings):>8.2f}ms"
+            f"{percentile(miss_timings, 0.95):>8.2f}ms"
+            f"{statistics.median(hit_timings):>8.3f}ms"
+            f"{size:>8}"
+        )
+    # The matrix, sent by default, must stay the smallest payload.
+    order = sorted(sizes, key=sizes.get)
+    assert order == ['matrix (drawn by the POS)', 'png (legacy)', 'svg'], sizes
+
+
+if __name__ == '__main__':
+    main()
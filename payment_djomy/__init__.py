@@ -3,6 +3,7 @@
 import base64
 from pathlib import Path
 
+from . import cli
 from . import controllers
 from . import models
 
@@ -7,12 +7,18 @@
     'sequence': 350,
     'summary': "A Guinean payment aggregator for Orange Money, MTN Mobile Money, and KULU.",
     'description': " ",
-    'depends': ['payment'],
+    'depends': ['account_payment'],
     'data': [
+        'security/ir.model.access.csv',
+
         'views/payment_djomy_templates.xml',
         'views/payment_provider_views.xml',
+        'views/account_move_views.xml',
+        'views/djomy_endpoint_state_views.xml',
+        'views/djomy_webhook_event_views.xml',
         'data/payment_provider_data.xml',
         'data/ir_config_parameter.xml',
+        'data/ir_cron_data.xml',
     ],
     'assets': {
         'web.assets_frontend': [
@@ -0,0 +1,69 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import argparse
+import contextlib
+import sys
+from datetime import datetime, time
+from pathlib import Path
+
+from odoo import SUPERUSER_ID, api
+from odoo.cli import Command
+from odoo.modules.registry import Registry
+from odoo.tools import config
+
+
+class DjomyReconcile(Command):
+    """Export the mismatches between the Djomy payments and the Odoo transactions as CSV.
+
+    Example, for a month-end reconciliation:
+
+        odoo-bin djomy_reconcile -c odoo.conf -d mydb --from 2026-09-01 --to 2026-10-01 \\
+            -o djomy-2026-09.csv
+    """
+    name = 'djomy_reconcile'
+
+    def run(self, cmdargs):
+        parser = argparse.ArgumentParser(
+            prog=f'{Path(sys.argv[0]).name} {self.name}',
+            description=self.__doc__.split('\n\n')[0],
+        )
+        parser.add_argument('-c', '--config', help="The Odoo configuration file.")
+        parser.add_argument('-d', '--database', required=True, help="The database.")
+        parser.add_argument(
+            '--from', dest='date_from', required=True, type=_parse_date,
+            help="The first day of the period, as YYYY-MM-DD.",
+        )
+        parser.add_argument(
+            '--to', dest='date_to', required=True, type=_parse_date,
+            help="The day after the period, as YYYY-MM-DD.",
+        )
+        parser.add_argument(
+            '--provider', type=int,
+            help="The id of the Djomy provider; by default, the first enabled one.",
+        )
+        parser.add_argument(
+            '-o', '--output', default='-', help="The CSV file to write; by default, stdout.",
+        )
+        args = parser.parse_args(cmdargs)
+        config.parse_config(['-c', args.config] if args.config else [])
+
+        with Registry(args.database).cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            Provider = env['payment.provider']
+            provider = Provider.browse(args.provider) if args.provider else Provider.search([
+                ('code', '=', 'djomy'), ('state', '!=', 'disabled'),
+            ], limit=1)
+            if not provider.exists() or provider.code != 'djomy':
+                sys.exit("No Djomy payment provider found.")
+            with contextlib.ExitStack() as stack:
+                output = sys.stdout if args.output == '-' else stack.enter_context(
+                    open(args.output, 'w', newline='', encoding='utf-8')
+                )
+                compared_count, mismatch_count = provider._djomy_export_reconciliation(
+                    output, args.date_from, args.date_to
+                )
+        print(f"{compared_count} payments compared, {mismatch_count} mismatches", file=sys.stderr)
+
+
+def _parse_date(value):
+    return datetime.combine(datetime.strptime(value, '%Y-%m-%d'), time.min)
@@ -16,6 +16,32 @@ PAYMENT_STATUS_MAPPING = {
     'error': ['FAILED', 'ERROR'],
 }
 
+# Webhook events that move a transaction
+WEBHOOK_EVENT_TYPES = [
+    'payment.success',
+    'payment.failed',
+    'payment.cancelled',
+    'payment.pending',
+]
+WEBHOOK_FINAL_EVENT_TYPES = {'payment.success', 'payment.failed', 'payment.cancelled'}
+
+# Webhook inbox. When the `djomy.webhook_async` system parameter is set, the webhook only stores the
+# notification and a cron processes the inbox in batches. A notification whose processing fails
+# (e.g., Djomy API unreachable) is retried up to WEBHOOK_MAX_ATTEMPTS times, with an exponential
+# back-off starting at WEBHOOK_RETRY_DELAY seconds, or after WEBHOOK_LOCKED_RETRY_DELAY seconds if
+# another request was updating the transaction. The cron is woken up WEBHOOK_COALESCE_DELAY seconds
+# after a notification so that the notifications that follow are merged with it. A run holds the
+# events of a batch for WEBHOOK_CLAIM_DELAY seconds, after which they are processed again if the run
+# crashed.
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_CLAIM_DELAY = 300
+WEBHOOK_COALESCE_DELAY = 2
+WEBHOOK_MAX_ATTEMPTS = 10
+WEBHOOK_RETRY_DELAY = 30
+WEBHOOK_LOCKED_RETRY_DELAY = 5
+WEBHOOK_TIME_BUDGET = 60
+WEBHOOK_RETENTION_DAYS = 30
+
 # Default payment method codes
 DEFAULT_PAYMENT_METHOD_CODES = {
     'djomy',
@@ -26,3 +52,156 @@ API_URLS = {
     'production': 'https://api.djomy.africa/v1/',
     'test': 'https://sandbox-api.djomy.africa/v1/',
 }
+
+# HTTP client. Each worker keeps a pool of persistent connections per provider; the pool size can
+# be overridden with the `djomy.http_pool_size` system parameter. HTTP_TIMEOUT is the longest a
+# request is expected to take.
+HTTP_POOL_SIZE = 10
+HTTP_TIMEOUT = 10
+
+# Connect and read timeouts, in seconds, of the requests to each endpoint class (see
+# BULKHEAD_SLOTS). Each pair can be overridden with the `djomy.timeout.<class>` system parameter,
+# e.g., `3,8`.
+HTTP_TIMEOUTS = {
+    'auth': (3, 5),
+    'payments': (3, 10),
+    'links': (3, 10),
+    'default': (3, 10),
+}
+
+# Circuit breaker, shared by all the workers, per provider and endpoint class. After
+# CIRCUIT_FAILURE_THRESHOLD failures (5xx, timeouts, connection errors) within
+# CIRCUIT_FAILURE_WINDOW seconds, the requests fail fast for CIRCUIT_OPEN_DURATION seconds; a single
+# probe request is then let through, and closes the circuit if it succeeds. A probe that did not
+# report back within CIRCUIT_PROBE_TIMEOUT seconds is replaced by another one.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_FAILURE_WINDOW = 60
+CIRCUIT_OPEN_DURATION = 30
+CIRCUIT_PROBE_TIMEOUT = 2 * HTTP_TIMEOUT
+
+# Bulkhead: maximum number of requests in flight at once, across all the workers, per provider and
+# endpoint class (the first segment of the endpoint path). The endpoints of no listed class fall in
+# the 'default' one. Each cap can be overridden with the `djomy.bulkhead_slots.<class>` system
+# parameter.
+BULKHEAD_SLOTS = {
+    'auth': 2,
+    'payments': 4,
+    'links': 4,
+    'default': 2,
+}
+
+# Rate limiter: requests per second sent to Djomy, across all the workers, per provider and endpoint
+# class. Each rate can be overridden with the `djomy.rate_limit.<class>` system parameter (0
+# disables the limiter). Up to RATE_LIMIT_BURST seconds worth of unused requests can be sent at
+# once. The background requests (crons) leave RATE_LIMIT_INTERACTIVE_SHARE of the burst to the
+# interactive ones (checkout, POS). A request waits at most RATE_LIMIT_MAX_WAIT seconds for its
+# turn (RATE_LIMIT_MAX_WAIT_BACKGROUND for the background ones), then is rejected. After a 429
+# answer, no request is sent before its `Retry-After` delay, or
+# RATE_LIMIT_DEFAULT_RETRY_AFTER seconds if it has none. A request that cannot update the shared
+# bucket because of a conflicting worker tries again after RATE_LIMIT_CONFLICT_DELAY seconds.
+RATE_LIMITS = {
+    'auth': 2,
+    'payments': 10,
+    'links': 10,
+    'default': 5,
+}
+RATE_LIMIT_BURST = 2
+RATE_LIMIT_INTERACTIVE_SHARE = 0.5
+RATE_LIMIT_MAX_WAIT = 3
+RATE_LIMIT_MAX_WAIT_BACKGROUND = 30
+RATE_LIMIT_DEFAULT_RETRY_AFTER = 5
+RATE_LIMIT_CONFLICT_DELAY = 0.05
+
+# The endpoint path segments that are not ids, kept as is in the metrics labels.
+ENDPOINT_STATIC_SEGMENTS = {'gateway', 'status', 'revoke'}
+
+# Background reconciliation of the pending transactions whose notification was lost. The number of
+# concurrent status requests can be overridden with the `djomy.reconcile_max_workers` system
+# parameter. Each transaction still pending after a check is checked again later, with an
+# exponential back-off between RECONCILE_BACKOFF_MIN and RECONCILE_BACKOFF_MAX seconds. A run claims
+# its transactions for RECONCILE_CLAIM_DELAY seconds, after which they are checked again if the run
+# crashed.
+RECONCILE_BATCH_SIZE = 200
+RECONCILE_MAX_WORKERS = 8
+RECONCILE_TIME_BUDGET = 120
+RECONCILE_BACKOFF_MIN = 30
+RECONCILE_BACKOFF_MAX = 6 * 3600
+RECONCILE_CLAIM_DELAY = 600
+
+# Expiry of the abandoned transactions: the Djomy transactions still draft or pending after
+# TRANSACTION_EXPIRY_HOURS hours, which can be overridden with the `djomy.transaction_expiry_hours`
+# system parameter, are cancelled by a daily cron, in batches of EXPIRY_BATCH_SIZE.
+TRANSACTION_EXPIRY_HOURS = 48
+EXPIRY_BATCH_SIZE = 5000
+EXPIRY_TIME_BUDGET = 300
+
+# Deferred post-processing of the confirmed transactions (invoice reconciliation and posting), run
+# by a cron triggered on each confirmation instead of inline in the webhook. The transactions
+# confirmed more than POST_PROCESS_MAX_AGE_DAYS days ago are left to the core cron, as it does.
+POST_PROCESS_BATCH_SIZE = 50
+POST_PROCESS_TIME_BUDGET = 60
+POST_PROCESS_MAX_AGE_DAYS = 4
+
+# Reconciliation export: size of the pages of payments requested from Djomy, and of the batches of
+# rows fetched from the server-side cursor merging them with the transactions.
+RECONCILIATION_PAGE_SIZE = 500
+
+# Cache of the payment statuses, keyed by provider and transaction: in memory in each worker, in
+# front of a table shared by all the workers. A final status never changes and is kept long; a
+# pending one is only kept a few seconds.
+STATUS_CACHE_SIZE = 10000
+STATUS_CACHE_TTL_FINAL = 3600
+STATUS_CACHE_TTL_PENDING = 3
+
+# The provider fields that the cached provider resolution and request context depend on.
+REQUEST_CONTEXT_FIELDS = {
+    'code', 'state', 'company_id', 'sequence', 'name',
+    'djomy_client_id', 'djomy_client_secret', 'djomy_partner_domain',
+}
+
+# Maximum number of payment link status requests sent concurrently.
+LINK_STATUS_MAX_WORKERS = 8
+
+# Bulk generation of the payment links of the invoices. The links are created in batches by a cron,
+# with at most LINK_GENERATION_MAX_WORKERS requests in flight and LINK_GENERATION_RATE requests per
+# second on average; both can be overridden with the `djomy.link_generation_max_workers` and
+# `djomy.link_generation_rate` system parameters. A run holds the invoices of a batch for
+# LINK_GENERATION_CLAIM_DELAY seconds, after which they are generated again if the run crashed. A
+# link whose creation failed because Djomy was unreachable is retried after
+# LINK_GENERATION_RETRY_DELAY seconds, up to LINK_GENERATION_MAX_ATTEMPTS times.
+LINK_GENERATION_BATCH_SIZE = 100
+LINK_GENERATION_CLAIM_DELAY = 600
+LINK_GENERATION_MAX_WORKERS = 8
+LINK_GENERATION_RATE = 20
+LINK_GENERATION_TIME_BUDGET = 240
+LINK_GENERATION_RETRY_DELAY = 60
+LINK_GENERATION_MAX_ATTEMPTS = 3
+INVOICE_LINK_LIFETIME_DAYS = 30
+
+# Access token management. Djomy does not always return the token lifetime, in
+# which case the default one is assumed. Tokens are refreshed this many seconds
+# before they expire so that no request is ever sent with an expired token.
+ACCESS_TOKEN_DEFAULT_LIFETIME = 1800
+ACCESS_TOKEN_REFRESH_MARGIN = 60
+
+# PostgreSQL advisory lock namespaces (first key of the two-keys lock functions;
+# the second key is the provider id).
+ADVISORY_LOCK_TOKEN_REFRESH = 0x446A0001
+# The bulkhead takes one lock per slot, from this namespace on: the first key is
+# `ADVISORY_LOCK_BULKHEAD + class_index * BULKHEAD_MAX_SLOTS + slot`, with `class_index` the
+# position of the endpoint class in BULKHEAD_SLOTS, and the second key is the provider id. The
+# slots configured beyond BULKHEAD_MAX_SLOTS are ignored so that the classes never overlap.
+ADVISORY_LOCK_BULKHEAD = 0x446A0100
+BULKHEAD_MAX_SLOTS = 256
+
+# Payload logging. The payloads received from Djomy are logged in full at DEBUG level, and at INFO
+# level for a share of them only (the `djomy.log_payload_sample_rate` system parameter, from 0 to
+# 1). The last PAYLOAD_BUFFER_SIZE payloads of each provider are kept in memory for debugging. The
+# values of the keys below (compared in lower case) are masked wherever a payload is logged.
+LOG_PAYLOAD_SAMPLE_RATE = 0.0
+PAYLOAD_BUFFER_SIZE = 50
+PII_KEYS = {
+    'payernumber', 'phone', 'phonenumber', 'payerphone', 'msisdn', 'partner_phone',
+    'payername', 'customername', 'name', 'email', 'payeremail', 'customeremail',
+    'client_secret', 'clientsecret', 'access_token', 'accesstoken', 'token', 'password',
+}
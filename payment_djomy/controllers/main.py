@@ -3,15 +3,16 @@
 import hmac
 import hashlib
 import json
-import pprint
 
-from werkzeug.exceptions import Forbidden
+from werkzeug.exceptions import Forbidden, NotFound
 
 from odoo import http
 from odoo.exceptions import ValidationError
 from odoo.http import request
 
+from odoo.addons.payment import utils as payment_utils
 from odoo.addons.payment.logging import get_payment_logger
+from odoo.addons.payment_djomy import const, metrics, payload_log
 
 
 _logger = get_payment_logger(__name__)
@@ -22,8 +23,10 @@ class DjomyController(http.Controller):
     _cancel_url = '/payment/djomy/cancel'
     _webhook_url = '/payment/djomy/webhook'
     _process_url = '/payment/djomy/process'
+    _metrics_url = '/payment/djomy/metrics'
 
     @http.route(_process_url, type='json', auth='public')
+    @metrics.timed('djomy_route_duration_seconds', 'djomy_route_errors_total', route='process')
     def djomy_process_payment(self, reference, phone):
         """Process Djomy payment with phone number from inline form.
 
@@ -32,7 +35,10 @@ class DjomyController(http.Controller):
         :return: The redirect URL or error message.
         :rtype: dict
         """
-        _logger.info("Processing Djomy payment for reference %s with phone %s", reference, phone)
+        _logger.info(
+            "Processing Djomy payment for reference %s with phone %s",
+            reference, payload_log.mask_phone(phone),
+        )
 
         tx_sudo = request.env['payment.transaction'].sudo().search([
             ('reference', '=', reference),
@@ -55,36 +61,54 @@ class DjomyController(http.Controller):
 
         return {'redirect_url': redirect_url}
 
-    @http.route(_return_url, type='http', methods=['GET'], auth='public')
-    def djomy_return_from_checkout(self, **data):
+    @http.route([
+        _return_url,
+        f'{_return_url}/<int:tx_id>/<string:access_token>',
+    ], type='http', methods=['GET'], auth='public')
+    @metrics.timed('djomy_route_duration_seconds', 'djomy_route_errors_total', route='return')
+    def djomy_return_from_checkout(self, tx_id=None, access_token=None, **data):
         """Process the payment data sent by Djomy after redirection.
 
+        The return URL carries the id of the transaction, signed with an
+        access token, so that the transaction is resolved by primary key.
         Djomy should add ?transactionId=<uuid>&status=SUCCESS|FAILED|CANCELLED
-        But sometimes Djomy doesn't send these parameters, so we fallback to
-        finding the most recent pending transaction.
-        """
-        _logger.info("Handling redirection from Djomy with data:\n%s", pprint.pformat(data))
+        But sometimes Djomy doesn't send these parameters, so we fall back to
+        the transactionId stored on the transaction.
 
+        The unsigned URL is still served for the payments created before the
+        return URL was signed; the transaction is then looked up by
+        transactionId only.
+        """
         transaction_id = data.get('transactionId')
         url_status = data.get('status', '').upper()
+        _logger.info(
+            "Handling redirection from Djomy for transaction %s with status %s",
+            transaction_id, url_status,
+        )
 
-        tx_sudo = None
-
-        if transaction_id:
+        tx_sudo = request.env['payment.transaction'].sudo()
+
+        if tx_id:
+            if not payment_utils.check_access_token(access_token, tx_id):
+                _logger.warning("Djomy: Invalid access token in return URL for tx %s", tx_id)
+                raise Forbidden()
+            tx_sudo = tx_sudo.browse(tx_id).exists().filtered(lambda t: t.provider_code == 'djomy')
+            if tx_sudo and transaction_id and transaction_id != tx_sudo.provider_reference:
+                # Only the transactionId stored on the signed transaction is trusted.
+                _logger.warning(
+                    "Djomy: transactionId %s in return URL does not match tx %s",
+                    transaction_id, tx_sudo.reference,
+                )
+                transaction_id = None
+                url_status = ''
+        elif transaction_id:
             # Find transaction by provider reference (transactionId from Djomy)
-            tx_sudo = request.env['payment.transaction'].sudo().search([
-                ('provider_code', '=', 'djomy'),
+            tx_sudo = tx_sudo.search([
                 ('provider_reference', '=', transaction_id),
-            ], limit=1)
-
-        if not tx_sudo:
-            # Fallback: find the most recent draft/pending djomy transaction
-            tx_sudo = request.env['payment.transaction'].sudo().search([
                 ('provider_code', '=', 'djomy'),
-                ('state', 'in', ['draft', 'pending']),
-            ], order='create_date desc', limit=1)
-            _logger.info("Djomy: No transactionId in URL, found fallback tx: %s", tx_sudo.reference if tx_sudo else None)
+            ], limit=1)
 
+        self._log_payload('return', data, tx_sudo.provider_id.id)
         if tx_sudo:
             # Get transaction_id from the transaction if not in URL
             if not transaction_id:
@@ -93,10 +117,11 @@ class DjomyController(http.Controller):
             if transaction_id:
                 # Query API to get actual status
                 try:
-                    # Retry wrapper: refresh the (likely expired) access
-                    # token on 401 instead of failing the status check.
-                    api_data = tx_sudo.provider_id._djomy_send_request_with_retry(
-                        'GET', f'payments/{transaction_id}/status'
+                    # Shared status cache: the webhook may have fetched the
+                    # status a moment ago. A cached pending status is not
+                    # trusted when Djomy sent a status along the redirection.
+                    api_data = tx_sudo.provider_id._djomy_fetch_payment_status(
+                        transaction_id, allow_pending=not url_status
                     )
                     # Use API status if URL status not available
                     api_status = api_data.get('status', '').upper()
@@ -111,7 +136,7 @@ class DjomyController(http.Controller):
                     payment_data['status'] = final_status
 
                     _logger.info("Djomy: Processing payment with status: %s", final_status)
-                    tx_sudo._process('djomy', payment_data)
+                    tx_sudo._djomy_apply_status(payment_data)
 
                 except ValidationError as e:
                     _logger.warning("Could not fetch payment details from Djomy API: %s", e)
@@ -122,7 +147,7 @@ class DjomyController(http.Controller):
                             'status': url_status,
                             'merchantPaymentReference': tx_sudo.reference,
                         }
-                        tx_sudo._process('djomy', payment_data)
+                        tx_sudo._djomy_apply_status(payment_data)
             else:
                 _logger.warning("Djomy: No transactionId available to verify payment status")
 
@@ -131,10 +156,12 @@ class DjomyController(http.Controller):
     @http.route(_cancel_url, type='http', methods=['GET'], auth='public')
     def djomy_cancel_from_checkout(self, **data):
         """Handle payment cancellation."""
-        _logger.info("Payment cancelled from Djomy with data:\n%s", pprint.pformat(data))
+        _logger.info("Payment cancelled from Djomy for transaction %s", data.get('transactionId'))
+        self._log_payload('cancel', data)
         return request.redirect('/payment/status')
 
     @http.route(_webhook_url, type='http', methods=['GET', 'POST'], auth='public', csrf=False)
+    @metrics.timed('djomy_route_duration_seconds', 'djomy_route_errors_total', route='webhook')
     def djomy_webhook(self):
         """Process the webhook notification from Djomy.
 
@@ -144,11 +171,19 @@ class DjomyController(http.Controller):
 
         HMAC verification can be disabled via the system parameter
         ``djomy.webhook_verify_signature`` (see ``_verify_webhook_signature``).
-        Whether the signature is checked or not, the controller ALWAYS
-        re-fetches the official status from Djomy via
+        Whether the signature is checked or not, the official status is
+        ALWAYS re-fetched from Djomy via
         ``GET /payments/{transactionId}/status`` before transitioning the
         transaction state — this prevents a caller from forging a
-        ``{status: SUCCESS}`` payload when the signature check is off.
+        ``{status: SUCCESS}`` payload when the signature check is off
+        (see ``payment.transaction._djomy_process_notification``).
+
+        Every verified notification, about a transaction or a payment link,
+        is recorded in the webhook inbox (``djomy.webhook.event``), which
+        drops the exact duplicates. When
+        the system parameter ``djomy.webhook_async`` is enabled, the
+        notification is only recorded and acknowledged; a cron processes
+        the inbox in batches. Otherwise it is processed right away.
         """
         # Handle GET requests for webhook validation
         if request.httprequest.method == 'GET':
@@ -165,86 +200,96 @@ class DjomyController(http.Controller):
             return request.make_json_response(
                 {'status': 'error', 'reason': 'bad_payload'}
             )
-        _logger.info("Webhook notification from Djomy:\n%s", pprint.pformat(data))
-
-        event_type = data.get('eventType', '')
-
-        if event_type in [
-            'payment.success',
-            'payment.failed',
-            'payment.cancelled',
-            'payment.pending',
-        ]:
-            # Find the transaction
-            tx_sudo = request.env['payment.transaction'].sudo()._search_by_reference(
+        _logger.info(
+            "Webhook notification from Djomy: %s for transaction %s",
+            data.get('eventType'), data.get('transactionId'),
+        )
+
+        if data.get('eventType', '') in const.WEBHOOK_EVENT_TYPES:
+            # Payments made through a payment link (e.g., from the POS) may
+            # have no transaction: the notification is then about the link.
+            record_sudo = request.env['payment.transaction'].sudo()._search_by_reference(
                 'djomy', data
-            )
+            ) or request.env['payment.transaction'].sudo()._djomy_search_payment_link(data)
 
-            if tx_sudo:
+            signature = request.httprequest.headers.get('X-Webhook-Signature', '')
+            if record_sudo:
                 # Verify webhook signature
-                signature = request.httprequest.headers.get('X-Webhook-Signature', '')
-                self._verify_webhook_signature(signature, raw_body, tx_sudo)
-
-                # Re-fetch the official status from Djomy to prevent a
-                # forged payload from moving the transaction to `done`
-                # when signature verification is disabled.
-                transaction_id = (
-                    data.get('transactionId')
-                    or data.get('data', {}).get('transactionId')
-                    or tx_sudo.provider_reference
+                self._verify_webhook_signature(signature, raw_body, record_sudo)
+                # Only the authenticated payloads are kept, so that forged ones cannot flood the
+                # buffer of the provider.
+                self._log_payload('webhook', data, record_sudo.provider_id.id)
+
+                # The inbox drops the exact duplicates before any call to Djomy.
+                process_async = self._is_webhook_async()
+                event_sudo = request.env['djomy.webhook.event'].sudo()._enqueue(
+                    record_sudo, data, raw_body, process_async=process_async
                 )
-                if transaction_id:
-                    try:
-                        # Use the retry wrapper: the stored access token was
-                        # fetched at payment creation and is very likely
-                        # expired by the time the webhook fires. A direct
-                        # `_send_api_request` would 401 without refreshing.
-                        api_data = tx_sudo.provider_id._djomy_send_request_with_retry(
-                            'GET', f'payments/{transaction_id}/status'
-                        )
-                    except ValidationError as err:
-                        _logger.warning(
-                            "Djomy webhook: failed to fetch official status "
-                            "for tx=%s: %s", tx_sudo.reference, err,
-                        )
+                if event_sudo and not process_async:
+                    event_sudo._process()
+                    if event_sudo.state != 'done':
                         return request.make_json_response(
-                            {'status': 'error', 'reason': 'api_unreachable'}
-                        )
-                    api_status = api_data.get('status', '').upper()
-                    if not api_status:
-                        _logger.warning(
-                            "Djomy webhook: Djomy returned no status for tx=%s",
-                            tx_sudo.reference,
-                        )
-                        return request.make_json_response(
-                            {'status': 'error', 'reason': 'no_official_status'}
-                        )
-                    data = {**data, **api_data, 'status': api_status}
-
-                # Process the transaction
-                tx_sudo._process('djomy', data)
-                # Trigger post-processing immediately so the invoice is
-                # marked paid without waiting for the ~10-min core cron
-                # `cron_post_process_payment_tx`. The return URL relies
-                # on `/payment/status` (portal page) to do this — the
-                # webhook has no such external trigger.
-                if tx_sudo.state == 'done' and not tx_sudo.is_post_processed:
-                    try:
-                        tx_sudo._post_process()
-                    except Exception as exc:
-                        _logger.warning(
-                            "Djomy webhook: _post_process failed tx=%s: %s",
-                            tx_sudo.reference, exc,
+                            {'status': 'error', 'reason': event_sudo.error}
                         )
 
         return request.make_json_response({'status': 'ok'})
 
+    @http.route(_metrics_url, type='http', methods=['GET'], auth='public', csrf=False)
+    def djomy_metrics(self, token=None):
+        """Expose the Djomy metrics of all the workers in the Prometheus text format.
+
+        The route is disabled unless the system parameter ``djomy.metrics_token``
+        is set; the token must then be sent as a bearer token, or in the
+        ``token`` query parameter.
+        """
+        expected_token = request.env['ir.config_parameter'].sudo().get_param('djomy.metrics_token')
+        if not expected_token:
+            raise NotFound()
+        authorization = request.httprequest.headers.get('Authorization', '')
+        received_token = authorization.removeprefix('Bearer ') if authorization else token
+        if not received_token or not hmac.compare_digest(received_token, expected_token):
+            raise Forbidden()
+        return request.make_response(
+            metrics.registry.render(),
+            headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')],
+        )
+
+    @staticmethod
+    def _log_payload(source, data, provider_id=None):
+        """Keep a received payload for debugging, and log it if enabled or sampled.
+
+        The share of the payloads logged in full at INFO level is set by the system parameter
+        ``djomy.log_payload_sample_rate`` (0 by default); they are always logged at DEBUG level.
+        """
+        sample_rate = request.env['ir.config_parameter'].sudo().get_param(
+            'djomy.log_payload_sample_rate', const.LOG_PAYLOAD_SAMPLE_RATE,
+        )
+        try:
+            sample_rate = float(sample_rate)
+        except ValueError:
+            sample_rate = const.LOG_PAYLOAD_SAMPLE_RATE
+        payload_log.log_payload(
+            _logger, source, data, request.env.cr.dbname,
+            provider_id=provider_id or None, sample_rate=sample_rate,
+        )
+
+    @staticmethod
+    def _is_webhook_async():
+        """Return whether the webhook notifications are processed by the inbox cron."""
+        async_mode = request.env['ir.config_parameter'].sudo().get_param(
+            'djomy.webhook_async', 'False',
+        )
+        return str(async_mode).lower() in ('true', '1', 'yes')
+
     @staticmethod
     def _verify_webhook_signature(received_signature, raw_body, tx_sudo):
         """Verify the webhook signature.
 
         Format: v1:<HMAC-SHA256(raw_body, clientSecret)>
 
+        ``tx_sudo`` is the transaction, or the payment link, the notification
+        is about; the secret of its ``provider_id`` signs the notification.
+
         Can be disabled via the system parameter
         ``djomy.webhook_verify_signature`` (default ``True``). When set
         to ``False``, a warning is logged and the check is skipped —
@@ -0,0 +1,245 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+"""Latency and error metrics of the Djomy integration, exposed in the Prometheus text format.
+
+Recording a value only updates a dict under a lock. Each worker periodically saves its metrics in a
+file of a directory shared by all the workers of the server, so that the metrics endpoint, served
+by any one of them, can aggregate the metrics of all of them.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+from odoo.tools import config
+
+
+# {name: (type, help)}
+METRICS = {
+    'djomy_api_request_duration_seconds': (
+        'histogram', "Duration of the requests to the Djomy API, by endpoint."
+    ),
+    'djomy_api_requests_total': (
+        'counter', "Requests to the Djomy API, by endpoint and HTTP status."
+    ),
+    'djomy_rate_limit_wait_seconds': (
+        'histogram', "Time spent waiting for the rate limiter, by endpoint class and priority."
+    ),
+    'djomy_access_token_requests_total': (
+        'counter', "Access token lookups, by result (cached, reused, refreshed)."
+    ),
+    'djomy_status_cache_requests_total': (
+        'counter', "Payment status cache lookups, by result (hit, miss, coalesced)."
+    ),
+    'djomy_status_updates_total': (
+        'counter', "Payment statuses received, by result (applied, unchanged, locked)."
+    ),
+    'djomy_route_duration_seconds': (
+        'histogram', "Duration of the Djomy HTTP routes, by route."
+    ),
+    'djomy_route_errors_total': (
+        'counter', "Djomy HTTP routes that raised an error, by route."
+    ),
+    'djomy_pos_rpc_duration_seconds': (
+        'histogram', "Duration of the Djomy POS RPCs, by method."
+    ),
+    'djomy_pos_rpc_errors_total': (
+        'counter', "Djomy POS RPCs that raised an error, by method."
+    ),
+    'djomy_webhook_event_latency_seconds': (
+        'histogram', "Time from the reception of a webhook notification to its processing."
+    ),
+}
+
+# Upper bounds, in seconds, of the histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# How often, in seconds, a worker saves its metrics for the other workers.
+SAVE_INTERVAL = 5
+
+# The files of the workers that stopped this long ago, in seconds, are dropped.
+FILE_RETENTION = 24 * 3600
+
+
+class MetricsRegistry:
+    """Thread-safe in-memory store of the counters and histograms of a process."""
+
+    def __init__(self, directory=None):
+        """
+        :param str directory: The directory shared by the workers, by default `djomy_metrics` in
+                              the data directory of the server.
+        """
+        self.directory = directory
+        self._counters = {}  # {(name, labels): value}
+        self._histograms = {}  # {(name, labels): [bucket counts..., sum, count]}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._last_save = 0
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter."""
+        key = _get_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._save_if_due()
+
+    def observe(self, name, value, **labels):
+        """Record a value, e.g., a duration in seconds, in a histogram."""
+        key = _get_key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+        self._save_if_due()
+
+    def register_collector(self, collect):
+        """Register a function returning counters kept elsewhere, as `[(name, labels, value)]`."""
+        self._collectors.append(collect)
+
+    def snapshot(self):
+        """Return the current metrics of the process, in a JSON-serializable form."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+        for collect in self._collectors:
+            for name, labels, value in collect():
+                counters[_get_key(name, labels)] = value
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [
+                [name, list(labels), values] for (name, labels), values in histograms.items()
+            ],
+        }
+
+    def clear(self):
+        """Drop all the metrics recorded by the process."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    # === SHARING ACROSS WORKERS === #
+
+    def save(self):
+        """Save the metrics of the process in the shared directory."""
+        with self._save_lock:
+            self._last_save = time.monotonic()
+            directory = self.directory or _get_directory()
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{os.getpid()}.json')
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+                json.dump(self.snapshot(), file)
+            os.replace(f'{path}.tmp', path)
+
+    def _save_if_due(self):
+        if time.monotonic() - self._last_save > SAVE_INTERVAL and not self._save_lock.locked():
+            try:
+                self.save()
+            except OSError:
+                pass  # Metrics must never break the request that records them.
+
+    def render(self):
+        """Return the metrics of all the workers, in the Prometheus text format.
+
+        :rtype: str
+        """
+        self.save()
+        counters, histograms = {}, {}
+        directory = self.directory or _get_directory()
+        now = time.time()
+        for file_name in os.listdir(directory):
+            if not file_name.endswith('.json'):
+                continue
+            path = os.path.join(directory, file_name)
+            try:
+                if now - os.path.getmtime(path) > FILE_RETENTION:
+                    os.remove(path)
+                    continue
+                with open(path, encoding='utf-8') as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+                else:
+                    histograms[key] = values
+
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for (metric_name, labels), value in sorted(counters.items()):
+                if metric_name == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            for (metric_name, labels), values in sorted(histograms.items()):
+                if metric_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, values):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{_format_labels(labels, le=bound)} {cumulative}'
+                    )
+                lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {values[-1]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {values[-2]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {values[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _get_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _get_directory():
+    return os.path.join(config['data_dir'], 'djomy_metrics')
+
+
+def _format_labels(labels, **extra):
+    labels = [*labels, *extra.items()]
+    if not labels:
+        return ''
+    formatted = ','.join(
+        '{}="{}"'.format(
+            key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        )
+        for key, value in labels
+    )
+    return f'{{{formatted}}}'
+
+
+registry = MetricsRegistry()
+
+
+def timed(histogram, errors_counter, **labels):
+    """Decorate a function to record its duration, and whether it raised an error.
+
+    :param str histogram: The name of the histogram of the durations.
+    :param str errors_counter: The name of the counter of the errors.
+    :param labels: The labels of the metrics.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                registry.inc(errors_counter, **labels)
+                raise
+            finally:
+                registry.observe(histogram, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
@@ -1,4 +1,8 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from . import account_move
+from . import djomy_endpoint_state
+from . import djomy_payment_status
+from . import djomy_webhook_event
 from . import payment_provider
 from . import payment_transaction
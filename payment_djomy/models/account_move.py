@@ -0,0 +1,321 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import time
+from datetime import timedelta
+
+from odoo import _, api, Command, fields, models, tools
+from odoo.exceptions import UserError
+
+from odoo.addons.payment.logging import get_payment_logger
+from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy.utils import DjomyAPIError, is_throttled, is_transient_failure
+
+
+_logger = get_payment_logger(__name__)
+
+
+class AccountMove(models.Model):
+    _inherit = 'account.move'
+
+    djomy_link_state = fields.Selection(
+        string="Djomy Link Status",
+        selection=[
+            ('pending', "To Generate"),
+            ('done', "Generated"),
+            ('error', "Error"),
+        ],
+        copy=False,
+        readonly=True,
+    )
+    djomy_link_reference = fields.Char(string="Djomy Link Reference", copy=False, readonly=True)
+    djomy_link_url = fields.Char(string="Djomy Payment Link", copy=False, readonly=True)
+    djomy_link_amount = fields.Monetary(
+        string="Djomy Link Amount",
+        help="The amount to pay through the link, i.e., the amount due when it was created.",
+        currency_field='currency_id',
+        copy=False,
+        readonly=True,
+    )
+    djomy_link_attempts = fields.Integer(string="Djomy Link Attempts", copy=False, readonly=True)
+    djomy_link_error = fields.Text(string="Djomy Link Error", copy=False, readonly=True)
+    djomy_link_claimed_until = fields.Datetime(
+        string="Djomy Link Claimed Until",
+        help="Until when the generation cron holds the invoice, or waits before retrying it.",
+        copy=False,
+        readonly=True,
+    )
+
+    def init(self):
+        super().init()
+        # The generation cron only ever looks for the invoices whose link is to generate.
+        tools.create_index(
+            self.env.cr,
+            'account_move_djomy_link_pending_index',
+            self._table,
+            ['id'],
+            where="djomy_link_state = 'pending'",
+        )
+
+    # === ACTION METHODS === #
+
+    def action_djomy_generate_payment_links(self):
+        """Queue the generation of a Djomy payment link for each invoice.
+
+        The links are generated in the background by a cron, so that hundreds of invoices can be
+        selected at once. The invoices already having a link, or not expecting any payment, are
+        skipped.
+        """
+        self.check_access('write')
+        invoices = self.filtered(lambda m: (
+            m.is_invoice(include_receipts=True)
+            and m.is_inbound()
+            and m.state == 'posted'
+            and m.payment_state in ('not_paid', 'partial')
+            and m.djomy_link_state != 'done'
+        ))
+        if not invoices:
+            raise UserError(_("None of the selected invoices needs a Djomy payment link."))
+        invoices.sudo().write({
+            'djomy_link_state': 'pending',
+            'djomy_link_attempts': 0,
+            'djomy_link_error': False,
+            'djomy_link_claimed_until': False,
+        })
+        self.env.ref('payment_djomy.cron_generate_invoice_payment_links')._trigger()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'type': 'info',
+                'message': _(
+                    "The Djomy payment links of %(count)s invoices are being generated.",
+                    count=len(invoices),
+                ),
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
+
+    # === BUSINESS METHODS === #
+
+    @api.model
+    def _cron_djomy_generate_payment_links(self):
+        """Generate the Djomy payment links of the invoices queued for it.
+
+        The invoices are claimed in batches with `SKIP LOCKED`, by holding them for
+        LINK_GENERATION_CLAIM_DELAY seconds, and the claim is committed right away so that no row
+        stays locked while their links are created concurrently. Concurrent runs never process the
+        same invoices, and those of a crashed run are generated again once the claim expires. Each
+        batch is committed once done. The invoices to retry are held for
+        LINK_GENERATION_RETRY_DELAY seconds, and the cron is rescheduled for them. The request rate
+        is capped across batches, and the cron stops after a time budget and reschedules itself if
+        invoices are left.
+        """
+        self = self.with_context(djomy_request_priority='background')
+        ICP = self.env['ir.config_parameter'].sudo()
+        max_workers = int(ICP.get_param(
+            'djomy.link_generation_max_workers', const.LINK_GENERATION_MAX_WORKERS
+        ))
+        rate = float(ICP.get_param('djomy.link_generation_rate', const.LINK_GENERATION_RATE))
+        cron = self.env.ref('payment_djomy.cron_generate_invoice_payment_links')
+        start = time.monotonic()
+        while True:
+            self.flush_model(['djomy_link_state', 'djomy_link_claimed_until'])
+            now = fields.Datetime.now()
+            self.env.cr.execute("""
+                UPDATE account_move
+                   SET djomy_link_claimed_until = %s
+                 WHERE id IN (
+                        SELECT id
+                          FROM account_move
+                         WHERE djomy_link_state = 'pending'
+                           AND (djomy_link_claimed_until IS NULL OR djomy_link_claimed_until <= %s)
+                         ORDER BY id
+                         LIMIT %s
+                           FOR UPDATE SKIP LOCKED
+                       )
+             RETURNING id
+            """, [
+                now + timedelta(seconds=const.LINK_GENERATION_CLAIM_DELAY),
+                now,
+                const.LINK_GENERATION_BATCH_SIZE,
+            ])
+            invoices = self.sudo().browse(row[0] for row in self.env.cr.fetchall())
+            if not invoices:
+                self.env.cr.execute("""
+                    SELECT MIN(djomy_link_claimed_until)
+                      FROM account_move
+                     WHERE djomy_link_state = 'pending'
+                """)
+                if next_run := self.env.cr.fetchone()[0]:
+                    cron._trigger(next_run)
+                return
+            invoices.invalidate_recordset(['djomy_link_claimed_until'])
+            self.env['payment.transaction']._djomy_commit_progress()
+            batch_start = time.monotonic()
+            for _company, company_invoices in invoices.grouped('company_id').items():
+                company_invoices._djomy_generate_payment_links(max_workers)
+            invoices.filtered(lambda m: m.djomy_link_state == 'pending').write({
+                'djomy_link_claimed_until': (
+                    fields.Datetime.now() + timedelta(seconds=const.LINK_GENERATION_RETRY_DELAY)
+                ),
+            })
+            self.env['payment.transaction']._djomy_commit_progress()
+            if time.monotonic() - start > const.LINK_GENERATION_TIME_BUDGET:
+                cron._trigger()
+                return
+            # Never send more than `rate` requests per second on average.
+            time.sleep(max(0, len(invoices) / rate - (time.monotonic() - batch_start)))
+
+    def _djomy_generate_payment_links(self, max_workers):
+        """Create the Djomy payment links of invoices of a same company and store them.
+
+        The invoices whose link could not be created because of a transient failure are kept in
+        the queue, up to LINK_GENERATION_MAX_ATTEMPTS times. Those rejected without being sent,
+        e.g., while the circuit is open, or throttled by Djomy are kept in the queue without
+        counting an attempt.
+
+        :param int max_workers: The maximum number of requests in flight at once.
+        """
+        provider = self.env['payment.provider'].browse(
+            self.env['payment.provider']._djomy_get_provider_id(self.company_id.id)
+        )
+        if not provider or provider.state == 'disabled':
+            self.write({
+                'djomy_link_state': 'error',
+                'djomy_link_error': _("No Djomy payment provider is enabled for this company."),
+            })
+            return
+
+        expires_at = (
+            fields.Datetime.now() + timedelta(days=const.INVOICE_LINK_LIFETIME_DAYS)
+        ).strftime('%Y-%m-%dT%H:%M:%SZ')
+        payloads = {invoice.id: invoice._djomy_prepare_link_payload(expires_at) for invoice in self}
+        responses = provider._djomy_send_concurrent_requests({
+            invoice_id: ('POST', 'links', payload) for invoice_id, payload in payloads.items()
+        }, max_workers)
+
+        for invoice in self:
+            response = responses.get(invoice.id)
+            if isinstance(response, dict) and response.get('paymentLinkReference'):
+                invoice.write({
+                    'djomy_link_state': 'done',
+                    'djomy_link_reference': response['paymentLinkReference'],
+                    'djomy_link_url': response.get('paymentPageUrl'),
+                    'djomy_link_amount': payloads[invoice.id]['amountToPay'],
+                    'djomy_link_attempts': invoice.djomy_link_attempts + 1,
+                    'djomy_link_error': False,
+                })
+                continue
+            if isinstance(response, DjomyAPIError) and response.rejected or is_throttled(response):
+                invoice.djomy_link_error = str(response)
+                continue
+            if isinstance(response, Exception):
+                error = str(response)
+                retry = is_transient_failure(response)
+            else:
+                error = (response or {}).get('message') or _("Invalid response from Djomy.")
+                retry = False
+            attempts = invoice.djomy_link_attempts + 1
+            if not retry or attempts >= const.LINK_GENERATION_MAX_ATTEMPTS:
+                _logger.warning(
+                    "Djomy: Could not generate the payment link of invoice %s: %s",
+                    invoice.name, error,
+                )
+            invoice.write({
+                'djomy_link_state': (
+                    'pending' if retry and attempts < const.LINK_GENERATION_MAX_ATTEMPTS
+                    else 'error'
+                ),
+                'djomy_link_attempts': attempts,
+                'djomy_link_error': error,
+            })
+
+    @api.model
+    def _djomy_search_by_notification(self, data):
+        """Return the invoice whose payment link a Djomy notification is about, if any.
+
+        :param dict data: The notification data.
+        :return: The invoice, or an empty recordset.
+        :rtype: account.move
+        """
+        notification_data = data.get('data', data)
+        link_reference = (
+            data.get('paymentLinkReference') or notification_data.get('paymentLinkReference')
+        )
+        if link_reference:
+            return self.search([('djomy_link_reference', '=', link_reference)], limit=1)
+        merchant_reference = (
+            notification_data.get('merchantPaymentReference')
+            or notification_data.get('merchantReference')
+        )
+        if merchant_reference:
+            return self.search([
+                ('name', '=', merchant_reference),
+                ('djomy_link_state', '=', 'done'),
+            ], limit=1)
+        return self.browse()
+
+    def _djomy_get_link_transaction(self, data):
+        """Return the transaction of a payment made through the link of the invoice.
+
+        The transaction is created on the first notification of the payment, for the amount of the
+        link, so that processing it registers the payment on the invoice. The amount due may have
+        changed since the link was created, e.g., after a partial payment, so it is only a last
+        resort when neither the link nor the notification tell the amount. The next notifications
+        find it by its Djomy transaction id.
+
+        :param dict data: The notification data.
+        :return: The transaction, or None if the notification is about no payment.
+        :rtype: payment.transaction
+        """
+        self.ensure_one()
+        notification_data = data.get('data', data)
+        djomy_transaction_ref = data.get('transactionId') or notification_data.get('transactionId')
+        provider = self.env['payment.provider'].browse(
+            self.env['payment.provider']._djomy_get_provider_id(self.company_id.id)
+        )
+        if not djomy_transaction_ref or not provider:
+            return None
+        Transaction = self.env['payment.transaction']
+        tx = Transaction.search([
+            ('provider_id', '=', provider.id),
+            ('provider_reference', '=', djomy_transaction_ref),
+        ], limit=1)
+        if tx:
+            return tx
+        _logger.info(
+            "Djomy: Payment %s received through the payment link of invoice %s",
+            djomy_transaction_ref, self.name,
+        )
+        return Transaction.create({
+            'provider_id': provider.id,
+            'payment_method_id': self.env.ref('payment_djomy.payment_method_djomy').id,
+            'reference': Transaction._compute_reference(provider.code, prefix=self.name),
+            'amount': int(
+                self.djomy_link_amount
+                or notification_data.get('paidAmount')
+                or notification_data.get('amount')
+                or self.amount_residual
+            ),
+            'currency_id': self.currency_id.id,
+            'partner_id': self.partner_id.id,
+            'provider_reference': djomy_transaction_ref,
+            'invoice_ids': [Command.set(self.ids)],
+        })
+
+    def _djomy_prepare_link_payload(self, expires_at):
+        """Return the payload of the `POST links` request creating the link of the invoice.
+
+        :param str expires_at: The expiry of the link, in ISO 8601 format.
+        :rtype: dict
+        """
+        self.ensure_one()
+        return {
+            'amountToPay': int(self.amount_residual),
+            'linkName': f'INV-{self.name}',
+            'countryCode': self.company_id.country_id.code or 'GN',
+            'description': _("Invoice %s", self.name),
+            'merchantReference': self.name,
+            'usageType': 'UNIQUE',
+            'expiresAt': expires_at,
+        }
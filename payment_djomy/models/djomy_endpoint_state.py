@@ -0,0 +1,406 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from psycopg2 import errors
+
+import odoo
+from odoo import _, fields, models
+
+from odoo.addons.payment.logging import get_payment_logger
+from odoo.addons.payment_djomy import const, metrics
+from odoo.addons.payment_djomy.utils import DjomyAPIError
+
+
+_logger = get_payment_logger(__name__)
+
+
+class DjomyEndpointState(models.Model):
+    """Health of a class of Djomy API endpoints, shared by all the workers.
+
+    Each row is the circuit breaker of a provider and endpoint class. The circuit opens after too
+    many failures in a row, so that the requests fail fast instead of tying up the HTTP workers
+    while Djomy is down, then lets a single probe request through to detect the recovery. The row
+    also holds the token bucket of the rate limiter, which spaces the requests out so that Djomy
+    does not throttle them.
+
+    The state is read from the cursor of the request, but always written in a dedicated cursor
+    committed right away, so that the other workers see it immediately and that it survives the
+    rollback of the request.
+    """
+    _name = 'djomy.endpoint.state'
+    _description = "Djomy Endpoint State"
+    _order = 'provider_id, endpoint_class'
+
+    provider_id = fields.Many2one(
+        string="Provider", comodel_name='payment.provider', required=True, readonly=True,
+        ondelete='cascade',
+    )
+    endpoint_class = fields.Char(string="Endpoint Class", required=True, readonly=True)
+    state = fields.Selection(
+        string="Circuit",
+        selection=[
+            ('closed', "Closed"),
+            ('open', "Open"),
+            ('half_open', "Half-Open"),
+        ],
+        default='closed',
+        required=True,
+        readonly=True,
+    )
+    failure_count = fields.Integer(string="Consecutive Failures", readonly=True)
+    last_failure_date = fields.Datetime(string="Last Failure", readonly=True)
+    open_until = fields.Datetime(
+        string="Open Until",
+        help="When the next probe request is let through.",
+        readonly=True,
+    )
+    tokens = fields.Float(
+        string="Available Requests",
+        help="The requests that can be sent right away, as of the last refill.",
+        readonly=True,
+    )
+    tokens_date = fields.Datetime(string="Last Refill", readonly=True)
+    throttled_until = fields.Datetime(
+        string="Throttled Until",
+        help="No request is sent before this date, as requested by Djomy.",
+        readonly=True,
+    )
+
+    def init(self):
+        super().init()
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS djomy_endpoint_state_provider_class_index
+                ON djomy_endpoint_state (provider_id, endpoint_class)
+        """)
+
+    # === ACTION METHODS === #
+
+    def action_close_circuit(self):
+        """Close the circuits manually, e.g., once Djomy confirmed an incident is over."""
+        self.write({'state': 'closed', 'failure_count': 0, 'open_until': False})
+
+    # === BUSINESS METHODS === #
+
+    @contextmanager
+    def _djomy_state_cursor(self):
+        """Yield a dedicated cursor to update the state rows, committed right away.
+
+        The cursor runs at the READ COMMITTED level, where a statement waiting for the lock of a
+        row updates the version committed by the other worker, instead of failing on a
+        serialization error as at the REPEATABLE READ level of the Odoo cursors.
+
+        :return: The cursor.
+        :rtype: odoo.sql_db.Cursor
+        """
+        with self.env.registry.cursor() as cr:
+            if not odoo.modules.module.current_test:
+                # The cursors of the tests share the transaction of the test, already started.
+                cr.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+            yield cr
+
+    def _check_circuit(self, provider, endpoint_class):
+        """Let a request through, or fail fast if the circuit is open.
+
+        When the open period is over, a single request, among all the workers, is let through as
+        the probe; the others keep failing fast until it reports back.
+
+        :param payment.provider provider: The provider sending the request.
+        :param str endpoint_class: The class of the endpoint.
+        :return: None
+        :raise DjomyAPIError: If the circuit is open.
+        """
+        self.env.cr.execute("""
+            SELECT state, open_until
+              FROM djomy_endpoint_state
+             WHERE provider_id = %s AND endpoint_class = %s
+        """, [provider.id, endpoint_class])
+        row = self.env.cr.fetchone()
+        if not row or row[0] == 'closed':
+            return
+        now = fields.Datetime.now()
+        if row[1] and row[1] <= now:
+            # Only one worker wins the probe; the row lock serializes the candidates.
+            probing = self._djomy_write_state("""
+                UPDATE djomy_endpoint_state
+                   SET state = 'half_open', open_until = %s
+                 WHERE provider_id = %s AND endpoint_class = %s
+                   AND state != 'closed' AND open_until <= %s
+             RETURNING id
+            """, [
+                now + timedelta(seconds=const.CIRCUIT_PROBE_TIMEOUT),
+                provider.id, endpoint_class, now,
+            ])
+            if probing:
+                _logger.info(
+                    "Djomy: Probing the %s endpoints of provider %s", endpoint_class, provider.id
+                )
+                return
+        raise DjomyAPIError(
+            _("Djomy is currently unavailable, please try again in a few moments."),
+            rejected=True,
+        )
+
+    def _acquire_tokens(self, provider, endpoint_class, count=1):
+        """Wait for the rate limiter to let requests through, or fail fast if it takes too long.
+
+        The requests are background ones when the context key `djomy_request_priority` is set to
+        `background`, e.g., in the crons: they leave part of the burst to the interactive requests,
+        and can wait longer for their turn. A batch may be let through only in part; the caller
+        sends the rest once it acquired more tokens.
+
+        :param payment.provider provider: The provider sending the requests.
+        :param str endpoint_class: The class of the endpoint.
+        :param int count: The number of requests to send.
+        :return: The number of requests that can be sent, between 1 and `count`.
+        :rtype: int
+        :raise DjomyAPIError: If no request can be sent within the maximum waiting time.
+        """
+        rate = float(self.env['ir.config_parameter'].sudo().get_param(
+            f'djomy.rate_limit.{endpoint_class}', const.RATE_LIMITS[endpoint_class]
+        ))
+        if rate <= 0:
+            return count
+        priority = self.env.context.get('djomy_request_priority') or 'interactive'
+        burst = max(1.0, rate * const.RATE_LIMIT_BURST)
+        if priority == 'background':
+            reserve = min(burst * const.RATE_LIMIT_INTERACTIVE_SHARE, burst - 1)
+            max_wait = const.RATE_LIMIT_MAX_WAIT_BACKGROUND
+        else:
+            reserve = 0
+            max_wait = const.RATE_LIMIT_MAX_WAIT
+        start = time.monotonic()
+        while True:
+            granted, delay = self._take_tokens(
+                provider, endpoint_class, count, reserve, rate, burst
+            )
+            if granted:
+                break
+            if time.monotonic() - start + delay > max_wait:
+                _logger.warning(
+                    "Djomy: Rate limit of the %s endpoints of provider %s reached (%s requests)",
+                    endpoint_class, provider.id, priority,
+                )
+                raise DjomyAPIError(
+                    _("Djomy is busy, please try again in a few moments."),
+                    retry_after=delay,
+                    rejected=True,
+                )
+            time.sleep(delay)
+        metrics.registry.observe(
+            'djomy_rate_limit_wait_seconds', time.monotonic() - start,
+            endpoint_class=endpoint_class, priority=priority,
+        )
+        return granted
+
+    def _take_tokens(self, provider, endpoint_class, count, reserve, rate, burst):
+        """Take up to `count` tokens from the bucket, leaving at least `reserve` tokens in it.
+
+        The bucket is refilled at `rate` tokens per second up to `burst` tokens. The refill and
+        the take are a single statement, run in a dedicated cursor committed right away, so that
+        the workers take turns on the row lock. A worker that cannot take its turn, e.g., on a
+        serialization error, is answered as if the bucket were empty and tries again a bit later.
+
+        :return: The number of tokens taken, and the delay, in seconds, before one can be taken if
+                 none was.
+        :rtype: tuple[int, float]
+        """
+        query = """
+            WITH bucket AS (
+                SELECT id, throttled_until, statement_timestamp() AT TIME ZONE 'UTC' AS now,
+                       LEAST(%(burst)s, COALESCE(
+                           tokens + EXTRACT(EPOCH FROM
+                               statement_timestamp() AT TIME ZONE 'UTC' - tokens_date
+                           ) * %(rate)s,
+                           %(burst)s
+                       )) AS tokens
+                  FROM djomy_endpoint_state
+                 WHERE provider_id = %(provider_id)s AND endpoint_class = %(class)s
+                   FOR UPDATE
+            ), take AS (
+                SELECT id, throttled_until, now, tokens,
+                       CASE
+                           WHEN throttled_until > now THEN 0
+                           ELSE GREATEST(0, LEAST(%(count)s, FLOOR(tokens - %(reserve)s)))
+                       END AS granted
+                  FROM bucket
+            )
+            UPDATE djomy_endpoint_state es
+               SET tokens = take.tokens - take.granted, tokens_date = take.now
+              FROM take
+             WHERE es.id = take.id
+         RETURNING take.granted, take.tokens, take.throttled_until, take.now
+        """
+        params = {
+            'provider_id': provider.id,
+            'class': endpoint_class,
+            'count': count,
+            'reserve': reserve,
+            'rate': rate,
+            'burst': burst,
+        }
+        try:
+            with self._djomy_state_cursor() as cr:
+                cr.execute(query, params, log_exceptions=False)
+                row = cr.fetchone()
+                if not row:
+                    cr.execute("""
+                        INSERT INTO djomy_endpoint_state (
+                            provider_id, endpoint_class, state, failure_count,
+                            create_uid, create_date, write_uid, write_date
+                        )
+                        VALUES (%(provider_id)s, %(class)s, 'closed', 0,
+                                %(uid)s, %(now)s, %(uid)s, %(now)s)
+                        ON CONFLICT (provider_id, endpoint_class) DO NOTHING
+                    """, {**params, 'now': fields.Datetime.now(), 'uid': self.env.uid})
+                    cr.execute(query, params, log_exceptions=False)
+                    row = cr.fetchone()
+        except (errors.LockNotAvailable, errors.SerializationFailure):
+            return 0, const.RATE_LIMIT_CONFLICT_DELAY
+        granted, tokens, throttled_until, now = row
+        if granted:
+            return int(granted), 0
+        if throttled_until and throttled_until > now:
+            return 0, (throttled_until - now).total_seconds()
+        return 0, (reserve + 1 - tokens) / rate
+
+    def _record_throttling(self, provider, endpoint_class, retry_after=None):
+        """Hold the requests back after Djomy answered that there were too many of them.
+
+        :param payment.provider provider: The provider that sent the request.
+        :param str endpoint_class: The class of the endpoint.
+        :param float retry_after: The `Retry-After` delay of the answer, in seconds, if any.
+        :return: None
+        """
+        if retry_after is None:
+            retry_after = const.RATE_LIMIT_DEFAULT_RETRY_AFTER
+        _logger.warning(
+            "Djomy: Requests to the %s endpoints of provider %s throttled for %s seconds",
+            endpoint_class, provider.id, retry_after,
+        )
+        self._djomy_write_state("""
+            INSERT INTO djomy_endpoint_state AS es (
+                provider_id, endpoint_class, state, failure_count,
+                tokens, tokens_date, throttled_until,
+                create_uid, create_date, write_uid, write_date
+            )
+            VALUES (%(provider_id)s, %(class)s, 'closed', 0,
+                    0, clock_timestamp() AT TIME ZONE 'UTC',
+                    clock_timestamp() AT TIME ZONE 'UTC' + make_interval(secs => %(delay)s),
+                    %(uid)s, %(now)s, %(uid)s, %(now)s)
+            ON CONFLICT (provider_id, endpoint_class) DO UPDATE
+               SET tokens = 0,
+                   tokens_date = excluded.tokens_date,
+                   throttled_until = GREATEST(es.throttled_until, excluded.throttled_until)
+        """, {
+            'provider_id': provider.id,
+            'class': endpoint_class,
+            'delay': retry_after,
+            'now': fields.Datetime.now(),
+            'uid': self.env.uid,
+        })
+
+    def _record_success(self, provider, endpoint_class):
+        """Close the circuit after a successful request.
+
+        Nothing is written while the circuit is closed and healthy, which is the common case.
+
+        :param payment.provider provider: The provider that sent the request.
+        :param str endpoint_class: The class of the endpoint.
+        :return: None
+        """
+        self.env.cr.execute("""
+            SELECT state
+              FROM djomy_endpoint_state
+             WHERE provider_id = %s AND endpoint_class = %s
+               AND (state != 'closed' OR failure_count > 0)
+        """, [provider.id, endpoint_class])
+        row = self.env.cr.fetchone()
+        if not row:
+            return
+        closed = self._djomy_write_state("""
+            UPDATE djomy_endpoint_state
+               SET state = 'closed', failure_count = 0, open_until = NULL
+             WHERE provider_id = %s AND endpoint_class = %s
+               AND (state != 'closed' OR failure_count > 0)
+         RETURNING id
+        """, [provider.id, endpoint_class])
+        if closed and row[0] != 'closed':
+            _logger.info(
+                "Djomy: Circuit of the %s endpoints of provider %s closed",
+                endpoint_class, provider.id,
+            )
+
+    def _record_failure(self, provider, endpoint_class):
+        """Count a failed request, and open the circuit if there are too many of them.
+
+        A failed probe reopens the circuit right away.
+
+        :param payment.provider provider: The provider that sent the request.
+        :param str endpoint_class: The class of the endpoint.
+        :return: None
+        """
+        now = fields.Datetime.now()
+        open_until = now + timedelta(seconds=const.CIRCUIT_OPEN_DURATION)
+        # The circuit opens in the same statement as the failure is counted, so that concurrent
+        # failures cannot both miss the threshold.
+        opened = self._djomy_write_state("""
+            INSERT INTO djomy_endpoint_state AS es (
+                provider_id, endpoint_class, state, failure_count, last_failure_date,
+                create_uid, create_date, write_uid, write_date
+            )
+            VALUES (%(provider_id)s, %(class)s, 'closed', 1, %(now)s,
+                    %(uid)s, %(now)s, %(uid)s, %(now)s)
+            ON CONFLICT (provider_id, endpoint_class) DO UPDATE
+               SET (failure_count, last_failure_date, state, open_until) = (
+                       SELECT failure.failures, %(now)s,
+                              CASE WHEN failure.opens THEN 'open' ELSE es.state END,
+                              CASE WHEN failure.opens THEN %(open_until)s ELSE es.open_until END
+                         FROM (
+                             SELECT failures, es.state = 'half_open'
+                                    OR es.state = 'closed' AND failures >= %(threshold)s AS opens
+                               FROM (
+                                   SELECT CASE
+                                       WHEN es.last_failure_date > %(window_start)s
+                                       THEN es.failure_count + 1
+                                       ELSE 1
+                                   END AS failures
+                               ) AS counted
+                         ) AS failure
+                   )
+         RETURNING es.failure_count, es.state = 'open' AND es.open_until = %(open_until)s
+        """, {
+            'provider_id': provider.id,
+            'class': endpoint_class,
+            'now': now,
+            'window_start': now - timedelta(seconds=const.CIRCUIT_FAILURE_WINDOW),
+            'threshold': const.CIRCUIT_FAILURE_THRESHOLD,
+            'open_until': open_until,
+            'uid': self.env.uid,
+        })
+        if opened and opened[1]:
+            _logger.warning(
+                "Djomy: Circuit of the %s endpoints of provider %s opened after %s failures",
+                endpoint_class, provider.id, opened[0],
+            )
+
+    def _djomy_write_state(self, query, params):
+        """Run a statement updating the state rows in a dedicated cursor committed right away.
+
+        The bookkeeping of the circuit must never make the request fail: the statement is given
+        up if it conflicts with another worker, which records the health of Djomy just as well.
+
+        :param str query: The statement to run.
+        :param list|dict params: The parameters of the statement.
+        :return: The first row returned by the statement, if any.
+        :rtype: tuple|None
+        """
+        try:
+            with self._djomy_state_cursor() as cr:
+                cr.execute(query, params, log_exceptions=False)
+                return cr.fetchone() if cr.description else None
+        except (errors.LockNotAvailable, errors.SerializationFailure) as error:
+            _logger.info("Djomy: Endpoint state update given up on conflict: %s", error)
+            return None
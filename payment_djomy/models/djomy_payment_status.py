@@ -0,0 +1,96 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import json
+from datetime import timedelta
+
+from psycopg2 import errors
+
+from odoo import api, fields, models
+
+
+class DjomyPaymentStatus(models.Model):
+    """Last status of a Djomy payment, fetched by any worker and shared by all of them.
+
+    The table backs the in-memory status cache of each worker, so that the webhook, the return URL
+    and the POS polls of a same payment share the status fetched by the first of them even when
+    they are served by different workers. A status is written in a dedicated cursor committed
+    right away, so that the other workers see it immediately and that it survives the rollback of
+    the request.
+    """
+    _name = 'djomy.payment.status'
+    _description = "Djomy Payment Status"
+    _log_access = False
+
+    provider_id = fields.Many2one(
+        string="Provider", comodel_name='payment.provider', required=True, readonly=True,
+        ondelete='cascade',
+    )
+    djomy_transaction_ref = fields.Char(string="Djomy Transaction ID", required=True, readonly=True)
+    status_data = fields.Json(string="Status Data", readonly=True)
+    expiry_date = fields.Datetime(string="Expires On", required=True, readonly=True)
+
+    def init(self):
+        super().init()
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS djomy_payment_status_provider_ref_index
+                ON djomy_payment_status (provider_id, djomy_transaction_ref)
+        """)
+
+    # === BUSINESS METHODS === #
+
+    @api.model
+    def _get_status(self, provider, djomy_transaction_ref):
+        """Return the status data of a payment stored by any worker, if still valid.
+
+        :param payment.provider provider: The provider of the payment.
+        :param str djomy_transaction_ref: The Djomy transaction ID of the payment.
+        :return: The status data, or None.
+        :rtype: dict
+        """
+        self.env.cr.execute("""
+            SELECT status_data
+              FROM djomy_payment_status
+             WHERE provider_id = %s AND djomy_transaction_ref = %s AND expiry_date > %s
+        """, [provider.id, djomy_transaction_ref, fields.Datetime.now()])
+        row = self.env.cr.fetchone()
+        return row and row[0]
+
+    @api.model
+    def _set_status(self, provider, djomy_transaction_ref, status_data, ttl):
+        """Share the status data of a payment with the other workers for the given lifetime.
+
+        A status never replaces one that is kept longer, i.e., a final status fetched by another
+        worker in the meantime. The write is given up if it conflicts with another worker, which
+        stores a status at least as recent.
+
+        :param payment.provider provider: The provider of the payment.
+        :param str djomy_transaction_ref: The Djomy transaction ID of the payment.
+        :param dict status_data: The status data.
+        :param float ttl: The lifetime of the status, in seconds.
+        :return: None
+        """
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute("""
+                    INSERT INTO djomy_payment_status AS ps (
+                        provider_id, djomy_transaction_ref, status_data, expiry_date
+                    )
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (provider_id, djomy_transaction_ref) DO UPDATE
+                       SET status_data = excluded.status_data, expiry_date = excluded.expiry_date
+                     WHERE ps.expiry_date <= excluded.expiry_date
+                """, [
+                    provider.id,
+                    djomy_transaction_ref,
+                    json.dumps(status_data),
+                    fields.Datetime.now() + timedelta(seconds=ttl),
+                ], log_exceptions=False)
+        except (errors.LockNotAvailable, errors.SerializationFailure):
+            pass
+
+    @api.autovacuum
+    def _gc_expired_statuses(self):
+        """Delete the statuses no longer valid."""
+        self.env.cr.execute(
+            "DELETE FROM djomy_payment_status WHERE expiry_date <= %s", [fields.Datetime.now()]
+        )
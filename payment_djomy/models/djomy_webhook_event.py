@@ -0,0 +1,304 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from odoo import api, fields, models, tools
+
+from odoo.addons.payment.logging import get_payment_logger
+from odoo.addons.payment_djomy import const, metrics
+
+
+_logger = get_payment_logger(__name__)
+
+
+class DjomyWebhookEvent(models.Model):
+    """Inbox of the webhook notifications received from Djomy.
+
+    The webhook only verifies the signature and inserts the raw notification before acknowledging
+    it; the cron then processes the inbox in batches. An event is marked as processed in the same
+    transaction as its processing, so the events of a crashed run are simply processed again by
+    the next one.
+
+    The inbox doubles as an idempotency index: the exact duplicates of an event already received
+    are dropped on insertion, before any call to Djomy, and the events of a same transaction
+    received close together are merged so that only the latest one is processed.
+
+    An event is about a transaction or, for the payments made through a payment link that has no
+    transaction (e.g., from the POS), about the record of the link.
+    """
+    _name = 'djomy.webhook.event'
+    _description = "Djomy Webhook Event"
+    _order = 'id desc'
+
+    provider_id = fields.Many2one(
+        string="Provider", comodel_name='payment.provider', required=True, readonly=True,
+        ondelete='cascade',
+    )
+    transaction_id = fields.Many2one(
+        string="Transaction", comodel_name='payment.transaction', readonly=True, index=True,
+        ondelete='cascade',
+    )
+    link_model = fields.Char(string="Payment Link Model", readonly=True)
+    link_id = fields.Many2oneReference(
+        string="Payment Link", model_field='link_model', readonly=True,
+    )
+    djomy_transaction_ref = fields.Char(string="Djomy Transaction ID", readonly=True)
+    event_type = fields.Char(string="Event Type", readonly=True)
+    payload = fields.Text(string="Payload", required=True, readonly=True)
+    payload_hash = fields.Char(string="Payload Hash", readonly=True)
+    state = fields.Selection(
+        string="Status",
+        selection=[
+            ('pending', "Pending"),
+            ('done', "Processed"),
+            ('merged', "Merged"),
+            ('error', "Error"),
+        ],
+        default='pending',
+        required=True,
+        readonly=True,
+    )
+    attempts = fields.Integer(string="Attempts", readonly=True)
+    next_attempt_date = fields.Datetime(string="Next Attempt", readonly=True)
+    processed_date = fields.Datetime(string="Processed On", readonly=True)
+    error = fields.Text(string="Error", readonly=True)
+
+    def init(self):
+        super().init()
+        # The cron only ever looks for the pending events.
+        tools.create_index(
+            self.env.cr,
+            'djomy_webhook_event_pending_index',
+            self._table,
+            ['next_attempt_date', 'id'],
+            where="state = 'pending'",
+        )
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS djomy_webhook_event_dedup_index
+                ON djomy_webhook_event (djomy_transaction_ref, event_type, payload_hash)
+        """)
+
+    # === ACTION METHODS === #
+
+    def action_replay(self):
+        """Process the events again."""
+        self.write({
+            'state': 'pending',
+            'attempts': 0,
+            'next_attempt_date': False,
+            'error': False,
+        })
+        self.env.ref('payment_djomy.cron_process_webhook_events')._trigger()
+
+    # === BUSINESS METHODS === #
+
+    @api.model
+    def _enqueue(self, record, data, raw_body, process_async=True):
+        """Store a verified notification in the inbox, unless it is a duplicate.
+
+        The event is inserted in SQL with `ON CONFLICT DO NOTHING` on the idempotency index, so
+        that concurrent deliveries of the same notification never both get through.
+
+        :param record: The transaction the notification is about, or the payment link, as returned
+                       by `payment.transaction._djomy_search_payment_link`.
+        :param dict data: The notification data.
+        :param bytes raw_body: The notification body, as received.
+        :param bool process_async: Whether to wake up the cron to process the event. The cron is
+                                   woken up with a short delay to merge the events that follow.
+        :return: The created event, or an empty recordset if it is a duplicate.
+        :rtype: djomy.webhook.event
+        """
+        is_transaction = record._name == 'payment.transaction'
+        djomy_transaction_ref = (
+            data.get('transactionId')
+            or data.get('data', {}).get('transactionId')
+            or is_transaction and record.provider_reference
+            or record.display_name
+        )
+        self.env.cr.execute("""
+            INSERT INTO djomy_webhook_event (
+                provider_id, transaction_id, link_model, link_id, djomy_transaction_ref,
+                event_type, payload, payload_hash, state, attempts,
+                create_uid, create_date, write_uid, write_date
+            )
+            VALUES (
+                %(provider_id)s, %(transaction_id)s, %(link_model)s, %(link_id)s,
+                %(djomy_transaction_ref)s, %(event_type)s, %(payload)s, %(payload_hash)s,
+                'pending', 0, %(uid)s, %(now)s, %(uid)s, %(now)s
+            )
+            ON CONFLICT (djomy_transaction_ref, event_type, payload_hash) DO NOTHING
+            RETURNING id
+        """, {
+            'provider_id': record.provider_id.id,
+            'transaction_id': record.id if is_transaction else None,
+            'link_model': None if is_transaction else record._name,
+            'link_id': None if is_transaction else record.id,
+            'djomy_transaction_ref': djomy_transaction_ref,
+            'event_type': data.get('eventType'),
+            'payload': raw_body.decode('utf-8'),
+            'payload_hash': hashlib.sha256(raw_body).hexdigest(),
+            'uid': self.env.uid,
+            'now': fields.Datetime.now(),
+        })
+        row = self.env.cr.fetchone()
+        if not row:
+            _logger.info(
+                "Djomy: Dropped duplicate %s notification for transaction %s",
+                data.get('eventType'), djomy_transaction_ref,
+            )
+            return self.browse()
+        if process_async:
+            self.env.ref('payment_djomy.cron_process_webhook_events')._trigger(
+                fields.Datetime.now() + timedelta(seconds=const.WEBHOOK_COALESCE_DELAY)
+            )
+        return self.browse(row[0])
+
+    @api.model
+    def _cron_process_pending_events(self):
+        """Process the pending events in batches, oldest first.
+
+        The events are claimed in batches with `SKIP LOCKED`, by moving their next attempt
+        WEBHOOK_CLAIM_DELAY seconds ahead, and the claim is committed right away. Each event is
+        then committed once processed, so that the lock taken on its transaction is released
+        before the next one is processed. Concurrent runs never process the same events, and the
+        events of a crashed run are processed again once the claim expires. The cron stops after a
+        time budget and reschedules itself if events are left.
+        """
+        self = self.with_context(djomy_request_priority='background')
+        start = time.monotonic()
+        while True:
+            self.flush_model(['state', 'next_attempt_date'])
+            now = fields.Datetime.now()
+            self.env.cr.execute("""
+                UPDATE djomy_webhook_event
+                   SET next_attempt_date = %s
+                 WHERE id IN (
+                        SELECT id
+                          FROM djomy_webhook_event
+                         WHERE state = 'pending'
+                           AND (next_attempt_date IS NULL OR next_attempt_date <= %s)
+                         ORDER BY id
+                         LIMIT %s
+                           FOR UPDATE SKIP LOCKED
+                       )
+             RETURNING id
+            """, [
+                now + timedelta(seconds=const.WEBHOOK_CLAIM_DELAY),
+                now,
+                const.WEBHOOK_BATCH_SIZE,
+            ])
+            events = self.browse(row[0] for row in self.env.cr.fetchall())
+            if not events:
+                return
+            events.invalidate_recordset(['next_attempt_date'])
+            events = events._merge()
+            self.env['payment.transaction']._djomy_commit_progress()
+            for event in events.sorted('id'):
+                event._process()
+                self.env['payment.transaction']._djomy_commit_progress()
+            if time.monotonic() - start > const.WEBHOOK_TIME_BUDGET:
+                self.env.ref('payment_djomy.cron_process_webhook_events')._trigger()
+                return
+
+    def _merge(self):
+        """Keep only the latest event of each transaction or link and mark the others as merged.
+
+        Processing an event re-fetches the official status of the transaction from Djomy, so the
+        latest event makes the previous ones pointless. The events of a final status are preferred
+        over the pending ones, which Djomy may deliver out of order, so that the merged
+        notification never accepts a cached pending status.
+
+        :return: The events to process.
+        :rtype: djomy.webhook.event
+        """
+        latest_events = self.browse()
+        for tx_events in self.grouped(
+            lambda e: (e.transaction_id, e.link_model, e.link_id)
+        ).values():
+            final_events = tx_events.filtered(
+                lambda e: e.event_type in const.WEBHOOK_FINAL_EVENT_TYPES
+            )
+            latest_event = (final_events or tx_events).sorted('id')[-1]
+            latest_events |= latest_event
+            (tx_events - latest_event).write({
+                'state': 'merged',
+                'processed_date': fields.Datetime.now(),
+            })
+        return latest_events
+
+    def _process(self):
+        """Process the events in order and record their outcome.
+
+        An event whose processing failed is retried later with an exponential back-off, until it
+        reaches the maximum number of attempts.
+        """
+        for event in self.sorted('id'):
+            attempts = event.attempts + 1
+            try:
+                with self.env.cr.savepoint():
+                    error_reason = event._get_notified_record()._djomy_process_notification(
+                        json.loads(event.payload)
+                    )
+            except Exception as error:
+                _logger.exception("Djomy: Could not process webhook event %s", event.id)
+                error_reason = str(error)
+
+            if not error_reason:
+                processed_date = fields.Datetime.now()
+                event.write({
+                    'state': 'done',
+                    'attempts': attempts,
+                    'processed_date': processed_date,
+                    'error': False,
+                })
+                metrics.registry.observe(
+                    'djomy_webhook_event_latency_seconds',
+                    (processed_date - event.create_date).total_seconds(),
+                )
+            elif attempts >= const.WEBHOOK_MAX_ATTEMPTS:
+                event.write({'state': 'error', 'attempts': attempts, 'error': error_reason})
+            elif error_reason == 'locked':
+                # Another request is updating the transaction, possibly with an older status: the
+                # event is processed again as soon as the lock is likely released.
+                next_attempt_date = fields.Datetime.now() + timedelta(
+                    seconds=const.WEBHOOK_LOCKED_RETRY_DELAY
+                )
+                event.write({
+                    'attempts': attempts,
+                    'next_attempt_date': next_attempt_date,
+                    'error': error_reason,
+                })
+                self.env.ref('payment_djomy.cron_process_webhook_events')._trigger(
+                    next_attempt_date
+                )
+            else:
+                event.write({
+                    'attempts': attempts,
+                    'next_attempt_date': fields.Datetime.now() + timedelta(
+                        seconds=const.WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1)
+                    ),
+                    'error': error_reason,
+                })
+
+    def _get_notified_record(self):
+        """Return the transaction or the payment link the event is about.
+
+        Note: self.ensure_one()
+        """
+        self.ensure_one()
+        if self.link_model:
+            return self.env[self.link_model].browse(self.link_id)
+        return self.transaction_id
+
+    @api.autovacuum
+    def _gc_processed_events(self):
+        """Delete the processed events older than the retention period."""
+        self.search([
+            ('state', 'in', ('done', 'merged')),
+            ('processed_date', '<', fields.Datetime.now() - timedelta(
+                days=const.WEBHOOK_RETENTION_DAYS
+            )),
+        ]).unlink()
@@ -1,19 +1,56 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import csv
 import hmac
 import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+
 import requests
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
+from odoo.tools import frozendict, split_every
 from odoo.tools.urls import urljoin as url_join
 
 from odoo.addons.payment.logging import get_payment_logger
-from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy import const, metrics, payload_log
+from odoo.addons.payment_djomy.utils import (
+    DjomyAPIError,
+    SingleFlightCache,
+    is_throttled,
+    is_transient_failure,
+    parse_retry_after,
+)
 
 
 _logger = get_payment_logger(__name__)
 
+# Per-process cache of the Djomy access tokens, shared by all the threads of a
+# worker: {(dbname, provider_id): (access_token, expiry_timestamp)}.
+_access_tokens = {}
+# Per-process locks serializing the refreshes of each token, so that a slow refresh only holds up
+# the threads waiting for the same token: {(dbname, provider_id): Lock}.
+_access_token_locks = {}
+_access_token_locks_lock = threading.Lock()
+
+# Per-process cache of the payment statuses, in front of the `djomy.payment.status` table shared by
+# all the workers: {(dbname, provider_id, transaction_id): status_data}.
+_status_cache = SingleFlightCache(const.STATUS_CACHE_SIZE)
+
+# Per-process pool of persistent HTTP sessions, one per provider so that the connections (and their
+# TLS handshake) are reused across requests: {(dbname, provider_id): (fingerprint, session)}.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+metrics.registry.register_collector(lambda: [
+    ('djomy_status_cache_requests_total', {'result': result}, count)
+    for result, count in _status_cache.get_stats().items() if result != 'size'
+])
+
 
 class PaymentProvider(models.Model):
     _inherit = 'payment.provider'
@@ -38,6 +75,11 @@ class PaymentProvider(models.Model):
         copy=False,
         groups='base.group_system',
     )
+    djomy_access_token_expiry = fields.Datetime(
+        string="Djomy Access Token Expiry",
+        copy=False,
+        groups='base.group_system',
+    )
     djomy_partner_domain = fields.Char(
         string="Partner Domain",
         help="Your domain registered and validated by Djomy. Optional in Test mode, required in Production.",
@@ -75,6 +117,43 @@ class PaymentProvider(models.Model):
 
     # === CRUD METHODS === #
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Override of `base` to drop the cached provider resolution."""
+        providers = super().create(vals_list)
+        if any(provider.code == 'djomy' for provider in providers):
+            self.env.registry.clear_cache()
+        return providers
+
+    def write(self, vals):
+        """Override of `base` to drop the cached access tokens and request context when the
+        provider changes."""
+        djomy_before = any(provider.code == 'djomy' for provider in self)
+        res = super().write(vals)
+        if const.REQUEST_CONTEXT_FIELDS & vals.keys() and (
+            djomy_before or any(provider.code == 'djomy' for provider in self)
+        ):
+            self.env.registry.clear_cache()
+        if {'state', 'djomy_client_id', 'djomy_client_secret'} & vals.keys():
+            djomy_providers = self.filtered(lambda p: p.code == 'djomy')
+            if djomy_providers and 'djomy_access_token' not in vals:
+                djomy_providers.sudo().write({
+                    'djomy_access_token': False,
+                    'djomy_access_token_expiry': False,
+                })
+            djomy_providers._djomy_clear_access_token_cache()
+            djomy_providers._djomy_drop_session()
+        return res
+
+    def unlink(self):
+        """Override of `base` to drop the cached provider resolution."""
+        djomy_providers = self.filtered(lambda p: p.code == 'djomy')
+        djomy_providers._djomy_drop_session()
+        res = super().unlink()
+        if djomy_providers:
+            self.env.registry.clear_cache()
+        return res
+
     def _get_default_payment_method_codes(self):
         """Override of `payment` to return the default payment method codes."""
         self.ensure_one()
@@ -84,6 +163,39 @@ class PaymentProvider(models.Model):
 
     # === BUSINESS METHODS === #
 
+    @api.model
+    @tools.ormcache('company_id')
+    def _djomy_get_provider_id(self, company_id):
+        """Return the id of the Djomy provider of a company, resolved once per worker.
+
+        The cache is cleared when a Djomy provider is created, modified or deleted.
+
+        :param int company_id: The company, as an id.
+        :return: The id of the provider, or `False` if the company has none.
+        :rtype: int
+        """
+        return self.sudo().search([
+            ('code', '=', 'djomy'),
+            ('company_id', '=', company_id),
+        ], limit=1).id
+
+    @tools.ormcache('self.id')
+    def _djomy_get_request_context(self):
+        """Return the static part of the API requests, computed once per worker.
+
+        The cache is cleared when a Djomy provider is created, modified or deleted.
+
+        :return: The `api_url`, the `api_key` signature header and the `partner_domain`.
+        :rtype: frozendict
+        """
+        self.ensure_one()
+        provider = self.sudo()
+        return frozendict({
+            'api_url': provider._djomy_get_api_url(),
+            'api_key': provider._djomy_generate_signature(),
+            'partner_domain': provider.djomy_partner_domain or False,
+        })
+
     def _djomy_get_api_url(self):
         """Return the API URL based on the provider state."""
         self.ensure_one()
@@ -101,60 +213,651 @@ class PaymentProvider(models.Model):
         ).hexdigest()
         return f"{self.djomy_client_id}:{signature}"
 
-    def _djomy_fetch_access_token(self):
-        """Fetch a new access token from Djomy API."""
+    def _djomy_get_access_token(self):
+        """Return a valid access token, refreshing it ahead of its expiry.
+
+        The token is served from the per-process cache without any query. When it is missing or
+        about to expire, `_djomy_fetch_access_token` takes care of the refresh.
+
+        :return: The access token.
+        :rtype: str
+        """
+        self.ensure_one()
+        cached_token = _access_tokens.get((self.env.cr.dbname, self.id))
+        if cached_token and _djomy_is_token_valid(cached_token[1]):
+            metrics.registry.inc('djomy_access_token_requests_total', result='cached')
+            return cached_token[0]
+        return self._djomy_fetch_access_token()
+
+    def _djomy_fetch_access_token(self, stale_token=None):
+        """Fetch a new access token from Djomy API, unless another worker already did.
+
+        The refresh is serialized across workers with a PostgreSQL advisory lock held on a
+        dedicated connection, and the token is committed before the lock is released. The workers
+        waiting on the lock then read the provider row in a new snapshot, find the fresh token and
+        reuse it instead of calling `auth` themselves. The write is done in SQL to not conflict with the ORM cache of the request.
+
+        :param str stale_token: A token rejected by Djomy, which must be replaced even though it is
+                                not expired yet.
+        :return: The access token.
+        :rtype: str
+        """
         self.ensure_one()
-        # Clear existing token before fetching new one
-        self.djomy_access_token = False
-        response = self._send_api_request(
-            'POST', 'auth', json={}, skip_auth=True
+        key = (self.env.cr.dbname, self.id)
+        with _access_token_locks_lock:
+            refresh_lock = _access_token_locks.setdefault(key, threading.Lock())
+        with refresh_lock:
+            # Another thread of this worker may have refreshed the token while this one waited.
+            cached_token = _access_tokens.get(key)
+            if (
+                cached_token
+                and cached_token[0] != stale_token
+                and _djomy_is_token_valid(cached_token[1])
+            ):
+                return cached_token[0]
+
+            with self.env.registry.cursor() as cr:
+                # The cursors run at REPEATABLE READ, with a snapshot taken when the statement
+                # waiting on the lock starts: the lock is held at session level and the transaction
+                # is committed once it is acquired, so that the token row is read in a snapshot that
+                # includes the token stored by the worker that held the lock before.
+                cr.execute(
+                    "SELECT pg_advisory_lock(%s, %s)", [const.ADVISORY_LOCK_TOKEN_REFRESH, self.id]
+                )
+                try:
+                    cr.commit()
+                    access_token, expiry_timestamp = self._djomy_refresh_stored_token(
+                        cr, stale_token
+                    )
+                    cr.commit()
+                finally:
+                    cr.rollback()
+                    cr.execute(
+                        "SELECT pg_advisory_unlock(%s, %s)",
+                        [const.ADVISORY_LOCK_TOKEN_REFRESH, self.id],
+                    )
+            _access_tokens[key] = (access_token, expiry_timestamp)
+        return access_token
+
+    def _djomy_refresh_stored_token(self, cr, stale_token):
+        """Return the access token stored on the provider, fetching a new one if it is not valid.
+
+        :param odoo.sql_db.Cursor cr: The dedicated cursor holding the refresh lock.
+        :param str stale_token: A token rejected by Djomy, which must be replaced.
+        :return: The access token and its expiry, as a timestamp.
+        :rtype: tuple
+        """
+        cr.execute(
+            "SELECT djomy_access_token, djomy_access_token_expiry"
+            " FROM payment_provider WHERE id = %s",
+            [self.id],
         )
+        access_token, expiry = cr.fetchone()
+        expiry_timestamp = expiry and expiry.replace(tzinfo=timezone.utc).timestamp()
+        if (
+            access_token
+            and access_token != stale_token
+            and _djomy_is_token_valid(expiry_timestamp)
+        ):
+            # Another worker refreshed the token meanwhile.
+            metrics.registry.inc('djomy_access_token_requests_total', result='reused')
+            return access_token, expiry_timestamp
+
+        _logger.info("Djomy: Refreshing the access token of provider %s", self.id)
+        metrics.registry.inc('djomy_access_token_requests_total', result='refreshed')
+        response = self._send_api_request('POST', 'auth', json={}, skip_auth=True)
         # _parse_response_content already extracts 'data' from the response
-        self.djomy_access_token = response.get('accessToken')
-        return self.djomy_access_token
+        access_token = response.get('accessToken')
+        lifetime = int(response.get('expiresIn') or const.ACCESS_TOKEN_DEFAULT_LIFETIME)
+        expiry_timestamp = time.time() + lifetime
+        cr.execute(
+            "UPDATE payment_provider"
+            " SET djomy_access_token = %s, djomy_access_token_expiry = %s"
+            " WHERE id = %s",
+            [
+                access_token,
+                datetime.fromtimestamp(expiry_timestamp, timezone.utc).replace(tzinfo=None),
+                self.id,
+            ],
+        )
+        return access_token, expiry_timestamp
+
+    def _djomy_clear_access_token_cache(self):
+        """Remove the access tokens of the providers from the per-process cache."""
+        for provider in self:
+            _access_tokens.pop((self.env.cr.dbname, provider.id), None)
 
     def _djomy_send_request_with_retry(self, method, endpoint, **kwargs):
         """Send API request with automatic token refresh on auth failure.
 
-        If the request fails due to an expired/invalid token (401 or token error),
-        the token is refreshed and the request is retried once.
+        If the request fails due to an expired/invalid token (HTTP 401),
+        the token is refreshed and the request is retried once. If Djomy
+        throttled the request (HTTP 429), it is retried once, when the rate
+        limiter lets it through again after the `Retry-After` delay.
         """
         self.ensure_one()
         try:
             return self._send_api_request(method, endpoint, **kwargs)
-        except Exception as e:
-            error_msg = str(e).lower()
-            # Check if it's an authentication error
-            if '401' in error_msg or 'token' in error_msg or 'unauthorized' in error_msg:
-                _logger.info("Djomy: Token expired or invalid, refreshing...")
-                self._djomy_fetch_access_token()
-                # Retry the request with new token
+        except DjomyAPIError as error:
+            if error.is_throttled:
+                _logger.info("Djomy: Request to %s throttled, retrying...", endpoint)
                 return self._send_api_request(method, endpoint, **kwargs)
-            raise
+            if not error.is_auth_error:
+                raise
+            _logger.info("Djomy: Token expired or invalid, refreshing...")
+            cached_token = _access_tokens.get((self.env.cr.dbname, self.id))
+            self._djomy_fetch_access_token(stale_token=cached_token and cached_token[0])
+            # Retry the request with new token
+            return self._send_api_request(method, endpoint, **kwargs)
+
+    def _djomy_fetch_payment_status(self, transaction_id, allow_pending=True):
+        """Return the status data of a payment, from the status caches when possible.
+
+        The status is looked up in the cache of the worker, then in the `djomy.payment.status`
+        table shared by all the workers, and only fetched from Djomy when neither has it.
+        Concurrent lookups of a same payment within a worker share a single request to Djomy. The
+        status is cached for long when final and for a few seconds when pending.
+
+        :param str transaction_id: The Djomy transaction ID of the payment.
+        :param bool allow_pending: Whether a cached pending status can be returned. Callers told
+                                   that the payment reached a final status should refuse it.
+        :return: The status data, as returned by `GET payments/{transaction_id}/status`.
+        :rtype: dict
+        """
+        self.ensure_one()
+        status_data = _status_cache.get_or_compute(
+            (self.env.cr.dbname, self.id, transaction_id),
+            lambda: self._djomy_fetch_shared_payment_status(transaction_id, allow_pending),
+            _djomy_get_status_ttl,
+            is_usable=None if allow_pending else _djomy_is_status_final,
+            timeout=2 * const.HTTP_TIMEOUT,
+        )
+        return dict(status_data)
+
+    def _djomy_fetch_shared_payment_status(self, transaction_id, allow_pending):
+        """Return the status data of a payment stored by any worker, or fetch and store it."""
+        PaymentStatus = self.env['djomy.payment.status'].sudo()
+        status_data = PaymentStatus._get_status(self, transaction_id)
+        if status_data and (allow_pending or _djomy_is_status_final(status_data)):
+            return status_data
+        status_data = self._djomy_send_request_with_retry(
+            'GET', f'payments/{transaction_id}/status'
+        )
+        PaymentStatus._set_status(
+            self, transaction_id, status_data, _djomy_get_status_ttl(status_data)
+        )
+        return status_data
+
+    def _djomy_cache_payment_status(self, transaction_id, status_data):
+        """Store a status fetched outside of `_djomy_fetch_payment_status` in the caches."""
+        self.ensure_one()
+        ttl = _djomy_get_status_ttl(status_data)
+        _status_cache.set((self.env.cr.dbname, self.id, transaction_id), status_data, ttl)
+        self.env['djomy.payment.status'].sudo()._set_status(self, transaction_id, status_data, ttl)
+
+    @api.model
+    def _djomy_get_status_cache_stats(self):
+        """Return the hit and miss counters of the status cache of the current worker."""
+        return _status_cache.get_stats()
+
+    def _djomy_get_recent_payloads(self, redacted=True):
+        """Return the last payloads received for this provider by the current worker.
+
+        :param bool redacted: Whether the personal data of the payloads are masked.
+        :return: The payloads, most recent first, as `(timestamp, source, payload)` tuples.
+        :rtype: list
+        """
+        self.ensure_one()
+        payloads = payload_log.get_recent_payloads(self.env.cr.dbname, self.id)
+        if redacted:
+            payloads = [(ts, source, payload_log.redact(data)) for ts, source, data in payloads]
+        return payloads
+
+    def _djomy_fetch_link_statuses(self, payment_link_references):
+        """Fetch the status of many payment links concurrently.
+
+        :param list payment_link_references: The references of the payment links.
+        :return: The response of `GET links/{reference}`, or the exception it raised, by reference.
+        :rtype: dict
+        """
+        self.ensure_one()
+        return self._djomy_send_concurrent_requests({
+            reference: ('GET', f'links/{reference}', None)
+            for reference in set(payment_link_references)
+        }, const.LINK_STATUS_MAX_WORKERS)
+
+    def _djomy_send_concurrent_requests(self, requests_by_key, max_workers):
+        """Send many API requests concurrently through the persistent HTTP session.
+
+        The URLs and headers, access token included, are resolved upfront so that the worker
+        threads only do HTTP and never touch the cursor, which is not thread-safe.
+
+        :param dict requests_by_key: The requests to send, as `{key: (method, endpoint, payload)}`.
+        :param int max_workers: The maximum number of requests in flight at once.
+        :return: The response data of each request, or the exception it raised, by key.
+        :rtype: dict
+        """
+        self.ensure_one()
+        keys_by_class = {}
+        for key, (_method, endpoint, _payload) in requests_by_key.items():
+            keys_by_class.setdefault(_djomy_get_endpoint_class(endpoint), []).append(key)
+        EndpointState = self.env['djomy.endpoint.state'].sudo()
+        try:
+            for endpoint_class in keys_by_class:
+                EndpointState._check_circuit(self, endpoint_class)
+        except DjomyAPIError as error:
+            self._djomy_reject_requests(requests_by_key)
+            return dict.fromkeys(requests_by_key, error)
+
+        session = self._djomy_get_session()
+        try:
+            prepared_requests = {
+                key: (
+                    method,
+                    self._build_request_url(endpoint),
+                    self._build_request_headers(method, endpoint, payload),
+                    payload,
+                    _djomy_get_endpoint_label(endpoint),
+                    self._djomy_get_timeout(_djomy_get_endpoint_class(endpoint)),
+                )
+                for key, (method, endpoint, payload) in requests_by_key.items()
+            }
+        except ValidationError as error:
+            # The access token could not be fetched: none of the requests is sent, and the callers
+            # retry them later as for the other rejections.
+            _logger.warning("Djomy: Could not authenticate the requests: %s", error)
+            self._djomy_reject_requests(requests_by_key)
+            rejection = DjomyAPIError(str(error), rejected=True)
+            return dict.fromkeys(requests_by_key, rejection)
+        results = {}
+        sent_keys_by_class = {}
+        max_workers = max(1, min(max_workers, len(prepared_requests)))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # The requests are sent in waves, as the rate limiter lets them through and within the
+            # free slots of the bulkhead, each request holding its slot until the wave completes.
+            # The requests rejected by either are not sent at all.
+            for endpoint_class, keys in keys_by_class.items():
+                while keys:
+                    with ExitStack() as bulkhead:
+                        try:
+                            granted = EndpointState._acquire_tokens(
+                                self, endpoint_class, min(len(keys), max_workers)
+                            )
+                            taken = bulkhead.enter_context(
+                                self._djomy_hold_bulkhead_slots(endpoint_class, granted)
+                            )
+                        except DjomyAPIError as error:
+                            rejected = {key: requests_by_key[key] for key in keys}
+                            self._djomy_reject_requests(rejected)
+                            results.update(dict.fromkeys(rejected, error))
+                            break
+                        wave, keys = keys[:taken], keys[taken:]
+                        futures = {
+                            key: pool.submit(
+                                _djomy_request_in_thread, session, *prepared_requests[key]
+                            )
+                            for key in wave
+                        }
+                        for key, future in futures.items():
+                            try:
+                                results[key] = future.result()
+                            except (requests.exceptions.RequestException, ValueError) as error:
+                                _logger.warning("Djomy: Request %s failed: %s", key, error)
+                                results[key] = error
+                    sent_keys_by_class.setdefault(endpoint_class, []).extend(wave)
+
+        for endpoint_class, keys in sent_keys_by_class.items():
+            errors = [results[key] for key in keys if isinstance(results[key], Exception)]
+            throttled_errors = [error for error in errors if is_throttled(error)]
+            if throttled_errors:
+                retry_after = max(
+                    parse_retry_after(error.response) or 0 for error in throttled_errors
+                )
+                EndpointState._record_throttling(self, endpoint_class, retry_after or None)
+            # The batch counts as a single request for the circuit breaker: it only fails if no
+            # request of the batch got an answer from Djomy.
+            if len(errors) == len(keys) and all(is_transient_failure(error) for error in errors):
+                EndpointState._record_failure(self, endpoint_class)
+            else:
+                EndpointState._record_success(self, endpoint_class)
+        return results
+
+    def _djomy_get_timeout(self, endpoint_class):
+        """Return the connect and read timeouts of the requests to an endpoint class.
+
+        The timeouts can be overridden with the `djomy.timeout.<class>` system parameter, as
+        `<connect>,<read>` in seconds.
+
+        :param str endpoint_class: The class of the endpoint.
+        :return: The connect and read timeouts, in seconds.
+        :rtype: tuple[float, float]
+        """
+        timeouts = self.env['ir.config_parameter'].sudo().get_param(
+            f'djomy.timeout.{endpoint_class}'
+        )
+        if timeouts:
+            try:
+                connect_timeout, read_timeout = (float(timeout) for timeout in timeouts.split(','))
+                return connect_timeout, read_timeout
+            except ValueError:
+                _logger.warning(
+                    "Djomy: Invalid timeouts %r for the %s endpoints", timeouts, endpoint_class
+                )
+        return const.HTTP_TIMEOUTS[endpoint_class]
+
+    def _djomy_reject_requests(self, requests_by_key):
+        """Count the requests rejected without being sent, e.g., while the circuit is open."""
+        for _method, endpoint, _payload in requests_by_key.values():
+            metrics.registry.inc(
+                'djomy_api_requests_total',
+                endpoint=_djomy_get_endpoint_label(endpoint),
+                status='rejected',
+            )
+
+    def _djomy_get_session(self):
+        """Return the persistent HTTP session of the provider for the current worker.
+
+        The session is rebuilt when the provider is modified (state, credentials...) or when the
+        pool size configured with the `djomy.http_pool_size` system parameter changes. The previous
+        session is only dropped, as requests of other threads may still be using it.
+
+        :return: The HTTP session.
+        :rtype: requests.Session
+        """
+        self.ensure_one()
+        pool_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            'djomy.http_pool_size', const.HTTP_POOL_SIZE
+        ))
+        key = (self.env.cr.dbname, self.id)
+        fingerprint = (self._djomy_get_api_url(), self.write_date, pool_size)
+        cached_session = _sessions.get(key)
+        if cached_session and cached_session[0] == fingerprint:
+            return cached_session[1]
+
+        with _sessions_lock:
+            cached_session = _sessions.get(key)
+            if cached_session and cached_session[0] == fingerprint:
+                return cached_session[1]
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size, max_retries=0
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[key] = (fingerprint, session)
+        return session
+
+    def _djomy_drop_session(self):
+        """Drop the HTTP sessions of the providers in the current worker.
+
+        The sessions are not closed: another thread may still be sending a request through them.
+        Their connections are closed once the last request releases them and they are
+        garbage-collected.
+        """
+        for provider in self:
+            _sessions.pop((self.env.cr.dbname, provider.id), None)
+
+    # === RECONCILIATION EXPORT === #
+
+    def _djomy_iter_payments(self, date_from, date_to):
+        """Yield the payments listed by Djomy over a period, one page at a time.
+
+        Only one page is held in memory at once. The pages are requested with the background
+        priority, behind the checkout and POS requests.
+
+        :param datetime date_from: The start of the period, included.
+        :param datetime date_to: The end of the period, excluded.
+        :return: The payments, as returned by `GET payments`.
+        :rtype: iterator[dict]
+        """
+        self.ensure_one()
+        provider = self.with_context(djomy_request_priority='background')
+        page = 0
+        while True:
+            response = provider._djomy_send_request_with_retry('GET', 'payments', params={
+                'page': page,
+                'size': const.RECONCILIATION_PAGE_SIZE,
+                'startDate': date_from.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'endDate': date_to.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            })
+            # The list is either the data itself or wrapped in a pagination envelope.
+            payments = response if isinstance(response, list) else (
+                response.get('content') or response.get('items') or []
+            )
+            yield from payments
+            if len(payments) < const.RECONCILIATION_PAGE_SIZE or (
+                isinstance(response, dict) and response.get('last')
+            ):
+                return
+            page += 1
+
+    def _djomy_export_reconciliation(self, output, date_from, date_to):
+        """Write the mismatches between the payments of Djomy and the transactions of Odoo as CSV.
+
+        The Djomy payments are paged into a temporary table, then merged with the transactions on
+        the Djomy transaction id by a single query read through a server-side cursor, so that the
+        memory used does not depend on the number of payments.
+
+        A mismatch is a payment missing on either side, or whose status or amount differ.
+
+        :param file output: The text file to write the CSV to.
+        :param datetime date_from: The start of the period, included.
+        :param datetime date_to: The end of the period, excluded.
+        :return: The number of payments compared and of mismatches written.
+        :rtype: tuple[int, int]
+        """
+        self.ensure_one()
+        cr = self.env.cr
+        cr.execute("""
+            DROP TABLE IF EXISTS djomy_reconciliation_payment;
+            CREATE TEMPORARY TABLE djomy_reconciliation_payment (
+                transaction_id varchar,
+                merchant_reference varchar,
+                status varchar,
+                amount numeric,
+                currency varchar
+            ) ON COMMIT DROP
+        """)
+        for payments in split_every(const.RECONCILIATION_PAGE_SIZE, self._djomy_iter_payments(
+            date_from, date_to
+        )):
+            cr.execute("""
+                INSERT INTO djomy_reconciliation_payment
+                SELECT * FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[], %s::numeric[],
+                                     %s::varchar[])
+            """, [list(column) for column in zip(*(
+                (
+                    payment.get('transactionId'),
+                    payment.get('merchantPaymentReference'),
+                    (payment.get('status') or '').upper(),
+                    payment.get('paidAmount', payment.get('amount')),
+                    payment.get('currency'),
+                )
+                for payment in payments
+            ))])
+        cr.execute("ANALYZE djomy_reconciliation_payment")
+
+        self.env['payment.transaction'].flush_model([
+            'provider_id', 'provider_reference', 'reference', 'state', 'amount', 'create_date',
+        ])
+        cr.execute("""
+            DECLARE djomy_reconciliation NO SCROLL CURSOR FOR
+            SELECT payment.transaction_id, payment.merchant_reference, payment.status,
+                   payment.amount, payment.currency,
+                   tx.provider_reference, tx.reference, tx.state, tx.amount
+              FROM djomy_reconciliation_payment payment
+              FULL JOIN (
+                    SELECT provider_reference, reference, state, amount
+                      FROM payment_transaction
+                     WHERE provider_id = %s
+                       AND provider_reference IS NOT NULL
+                       AND create_date >= %s AND create_date < %s
+                   ) tx ON tx.provider_reference = payment.transaction_id
+        """, [self.id, date_from, date_to])
+
+        writer = csv.writer(output)
+        writer.writerow([
+            'issue', 'djomy_transaction_id', 'djomy_merchant_reference', 'djomy_status',
+            'djomy_amount', 'djomy_currency', 'odoo_reference', 'odoo_state', 'odoo_amount',
+        ])
+        compared_count = mismatch_count = 0
+        while True:
+            cr.execute(
+                "FETCH FORWARD %s FROM djomy_reconciliation", [const.RECONCILIATION_PAGE_SIZE]
+            )
+            rows = cr.fetchall()
+            if not rows:
+                break
+            for row in rows:
+                compared_count += 1
+                issue = _djomy_get_reconciliation_issue(*row)
+                if issue:
+                    mismatch_count += 1
+                    writer.writerow([issue, *row[:5], *row[6:]])
+        cr.execute("CLOSE djomy_reconciliation")
+        cr.execute("DROP TABLE djomy_reconciliation_payment")
+        return compared_count, mismatch_count
 
     # === REQUEST HELPERS === #
 
+    def _send_api_request(self, method, endpoint, *, params=None, data=None, json=None, **kwargs):
+        """Override of `payment` to send the request through the persistent HTTP session."""
+        if self.code != 'djomy':
+            return super()._send_api_request(
+                method, endpoint, params=params, data=data, json=json, **kwargs
+            )
+
+        endpoint_class = _djomy_get_endpoint_class(endpoint)
+        endpoint_label = _djomy_get_endpoint_label(endpoint)
+        EndpointState = self.env['djomy.endpoint.state'].sudo()
+        try:
+            EndpointState._check_circuit(self, endpoint_class)
+            EndpointState._acquire_tokens(self, endpoint_class)
+        except DjomyAPIError:
+            metrics.registry.inc(
+                'djomy_api_requests_total', endpoint=endpoint_label, status='rejected'
+            )
+            raise
+
+        url = self._build_request_url(endpoint, **kwargs)
+        headers = self._build_request_headers(method, endpoint, json or data, **kwargs)
+        with ExitStack() as bulkhead:
+            try:
+                bulkhead.enter_context(self._djomy_hold_bulkhead_slots(endpoint_class))
+            except DjomyAPIError:
+                metrics.registry.inc(
+                    'djomy_api_requests_total', endpoint=endpoint_label, status='rejected'
+                )
+                raise
+            try:
+                with _djomy_measure_request(endpoint_label) as measure:
+                    response = self._djomy_get_session().request(
+                        method,
+                        url,
+                        params=params,
+                        data=data,
+                        json=json,
+                        headers=headers,
+                        timeout=self._djomy_get_timeout(endpoint_class),
+                    )
+                    measure(response)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                _logger.exception("Unable to reach endpoint at %s", url)
+                EndpointState._record_failure(self, endpoint_class)
+                raise DjomyAPIError(_("Djomy: Could not establish the connection to the API."))
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            _logger.exception(
+                "Invalid API request at %s with data:\n%s", url, payload_log.Redacted(json or data)
+            )
+            error = DjomyAPIError(
+                _(
+                    "Djomy API error (HTTP %(status)s): %(message)s",
+                    status=response.status_code,
+                    message=self._parse_response_error(response),
+                ),
+                status_code=response.status_code,
+                retry_after=parse_retry_after(response),
+            )
+            if error.is_transient:
+                EndpointState._record_failure(self, endpoint_class)
+            else:
+                EndpointState._record_success(self, endpoint_class)
+            if error.is_throttled:
+                EndpointState._record_throttling(self, endpoint_class, error.retry_after)
+            raise error
+        EndpointState._record_success(self, endpoint_class)
+        return self._parse_response_content(response, **kwargs)
+
+    @contextmanager
+    def _djomy_hold_bulkhead_slots(self, endpoint_class, count=1):
+        """Hold up to `count` of the slots of the endpoint class, shared by all the workers, for the
+        duration of the block.
+
+        The slots are session-level advisory locks taken on a dedicated connection, so that they
+        are held for as long as the HTTP calls only, whatever the transaction of the request does,
+        and released when the block exits.
+
+        :param str endpoint_class: The class of the endpoint.
+        :param int count: The number of slots wanted, one per request sent at once.
+        :return: The number of slots taken, between 1 and `count`.
+        :rtype: int
+        :raise DjomyAPIError: If all the slots are taken.
+        """
+        self.ensure_one()
+        slots = min(int(self.env['ir.config_parameter'].sudo().get_param(
+            f'djomy.bulkhead_slots.{endpoint_class}', const.BULKHEAD_SLOTS[endpoint_class]
+        )), const.BULKHEAD_MAX_SLOTS)
+        namespace = (
+            const.ADVISORY_LOCK_BULKHEAD
+            + list(const.BULKHEAD_SLOTS).index(endpoint_class) * const.BULKHEAD_MAX_SLOTS
+        )
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                SELECT slot
+                  FROM generate_series(0, %s - 1) AS slot
+                 WHERE pg_try_advisory_lock(%s + slot, %s)
+                 LIMIT %s
+            """, [slots, namespace, self.id, count])
+            taken_slots = [row[0] for row in cr.fetchall()]
+            if not taken_slots:
+                _logger.warning(
+                    "Djomy: All the %s slots of the %s endpoints are in use", slots, endpoint_class
+                )
+                raise DjomyAPIError(
+                    _("Djomy is busy, please try again in a few moments."), rejected=True
+                )
+            try:
+                yield len(taken_slots)
+            finally:
+                # Session-level locks outlive the transaction: they must be released before the
+                # connection goes back to the pool.
+                cr.execute(
+                    "SELECT pg_advisory_unlock(%s + slot, %s) FROM unnest(%s) AS slot",
+                    [namespace, self.id, taken_slots],
+                )
+
     def _build_request_url(self, endpoint, **kwargs):
         """Override of `payment` to build the request URL."""
         if self.code != 'djomy':
             return super()._build_request_url(endpoint, **kwargs)
-        return url_join(self._djomy_get_api_url(), endpoint)
+        return url_join(self._djomy_get_request_context()['api_url'], endpoint)
 
     def _build_request_headers(self, *args, skip_auth=False, **kwargs):
         """Override of `payment` to build the request headers."""
         if self.code != 'djomy':
             return super()._build_request_headers(*args, **kwargs)
 
+        request_context = self._djomy_get_request_context()
         headers = {
             'Content-Type': 'application/json',
-            'X-API-KEY': self._djomy_generate_signature(),
+            'X-API-KEY': request_context['api_key'],
         }
-        if self.djomy_partner_domain:
-            headers['X-PARTNER-DOMAIN'] = self.djomy_partner_domain
+        if request_context['partner_domain']:
+            headers['X-PARTNER-DOMAIN'] = request_context['partner_domain']
         if not skip_auth:
-            if not self.djomy_access_token:
-                self._djomy_fetch_access_token()
-            headers['Authorization'] = f'Bearer {self.djomy_access_token}'
+            headers['Authorization'] = f'Bearer {self._djomy_get_access_token()}'
         return headers
 
     def _parse_response_error(self, response):
@@ -177,3 +880,115 @@ class PaymentProvider(models.Model):
         if json_response.get('success'):
             return json_response.get('data', json_response)
         return json_response
+
+
+def _djomy_get_reconciliation_issue(
+    djomy_transaction_id, _merchant_reference, djomy_status, djomy_amount, _currency,
+    provider_reference, _reference, odoo_state, odoo_amount,
+):
+    """Return the mismatch between a Djomy payment and its transaction, if any.
+
+    :return: `missing_in_odoo`, `missing_in_djomy`, `status_mismatch`, `amount_mismatch`, or
+             `None` if both sides agree.
+    :rtype: str
+    """
+    if provider_reference is None:
+        return 'missing_in_odoo'
+    if djomy_transaction_id is None:
+        return 'missing_in_djomy'
+    djomy_state = next(
+        (state for state, statuses in const.PAYMENT_STATUS_MAPPING.items()
+         if djomy_status in statuses),
+        None,
+    )
+    if djomy_state != (odoo_state if odoo_state != 'draft' else 'pending'):
+        return 'status_mismatch'
+    if djomy_state == 'done' and (djomy_amount is None or djomy_amount != odoo_amount):
+        return 'amount_mismatch'
+    return None
+
+
+def _djomy_request_in_thread(session, method, url, headers, payload, endpoint_label, timeout):
+    """Send a request from a worker thread, without any access to the environment.
+
+    :raise requests.exceptions.RequestException: If the request fails.
+    :raise ValueError: If the response is not valid JSON.
+    """
+    with _djomy_measure_request(endpoint_label) as measure:
+        response = session.request(
+            method, url, json=payload, headers=headers, timeout=timeout
+        )
+        measure(response)
+    response.raise_for_status()
+    json_response = response.json()
+    if json_response.get('success'):
+        return json_response.get('data', json_response)
+    return json_response
+
+
+@contextmanager
+def _djomy_measure_request(endpoint_label):
+    """Record the duration and the outcome of a request to the Djomy API.
+
+    The block calls the yielded function with the response once it received it; a block left
+    without response, e.g., on timeout, is recorded as such.
+    """
+    outcome = {}
+    start = time.perf_counter()
+    try:
+        yield lambda response: outcome.update(status=response.status_code)
+    except requests.exceptions.Timeout:
+        outcome['status'] = 'timeout'
+        raise
+    except requests.exceptions.ConnectionError:
+        outcome['status'] = 'connection_error'
+        raise
+    finally:
+        metrics.registry.observe(
+            'djomy_api_request_duration_seconds', time.perf_counter() - start,
+            endpoint=endpoint_label,
+        )
+        metrics.registry.inc(
+            'djomy_api_requests_total',
+            endpoint=endpoint_label,
+            status=outcome.get('status', 'error'),
+        )
+
+
+def _djomy_get_endpoint_label(endpoint):
+    """Return the endpoint with its ids replaced by placeholders, e.g., `payments/{id}/status`."""
+    segments = endpoint.strip('/').split('/')
+    return '/'.join(
+        segments[:1] + [
+            segment if segment in const.ENDPOINT_STATIC_SEGMENTS else '{id}'
+            for segment in segments[1:]
+        ]
+    )
+
+
+def _djomy_get_endpoint_class(endpoint):
+    """Return the class of an endpoint, for the circuit breaker and the bulkhead."""
+    endpoint_class = endpoint.strip('/').split('/', 1)[0]
+    return endpoint_class if endpoint_class in const.BULKHEAD_SLOTS else 'default'
+
+
+def _djomy_is_status_final(status_data):
+    """Return whether the status data holds a final payment status."""
+    status = (status_data.get('status') or '').upper()
+    return any(
+        status in const.PAYMENT_STATUS_MAPPING[state] for state in ('done', 'cancel', 'error')
+    )
+
+
+def _djomy_get_status_ttl(status_data):
+    """Return how long, in seconds, the status data can be cached."""
+    if _djomy_is_status_final(status_data):
+        return const.STATUS_CACHE_TTL_FINAL
+    return const.STATUS_CACHE_TTL_PENDING
+
+
+def _djomy_is_token_valid(expiry_timestamp):
+    """Return whether a token expiring at the given timestamp can still be used."""
+    return bool(expiry_timestamp) and (
+        expiry_timestamp - const.ACCESS_TOKEN_REFRESH_MARGIN > time.time()
+    )
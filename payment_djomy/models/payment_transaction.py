@@ -1,11 +1,19 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import _, api, models
+import time
+from datetime import timedelta
+
+from markupsafe import escape
+from psycopg2 import errors
+
+import odoo
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
 from odoo.tools import urls
 
+from odoo.addons.payment import utils as payment_utils
 from odoo.addons.payment.logging import get_payment_logger
-from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy import const, metrics, payload_log
 from odoo.addons.payment_djomy.controllers.main import DjomyController
 
 
@@ -15,6 +23,53 @@ _logger = get_payment_logger(__name__)
 class PaymentTransaction(models.Model):
     _inherit = 'payment.transaction'
 
+    djomy_next_check = fields.Datetime(
+        string="Djomy Next Status Check",
+        help="When the reconciliation cron will next query the status of the transaction.",
+        copy=False,
+        readonly=True,
+    )
+    djomy_check_count = fields.Integer(
+        string="Djomy Status Checks",
+        copy=False,
+        readonly=True,
+    )
+
+    def init(self):
+        super().init()
+        # The return and webhook routes look the transactions up by Djomy transaction id.
+        tools.create_index(
+            self.env.cr,
+            'payment_transaction_djomy_provider_reference_index',
+            self._table,
+            ['provider_reference', 'provider_id'],
+            where="provider_reference IS NOT NULL",
+        )
+        # The post-processing cron only ever looks for the confirmed transactions not processed yet.
+        tools.create_index(
+            self.env.cr,
+            'payment_transaction_djomy_post_process_index',
+            self._table,
+            ['id'],
+            where="state = 'done' AND is_post_processed IS NOT TRUE",
+        )
+        # The expiry cron looks for the oldest draft and pending transactions.
+        tools.create_index(
+            self.env.cr,
+            'payment_transaction_djomy_open_index',
+            self._table,
+            ['create_date', 'id'],
+            where="state IN ('draft', 'pending')",
+        )
+        # The reconciliation cron only ever looks for the pending transactions that are due.
+        tools.create_index(
+            self.env.cr,
+            'payment_transaction_djomy_next_check_index',
+            self._table,
+            ['djomy_next_check NULLS FIRST', 'id'],
+            where="state IN ('draft', 'pending') AND provider_reference IS NOT NULL",
+        )
+
     def _get_specific_rendering_values(self, processing_values):
         """Override of payment to return Djomy-specific rendering values.
 
@@ -44,12 +99,13 @@ class PaymentTransaction(models.Model):
         self.ensure_one()
 
         base_url = self.provider_id.get_base_url()
-        return_url = urls.urljoin(base_url, DjomyController._return_url)
+        # The return URL is signed so that the customer comes back to this very transaction.
+        return_url = urls.urljoin(base_url, self._djomy_get_return_path())
         cancel_url = urls.urljoin(base_url, DjomyController._cancel_url)
 
         _logger.info(
             "Djomy: Creating payment for %s, amount=%s, phone=%s",
-            self.reference, self.amount, self.partner_phone
+            self.reference, self.amount, payload_log.mask_phone(self.partner_phone)
         )
 
         payload = {
@@ -83,6 +139,12 @@ class PaymentTransaction(models.Model):
 
         return redirect_url
 
+    def _djomy_get_return_path(self):
+        """Return the path of the return URL, signed with an access token of the transaction."""
+        self.ensure_one()
+        access_token = payment_utils.generate_access_token(self.id)
+        return f'{DjomyController._return_url}/{self.id}/{access_token}'
+
     @api.model
     def _extract_reference(self, provider_code, payment_data):
         """Override of `payment` to extract the reference from the payment data."""
@@ -121,6 +183,10 @@ class PaymentTransaction(models.Model):
             self._set_pending()
         elif payment_status in const.PAYMENT_STATUS_MAPPING['done']:
             self._set_done()
+            if self.state == 'done' and not self.is_post_processed:
+                # Mark the invoice paid within seconds rather than waiting for the ~10-min core
+                # cron `cron_post_process_payment_tx`, without doing the accounting inline.
+                self.env.ref('payment_djomy.cron_post_process_transactions')._trigger()
         elif payment_status in const.PAYMENT_STATUS_MAPPING['cancel']:
             self._set_canceled()
         elif payment_status in const.PAYMENT_STATUS_MAPPING['error']:
@@ -135,6 +201,314 @@ class PaymentTransaction(models.Model):
             )
             self._set_error(_("Unknown payment status: %s", payment_status))
 
+    # === NOTIFICATION PROCESSING === #
+
+    def _djomy_process_notification(self, data):
+        """Process a webhook notification from Djomy on the transaction.
+
+        The official status is re-fetched from Djomy via `GET /payments/{transactionId}/status`
+        before transitioning the transaction state; this prevents a caller from forging a
+        `{status: SUCCESS}` payload when the signature check is off.
+
+        Note: self.ensure_one()
+
+        :param dict data: The notification data.
+        :return: The reason why the notification could not be processed, if any. `locked` means
+                 that another request holds the lock of the transaction, and that the notification
+                 must be processed again shortly.
+        :rtype: str or None
+        """
+        self.ensure_one()
+        transaction_id = (
+            data.get('transactionId')
+            or data.get('data', {}).get('transactionId')
+            or self.provider_reference
+        )
+        if transaction_id:
+            try:
+                # A notification of a final status must not be answered
+                # with a pending status cached just before the change.
+                api_data = self.provider_id._djomy_fetch_payment_status(
+                    transaction_id, allow_pending=data.get('eventType') == 'payment.pending'
+                )
+            except ValidationError as err:
+                _logger.warning(
+                    "Djomy webhook: failed to fetch official status "
+                    "for tx=%s: %s", self.reference, err,
+                )
+                return 'api_unreachable'
+            api_status = api_data.get('status', '').upper()
+            if not api_status:
+                _logger.warning(
+                    "Djomy webhook: Djomy returned no status for tx=%s",
+                    self.reference,
+                )
+                return 'no_official_status'
+            data = {**data, **api_data, 'status': api_status}
+
+        # Process the transaction; its post-processing is deferred to
+        # `_cron_djomy_post_process`, out of Djomy's request. If another
+        # request is applying a status right now, it may be an older one
+        # (e.g., fetched by the reconciliation cron before the change):
+        # the notification is processed again once the lock is released.
+        # The reference is the one of the transaction, which differs from the merchant reference
+        # of the notification for the payments made through a payment link.
+        if not self._djomy_apply_status({**data, 'merchantPaymentReference': self.reference}):
+            return 'locked'
+        return None
+
+    def _djomy_apply_status(self, payment_data):
+        """Apply a Djomy payment status to the transaction, unless another request is doing it.
+
+        The webhook, the return URL and the reconciliation cron can all receive the status of a
+        same transaction at once. The row of the transaction is locked without waiting: the
+        request that gets the lock applies the status, and the others return right away instead of
+        waiting on the lock, then failing on a serialization error and being retried. A status the
+        transaction already has is not applied again, so that no row is rewritten for nothing.
+
+        :param dict payment_data: The payment data, as passed to `_process`.
+        :return: Whether the transaction now has the status, i.e., whether it was not skipped
+                 because another request holds the lock.
+        :rtype: bool
+        """
+        self.ensure_one()
+        if not self._djomy_try_lock():
+            _logger.info(
+                "Djomy: Transaction %s is being updated by another request, skipping",
+                self.reference,
+            )
+            metrics.registry.inc('djomy_status_updates_total', result='locked')
+            return False
+        data = payment_data.get('data', payment_data)
+        status = (data.get('status') or '').upper()
+        if (
+            self.state in ('done', 'cancel', 'error')
+            and status in const.PAYMENT_STATUS_MAPPING[self.state]
+            and data.get('transactionId') in (None, self.provider_reference)
+        ):
+            metrics.registry.inc('djomy_status_updates_total', result='unchanged')
+            return True
+        self._process('djomy', payment_data)
+        metrics.registry.inc('djomy_status_updates_total', result='applied')
+        return True
+
+    def _djomy_try_lock(self):
+        """Lock the row of the transaction for the rest of the current transaction, if free.
+
+        The lock also fails when the row was updated by a transaction committed since the current
+        one started, which would otherwise make the update fail on a serialization error.
+
+        :return: Whether the lock was acquired.
+        :rtype: bool
+        """
+        self.ensure_one()
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute(
+                    "SELECT id FROM payment_transaction WHERE id = %s FOR UPDATE NOWAIT",
+                    [self.id],
+                    log_exceptions=False,
+                )
+        except (errors.LockNotAvailable, errors.SerializationFailure):
+            return False
+        return True
+
+    @api.model
+    def _djomy_search_payment_link(self, data):
+        """Return the payment link a notification matching no transaction is about, if any.
+
+        The payment links are not tied to a transaction. The payments made through the link of an
+        invoice get a transaction of their own, created on their first notification and returned
+        in place of the link. Modules creating other links (e.g., `pos_djomy`) override this hook
+        to return the record of the link, which must have a `provider_id` field and a
+        `_djomy_process_notification(data)` method.
+
+        :param dict data: The notification data.
+        :return: The payment link record, or None.
+        """
+        invoice = self.env['account.move']._djomy_search_by_notification(data)
+        return invoice._djomy_get_link_transaction(data) if invoice else None
+
+    # === RECONCILIATION === #
+
+    @api.model
+    def _cron_djomy_reconcile_pending_transactions(self):
+        """Settle the pending Djomy transactions whose notification never arrived.
+
+        The transactions due for a check are claimed in batches with `SKIP LOCKED`, by moving their
+        next check RECONCILE_CLAIM_DELAY seconds ahead, and the claim is committed right away so
+        that no row stays locked while their status is queried concurrently. Concurrent runs never
+        process the same rows, and the rows of a crashed run are checked again once the claim
+        expires. The cron stops after a time budget and reschedules itself if transactions are
+        left.
+        """
+        self = self.with_context(djomy_request_priority='background')
+        max_workers = int(self.env['ir.config_parameter'].sudo().get_param(
+            'djomy.reconcile_max_workers', const.RECONCILE_MAX_WORKERS
+        ))
+        start = time.monotonic()
+        while True:
+            self.env['payment.provider'].flush_model(['code', 'state'])
+            self.flush_model(['provider_id', 'state', 'provider_reference', 'djomy_next_check'])
+            now = fields.Datetime.now()
+            self.env.cr.execute("""
+                UPDATE payment_transaction
+                   SET djomy_next_check = %s
+                 WHERE id IN (
+                        SELECT tx.id
+                          FROM payment_transaction tx
+                          JOIN payment_provider provider ON provider.id = tx.provider_id
+                         WHERE provider.code = 'djomy'
+                           AND provider.state != 'disabled'
+                           AND tx.state IN ('draft', 'pending')
+                           AND tx.provider_reference IS NOT NULL
+                           AND (tx.djomy_next_check IS NULL OR tx.djomy_next_check <= %s)
+                         ORDER BY tx.djomy_next_check NULLS FIRST, tx.id
+                         LIMIT %s
+                           FOR UPDATE OF tx SKIP LOCKED
+                       )
+             RETURNING id
+            """, [
+                now + timedelta(seconds=const.RECONCILE_CLAIM_DELAY),
+                now,
+                const.RECONCILE_BATCH_SIZE,
+            ])
+            txs = self.sudo().browse(row[0] for row in self.env.cr.fetchall())
+            if not txs:
+                return
+            txs.invalidate_recordset(['djomy_next_check'])
+            self._djomy_commit_progress()
+            for provider, provider_txs in txs.grouped('provider_id').items():
+                provider_txs._djomy_reconcile(provider, max_workers)
+            self._djomy_commit_progress()
+            if time.monotonic() - start > const.RECONCILE_TIME_BUDGET:
+                self.env.ref('payment_djomy.cron_reconcile_pending_transactions')._trigger()
+                return
+
+    def _djomy_reconcile(self, provider, max_workers):
+        """Fetch the official status of the transactions and process it.
+
+        The row of each transaction is only locked once its status was fetched, without waiting. A
+        transaction locked by another request (e.g., the webhook, whose status is at least as
+        recent) is left alone; it keeps its claimed next check. The transactions still pending
+        afterwards, or whose status could not be fetched, are scheduled for another check with an
+        exponential back-off.
+
+        :param payment.provider provider: The provider of the transactions.
+        :param int max_workers: The maximum number of status requests in flight at once.
+        :return: The transactions locked whose status was fetched and processed.
+        :rtype: payment.transaction
+        """
+        try:
+            responses = provider._djomy_send_concurrent_requests({
+                tx.id: ('GET', f'payments/{tx.provider_reference}/status', None) for tx in self
+            }, max_workers)
+        except ValidationError as error:
+            _logger.warning("Djomy: Could not reconcile the pending transactions: %s", error)
+            responses = {}
+
+        locked_txs = checked_txs = self.browse()
+        for tx in self:
+            if not tx._djomy_try_lock():
+                metrics.registry.inc('djomy_status_updates_total', result='locked')
+                continue
+            locked_txs |= tx
+            api_data = responses.get(tx.id)
+            if not isinstance(api_data, dict) or not api_data.get('status'):
+                continue
+            provider._djomy_cache_payment_status(tx.provider_reference, api_data)
+            payment_data = {
+                'transactionId': tx.provider_reference,
+                'merchantPaymentReference': tx.reference,
+                **api_data,
+                'status': api_data['status'].upper(),
+            }
+            try:
+                with self.env.cr.savepoint():
+                    tx._djomy_apply_status(payment_data)
+            except ValidationError as error:
+                _logger.warning("Djomy: Could not reconcile transaction %s: %s", tx.reference, error)
+            else:
+                checked_txs |= tx
+
+        now = fields.Datetime.now()
+        for check_count, txs in locked_txs.filtered(
+            lambda t: t.state in ('draft', 'pending')
+        ).grouped(lambda t: t.djomy_check_count + 1).items():
+            delay = min(
+                const.RECONCILE_BACKOFF_MIN * 2 ** (check_count - 1), const.RECONCILE_BACKOFF_MAX
+            )
+            txs.write({
+                'djomy_check_count': check_count,
+                'djomy_next_check': now + timedelta(seconds=delay),
+            })
+        return checked_txs
+
+    # === POST-PROCESSING === #
+
+    @api.model
+    def _cron_djomy_post_process(self):
+        """Post-process the confirmed Djomy transactions in batches.
+
+        The cron is triggered whenever a Djomy transaction is confirmed, so that the reconciliation
+        and posting of the invoices run out of the webhook request. The transactions confirmed
+        meanwhile are post-processed together, which shares the prefetching and the accounting
+        work. The transactions are claimed with `SKIP LOCKED`, so that concurrent runs never
+        process the same rows. If a batch fails, its transactions are retried one by one so that a
+        single faulty transaction does not hold back the others.
+
+        The core cron `cron_post_process_payment_tx` takes no lock and may pick the same
+        transactions, which is harmless: `is_post_processed` is checked again when a row is locked
+        here, and the run that marks a transaction as post-processed after the other one did
+        fails on a serialization error, which rolls its accounting back.
+        """
+        start = time.monotonic()
+        failed_ids = []
+        while True:
+            self.flush_model(['state', 'is_post_processed', 'provider_id'])
+            self.env.cr.execute("""
+                SELECT tx.id
+                  FROM payment_transaction tx
+                  JOIN payment_provider provider ON provider.id = tx.provider_id
+                 WHERE provider.code = 'djomy'
+                   AND tx.state = 'done'
+                   AND tx.is_post_processed IS NOT TRUE
+                   AND tx.last_state_change >= %s
+                   AND tx.id != ALL(%s)
+                 ORDER BY tx.id
+                 LIMIT %s
+                   FOR UPDATE OF tx SKIP LOCKED
+            """, [
+                fields.Datetime.now() - timedelta(days=const.POST_PROCESS_MAX_AGE_DAYS),
+                failed_ids,
+                const.POST_PROCESS_BATCH_SIZE,
+            ])
+            txs = self.sudo().browse(row[0] for row in self.env.cr.fetchall())
+            if not txs:
+                return
+            try:
+                with self.env.cr.savepoint():
+                    txs._post_process()
+            except Exception:
+                for tx in txs:
+                    try:
+                        with self.env.cr.savepoint():
+                            tx._post_process()
+                    except Exception as error:
+                        _logger.warning(
+                            "Djomy: Could not post-process transaction %s: %s", tx.reference, error
+                        )
+                        failed_ids.append(tx.id)
+            self._djomy_commit_progress()
+            if time.monotonic() - start > const.POST_PROCESS_TIME_BUDGET:
+                self.env.ref('payment_djomy.cron_post_process_transactions')._trigger()
+                return
+
+    def _djomy_commit_progress(self):
+        """Commit the work done so far by a cron, unless running the tests."""
+        if not odoo.modules.module.current_test:
+            self.env.cr.commit()
+
     # === UX : nettoyage des transactions zombies ===========================
 
     @api.model_create_multi
@@ -158,56 +532,186 @@ class PaymentTransaction(models.Model):
     def _djomy_cancel_stale_siblings(self):
         """Annule les autres tx Djomy `draft`/`pending` sur les mêmes SO /
         factures que `self`, ainsi que les `account.payment` draft associés.
+
+        Traitement ensembliste : une seule recherche pour tout le lot, une
+        seule écriture pour annuler, une seule recherche des paiements et une
+        note par document — le nombre de requêtes ne dépend pas du nombre de
+        tx créées ni du nombre de zombies.
         """
         PT = self.sudo()
+        # (champ m2m, modèle du document) présents selon les modules installés
+        doc_fields = [
+            (fname, self._fields[fname].comodel_name)
+            for fname in ('sale_order_ids', 'invoice_ids') if fname in self._fields
+        ]
+        # {(modèle, id document): références des nouvelles tx}
+        new_refs_by_doc = {}
         for tx in self:
-            so_ids = tx.sale_order_ids.ids if 'sale_order_ids' in tx._fields else []
-            inv_ids = tx.invoice_ids.ids if 'invoice_ids' in tx._fields else []
-            if not (so_ids or inv_ids):
-                continue
-            domain = [
-                ('id', '!=', tx.id),
-                ('provider_code', '=', 'djomy'),
-                ('state', 'in', ('draft', 'pending')),
-            ]
-            stale = PT.browse()
-            if so_ids:
-                stale |= PT.search(domain + [('sale_order_ids', 'in', so_ids)])
-            if inv_ids:
-                stale |= PT.search(domain + [('invoice_ids', 'in', inv_ids)])
-            if not stale:
-                continue
+            for fname, model in doc_fields:
+                for doc_id in tx[fname].ids:
+                    new_refs_by_doc.setdefault((model, doc_id), []).append(tx.reference)
+        if not new_refs_by_doc:
+            return
+
+        # {champ m2m: ids des documents des nouvelles tx}
+        doc_ids_by_field = {}
+        for fname, model in doc_fields:
+            doc_ids = [doc_id for doc_model, doc_id in new_refs_by_doc if doc_model == model]
+            if doc_ids:
+                doc_ids_by_field[fname] = doc_ids
+        domain = [
+            ('id', 'not in', self.ids),
+            ('provider_code', '=', 'djomy'),
+            ('state', 'in', ('draft', 'pending')),
+        ] + ['|'] * (len(doc_ids_by_field) - 1) + [
+            (fname, 'in', doc_ids) for fname, doc_ids in doc_ids_by_field.items()
+        ]
+        stale = PT.search_fetch(domain, ['reference', 'state'])
+        if not stale:
+            return
+        _logger.info(
+            "[DJOMY] %d new tx(s) supersede %d stale tx(s) — auto-cancel",
+            len(self), len(stale),
+        )
+
+        # Note interne en chatter SO/facture — pas dans `state_message`
+        # qui serait rendu côté portail client (payment_templates).
+        # Une seule note par document, qui regroupe toutes ses tx annulées.
+        for fname, doc_ids in doc_ids_by_field.items():
+            model = self._fields[fname].comodel_name
+            bodies = {}
+            for doc, old_refs in PT._read_group(
+                [('id', 'in', stale.ids), (fname, 'in', doc_ids)], [fname], ['reference:array_agg'],
+            ):
+                new_refs = new_refs_by_doc.get((model, doc.id))
+                if not new_refs:
+                    continue
+                bodies[doc.id] = escape(_(
+                    "Transaction Djomy %(old)s annulée automatiquement — "
+                    "remplacée par la nouvelle tentative %(new)s.",
+                    old=', '.join(sorted(old_refs)), new=', '.join(new_refs),
+                ))
+            if bodies:
+                self.env[model].sudo().browse(bodies)._message_log_batch(bodies)
+
+        # Une seule écriture ; la note groupée remplace celle par tx de
+        # `_set_canceled` (voir `_log_received_message`).
+        stale.with_context(djomy_batch_cancel=True)._set_canceled()
+
+        # Annule aussi les account.payment draft liés (sinon la facture
+        # reste polluée par un brouillon orphelin).
+        stale._djomy_cancel_draft_payments()
+
+    def _log_received_message(self):
+        """Override de `payment` : pas de note par tx lors des annulations
+        groupées (`djomy_batch_cancel` en contexte), qui font leur propre
+        note par document ou une seule ligne de log."""
+        if self.env.context.get('djomy_batch_cancel'):
+            return
+        super()._log_received_message()
+
+    def _djomy_cancel_draft_payments(self):
+        """Annule en une fois les `account.payment` draft des tx `self`.
+
+        Si l'annulation groupée échoue, on retombe sur une annulation
+        paiement par paiement pour ne pas bloquer les autres.
+
+        :return: le nombre de paiements annulés
+        :rtype: int
+        """
+        payments = self.env['account.payment'].sudo().search([
+            ('payment_transaction_id', 'in', self.ids),
+            ('state', '=', 'draft'),
+        ])
+        try:
+            with self.env.cr.savepoint():
+                payments.action_cancel()
+            return len(payments)
+        except Exception:
+            cancelled = 0
+            for p in payments:
+                try:
+                    with self.env.cr.savepoint():
+                        p.action_cancel()
+                    cancelled += 1
+                except Exception as exc:
+                    _logger.warning(
+                        "[DJOMY] could not cancel stale account.payment "
+                        "%d: %s", p.id, exc,
+                    )
+            return cancelled
+
+    @api.model
+    def _cron_djomy_expire_abandoned_transactions(self):
+        """Expire les tx Djomy `draft`/`pending` abandonnées.
+
+        Complète `_djomy_cancel_stale_siblings` pour les paniers abandonnés
+        sans nouvelle tentative : toute tx Djomy encore `draft`/`pending`
+        après `djomy.transaction_expiry_hours` heures est annulée, ainsi que
+        ses `account.payment` draft.
+
+        Seules les tx jamais transmises à Djomy (sans `provider_reference`)
+        sont annulées d'office. Les autres passent d'abord par le
+        rapprochement (`_djomy_reconcile`), par requêtes concurrentes, après
+        validation du lot pour ne garder aucune ligne verrouillée pendant les
+        appels : un paiement abouti entre-temps est confirmé au lieu d'être
+        annulé, et seules les tx que Djomy donne encore en attente sont
+        annulées. Une tx dont le statut n'a pu être obtenu, ou verrouillée par
+        une autre requête, est laissée au passage suivant.
+
+        Traitement par lots de quelques milliers, réclamés en `SKIP LOCKED`
+        dans l'ordre de l'index sur `create_date`, validés lot par lot ; une
+        seule ligne de log résume le passage, sans note en chatter par tx.
+        """
+        self = self.with_context(djomy_request_priority='background')
+        expiry_hours = int(self.env['ir.config_parameter'].sudo().get_param(
+            'djomy.transaction_expiry_hours', const.TRANSACTION_EXPIRY_HOURS
+        ))
+        max_workers = int(self.env['ir.config_parameter'].sudo().get_param(
+            'djomy.reconcile_max_workers', const.RECONCILE_MAX_WORKERS
+        ))
+        limit_date = fields.Datetime.now() - timedelta(hours=expiry_hours)
+        start = time.monotonic()
+        expired_count = payment_count = 0
+        kept_ids = []  # Les tx rapprochées sans statut, laissées au passage suivant.
+        while True:
+            self.env['payment.provider'].flush_model(['code'])
+            self.flush_model(['provider_id', 'state', 'provider_reference'])
+            self.env.cr.execute("""
+                SELECT tx.id
+                  FROM payment_transaction tx
+                  JOIN payment_provider provider ON provider.id = tx.provider_id
+                 WHERE provider.code = 'djomy'
+                   AND tx.state IN ('draft', 'pending')
+                   AND tx.create_date < %s
+                   AND tx.id != ALL(%s)
+                 ORDER BY tx.create_date, tx.id
+                 LIMIT %s
+                   FOR UPDATE OF tx SKIP LOCKED
+            """, [limit_date, kept_ids, const.EXPIRY_BATCH_SIZE])
+            txs = self.sudo().browse(row[0] for row in self.env.cr.fetchall())
+            if not txs:
+                break
+            # Pas de `state_message` : il serait rendu côté portail client.
+            expired_txs = txs.filtered(lambda t: not t.provider_reference)
+            expired_txs.with_context(djomy_batch_cancel=True)._set_canceled()
+            payment_count += expired_txs._djomy_cancel_draft_payments()
+            expired_count += len(expired_txs)
+            self._djomy_commit_progress()
+            for provider, provider_txs in (txs - expired_txs).grouped('provider_id').items():
+                checked_txs = provider_txs._djomy_reconcile(provider, max_workers)
+                kept_ids += (provider_txs - checked_txs).ids
+                pending_txs = checked_txs.filtered(lambda t: t.state in ('draft', 'pending'))
+                pending_txs.with_context(djomy_batch_cancel=True)._set_canceled()
+                payment_count += pending_txs._djomy_cancel_draft_payments()
+                expired_count += len(pending_txs)
+                self._djomy_commit_progress()
+            if time.monotonic() - start > const.EXPIRY_TIME_BUDGET:
+                self.env.ref('payment_djomy.cron_expire_abandoned_transactions')._trigger()
+                break
+        if expired_count:
             _logger.info(
-                "[DJOMY] tx %s supersedes %d stale tx(s) %s — auto-cancel",
-                tx.reference, len(stale), stale.mapped('reference'),
-            )
-            # Note interne en chatter SO/facture — pas dans `state_message`
-            # qui serait rendu côté portail client (payment_templates).
-            note = _(
-                "Transaction Djomy %(old)s annulée automatiquement — "
-                "remplacée par la nouvelle tentative %(new)s.",
-                old=', '.join(stale.mapped('reference')), new=tx.reference,
+                "[DJOMY] expired %d abandoned tx(s) older than %dh, cancelled %d draft "
+                "payment(s) in %.1fs",
+                expired_count, expiry_hours, payment_count, time.monotonic() - start,
             )
-            if 'sale_order_ids' in tx._fields:
-                for so in tx.sale_order_ids:
-                    so.message_post(body=note)
-            if 'invoice_ids' in tx._fields:
-                for inv in tx.invoice_ids:
-                    inv.message_post(body=note)
-
-            for s in stale:
-                s._set_canceled()
-                # Annule aussi les account.payment draft liés (sinon la
-                # facture reste polluée par un brouillon orphelin).
-                stale_payments = self.env['account.payment'].sudo().search([
-                    ('payment_transaction_id', '=', s.id),
-                    ('state', '=', 'draft'),
-                ])
-                for p in stale_payments:
-                    try:
-                        p.action_cancel()
-                    except Exception as exc:
-                        _logger.warning(
-                            "[DJOMY] could not cancel stale account.payment "
-                            "%d (tx %s): %s", p.id, s.reference, exc,
-                        )
@@ -0,0 +1,102 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+"""Logging of the payloads exchanged with Djomy, cheap enough for the hot paths.
+
+The full payloads are only formatted when they are actually logged: always at DEBUG level, and for
+a sample of the requests at INFO level. The personal data they hold (phone numbers, names, emails)
+is redacted before being formatted. The last payloads of each provider are also kept, unformatted,
+in a bounded per-process buffer, so that they can be inspected without dumping every payload to the
+logs.
+"""
+
+import collections
+import logging
+import pprint
+import random
+import threading
+import time
+
+from odoo.addons.payment_djomy import const
+
+
+# Per-process buffers of the last payloads received, by provider:
+# {(dbname, provider_id): deque([(timestamp, source, payload)])}.
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def mask_phone(phone):
+    """Return a phone number with all but its last two digits masked, e.g., `*******12`."""
+    if not phone:
+        return phone
+    phone = str(phone)
+    return '*' * max(len(phone) - 2, 0) + phone[-2:]
+
+
+def redact(payload):
+    """Return a copy of a payload with its personal data masked.
+
+    :param payload: The payload, as decoded from JSON.
+    :return: The redacted payload.
+    """
+    if isinstance(payload, dict):
+        return {
+            key: _redact_value(key, value) if str(key).lower() in const.PII_KEYS else redact(value)
+            for key, value in payload.items()
+        }
+    if isinstance(payload, (list, tuple)):
+        return [redact(value) for value in payload]
+    return payload
+
+
+def _redact_value(key, value):
+    if isinstance(value, (dict, list, tuple)) or value in (None, ''):
+        return redact(value)
+    if 'phone' in key.lower() or key.lower() in ('payernumber', 'msisdn'):
+        return mask_phone(value)
+    return '***'
+
+
+class Redacted:
+    """Redacted and pretty-printed payload, only formatted if logged."""
+
+    __slots__ = ('payload',)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return pprint.pformat(redact(self.payload))
+
+
+def log_payload(logger, source, payload, dbname, provider_id=None, sample_rate=0.0):
+    """Keep a payload in the buffer of its provider, and log it if enabled or sampled.
+
+    :param logging.Logger logger: The logger to log the payload with.
+    :param str source: Where the payload comes from, e.g., `webhook`.
+    :param payload: The payload, as decoded from JSON.
+    :param str dbname: The database, to keep the buffers of the databases apart.
+    :param int provider_id: The provider the payload is about, if known.
+    :param float sample_rate: The share of the payloads logged at INFO level, from 0 to 1.
+    :return: None
+    """
+    with _buffers_lock:
+        buffer = _buffers.get((dbname, provider_id))
+        if buffer is None:
+            buffer = _buffers[dbname, provider_id] = collections.deque(
+                maxlen=const.PAYLOAD_BUFFER_SIZE
+            )
+    buffer.append((time.time(), source, payload))
+    if sample_rate and random.random() < sample_rate:
+        logger.info("Djomy %s payload (sampled):\n%s", source, Redacted(payload))
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Djomy %s payload:\n%s", source, Redacted(payload))
+
+
+def get_recent_payloads(dbname, provider_id=None):
+    """Return the last payloads kept for a provider, most recent first.
+
+    :return: The payloads, as `(timestamp, source, payload)` tuples.
+    :rtype: list
+    """
+    return list(reversed(_buffers.get((dbname, provider_id), ())))
@@ -1 +1,19 @@
+from . import test_access_token
+from . import test_benchmarks
+from . import test_circuit_breaker
+from . import test_concurrent_status
+from . import test_http_session
+from . import test_invoice_payment_links
+from . import test_metrics
+from . import test_payload_logging
+from . import test_pending_reconciliation
+from . import test_post_process
+from . import test_rate_limiter
+from . import test_reconciliation
+from . import test_request_context
+from . import test_request_timeouts
+from . import test_return_url
+from . import test_status_cache
+from . import test_transaction_expiry
+from . import test_webhook_inbox
 from . import test_zombie_cleanup
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Bases des tests des appels sortants et des benchmarks Djomy.
+
+Les tests des appels sortants remplacent la session HTTP persistante par une
+fausse session ; les benchmarks sont exécutés contre l'émulateur local de
+l'API.
+
+Les benchmarks ne font pas partie de la suite standard :
+
+    odoo-bin -d <db> -i payment_djomy --test-tags djomy_benchmark
+
+Variables d'environnement :
+  - ``DJOMY_BENCH_N`` : nombre d'itérations par mesure (200 par défaut) ;
+  - ``DJOMY_BENCH_LATENCY`` : latence de l'émulateur en secondes (0.02) ;
+  - ``DJOMY_BENCH_OUTPUT`` : fichier où ajouter les résultats (une ligne
+    JSON par mesure), pour comparer les exécutions entre elles.
+"""
+import json
+import logging
+import os
+import time
+from unittest.mock import patch
+
+import requests
+
+from odoo import fields
+from odoo.tests.common import HttpCase, TransactionCase
+
+from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy.models import payment_provider as provider_module
+from odoo.addons.payment_djomy.tests.djomy_emulator import DjomyEmulator
+
+_logger = logging.getLogger(__name__)
+
+
+class FakeSession:
+    """Session HTTP factice, qui répond aux requêtes sans les envoyer.
+
+    Chaque réponse est prise dans `responses` : un code HTTP, un couple
+    `(code HTTP, Retry-After)`, ou `None` pour un timeout ; 200 une fois la
+    liste épuisée.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.calls = 0
+        self.timeouts = []
+        self.on_request = None
+
+    def request(self, method, url, timeout=None, **kwargs):
+        self.calls += 1
+        self.timeouts.append(timeout)
+        if self.on_request:
+            self.on_request()
+        response_spec = self.responses.pop(0) if self.responses else 200
+        if response_spec is None:
+            raise requests.exceptions.ConnectTimeout("timeout")
+        status_code, retry_after = (
+            response_spec if isinstance(response_spec, tuple) else (response_spec, None)
+        )
+        response = requests.Response()
+        response.status_code = status_code
+        if retry_after is not None:
+            response.headers['Retry-After'] = str(retry_after)
+        response._content = b'{"success": true, "data": {"status": "SUCCESS"}}'
+        return response
+
+
+class DjomyRequestCase(TransactionCase):
+    """Base des tests des appels sortants, envoyés à une `FakeSession`."""
+
+    def setUp(self):
+        super().setUp()
+        # Le disjoncteur, le limiteur de débit et le cloisonnement écrivent dans
+        # des curseurs dédiés : en mode test ils partagent la transaction du test.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        self.session = FakeSession()
+        patcher = patch.object(
+            type(self.provider), '_djomy_get_session', lambda provider: self.session
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class DjomyBenchmarkCase(HttpCase):
+
+    iterations = int(os.environ.get('DJOMY_BENCH_N', 200))
+    emulator_latency = float(os.environ.get('DJOMY_BENCH_LATENCY', 0.02))
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.emulator = DjomyEmulator(
+            latency=cls.emulator_latency, currency=cls.env.company.currency_id.name, seed=42,
+        )
+        cls.emulator.start()
+        cls.addClassCleanup(cls.emulator.stop)
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.dict(const.API_URLS, {'test': self.emulator.url})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_bench',
+            'djomy_client_secret': 'sec_bench',
+            'state': 'test',
+            'company_id': self.env.company.id,
+        })
+        # Les benchmarks mesurent le code du module, pas le limiteur de débit.
+        for endpoint_class in const.RATE_LIMITS:
+            self.env['ir.config_parameter'].sudo().set_param(
+                f'djomy.rate_limit.{endpoint_class}', 0
+            )
+        # L'URL de l'API est en cache : on repart de caches vides.
+        self.env.registry.clear_cache()
+        for cache in (provider_module._access_tokens, provider_module._status_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        self.partner = self.env['res.partner'].create({'name': 'Client Bench'})
+
+    # --- Helpers --------------------------------------------------------
+
+    def _tx_vals(self, reference, **values):
+        return {
+            'reference': reference,
+            'amount': 5000,
+            'currency_id': self.env.company.currency_id.id,
+            'provider_id': self.provider.id,
+            'payment_method_id': self.env.ref('payment_djomy.payment_method_djomy').id,
+            'partner_id': self.partner.id,
+            **values,
+        }
+
+    def _create_transactions(self, count, prefix, state='pending'):
+        """Crée `count` tx Djomy, chacune avec un paiement réussi côté émulateur."""
+        return self.env['payment.transaction'].create([
+            self._tx_vals(
+                f'{prefix}-{i}',
+                state=state,
+                provider_reference=self.emulator.add_payment(f'{prefix}-{i}', 5000),
+            )
+            for i in range(count)
+        ])
+
+    def _measure(self, function, items):
+        """Appelle `function` sur chaque élément et renvoie les durées en secondes."""
+        samples = []
+        for item in items:
+            start = time.perf_counter()
+            function(item)
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    def _report(self, name, samples, **extra):
+        """Journalise et enregistre les percentiles d'une mesure."""
+        ordered = sorted(samples)
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+        result = {
+            'benchmark': name,
+            'date': fields.Datetime.to_string(fields.Datetime.now()),
+            'n': len(ordered),
+            'p50_ms': round(percentile(50), 2),
+            'p95_ms': round(percentile(95), 2),
+            'p99_ms': round(percentile(99), 2),
+            'total_s': round(sum(ordered), 3),
+            'emulator_latency_ms': self.emulator_latency * 1000,
+            **extra,
+        }
+        _logger.info(
+            "DJOMY BENCH %-28s n=%-5s p50=%8.2fms p95=%8.2fms p99=%8.2fms %s",
+            name, result['n'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            ' '.join(f'{key}={value}' for key, value in extra.items()),
+        )
+        output = os.environ.get('DJOMY_BENCH_OUTPUT')
+        if output:
+            with open(output, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(result) + '\n')
+        return result
@@ -0,0 +1,320 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+"""Local emulator of the Djomy API, for the benchmarks and the load tests.
+
+The emulator serves the endpoints used by the modules (`auth`, `payments` and its listing,
+`payments/gateway`, `payments/{id}/status`, `links`, `links/{ref}`, `links/{ref}/revoke`) from
+memory, and can inject latency and faults. It only depends on the standard library, so that it can
+also be run on its own, e.g., to point a staging database at it:
+
+    python payment_djomy/tests/djomy_emulator.py --port 8099 --latency 0.05 --fault-rate 0.01
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class DjomyEmulator:
+    """In-memory Djomy API served over HTTP on a local port.
+
+    The payments and the payment links are created pending; they settle with `settle_status` after
+    `settle_after` seconds, or when `settle` is called.
+    """
+
+    def __init__(
+        self, latency=0.0, jitter=0.0, fault_rate=0.0, fault_status=503, hang_rate=0.0,
+        hang=30.0, settle_after=None, settle_status='SUCCESS', currency='GNF', seed=None,
+    ):
+        """
+        :param float latency: The delay, in seconds, added to every response.
+        :param float jitter: The maximum random delay, in seconds, added on top of the latency.
+        :param float fault_rate: The share of the requests answered with `fault_status`.
+        :param int fault_status: The HTTP status of the injected faults.
+        :param float hang_rate: The share of the requests answered only after `hang` seconds, to
+                                trigger the timeouts of the client.
+        :param float hang: The delay, in seconds, of the hanging requests.
+        :param float settle_after: The delay, in seconds, after which the payments settle on their
+                                   own; `None` to only settle them with `settle`.
+        :param str settle_status: The status of the payments settled on their own.
+        :param str currency: The currency of the payments.
+        :param int seed: The seed of the fault injection, for reproducible runs.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.fault_rate = fault_rate
+        self.fault_status = fault_status
+        self.hang_rate = hang_rate
+        self.hang = hang
+        self.settle_after = settle_after
+        self.settle_status = settle_status
+        self.currency = currency
+        self.payments = {}  # {transaction_id: payment}
+        self.links = {}  # {reference: link}
+        self.tokens = set()
+        self.request_counts = {}  # {route: count}
+        self._random = random.Random(seed)
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    # === LIFECYCLE === #
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve the API in a background thread.
+
+        :return: The base URL of the API, to use instead of the real one.
+        :rtype: str
+        """
+        emulator = self
+
+        class Handler(DjomyRequestHandler):
+            pass
+        Handler.emulator = emulator
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        """Stop serving the API."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1/'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # === STATE === #
+
+    def settle(self, transaction_id, status='SUCCESS'):
+        """Set the status of a payment, and of the payment link it belongs to."""
+        with self._lock:
+            payment = self.payments[transaction_id]
+            payment['status'] = status
+            link = self.links.get(payment.get('paymentLinkReference'))
+            if link is not None:
+                link['payments'] = [payment]
+                if status == 'SUCCESS':
+                    link['status'] = 'PAID'
+
+    def add_payment(self, merchant_reference, amount, status='SUCCESS'):
+        """Register a payment made outside of the API, e.g., for a transaction created in Odoo.
+
+        :return: The transaction id of the payment.
+        :rtype: str
+        """
+        with self._lock:
+            payment = self._create_payment({
+                'amount': amount, 'merchantPaymentReference': merchant_reference,
+            })
+            payment['status'] = status
+        return payment['transactionId']
+
+    def pay_link(self, reference, status='SUCCESS'):
+        """Simulate the payment of a payment link by a customer.
+
+        :return: The transaction id of the payment.
+        :rtype: str
+        """
+        with self._lock:
+            link = self.links[reference]
+            payment = self._create_payment({
+                'amount': link['amountToPay'],
+                'merchantPaymentReference': link.get('merchantReference'),
+                'paymentLinkReference': reference,
+            })
+        self.settle(payment['transactionId'], status)
+        return payment['transactionId']
+
+    def _create_payment(self, payload):
+        payment = {
+            'transactionId': str(uuid.uuid4()),
+            'status': 'PENDING',
+            'amount': payload.get('amount'),
+            'paidAmount': payload.get('amount'),
+            'currency': self.currency,
+            'merchantPaymentReference': payload.get('merchantPaymentReference'),
+            'paymentLinkReference': payload.get('paymentLinkReference'),
+            'createdAt': time.time(),
+        }
+        self.payments[payment['transactionId']] = payment
+        return payment
+
+    def _refresh(self, payment):
+        if (
+            self.settle_after is not None
+            and payment['status'] == 'PENDING'
+            and time.time() - payment['createdAt'] >= self.settle_after
+        ):
+            payment['status'] = self.settle_status
+
+    # === API === #
+
+    def handle(self, method, path, headers, payload):
+        """Answer a request.
+
+        :return: The HTTP status and the JSON body of the response.
+        :rtype: tuple
+        """
+        route, params = _match_route(method, path)
+        with self._lock:
+            self.request_counts[route] = self.request_counts.get(route, 0) + 1
+            draw = self._random.random()
+            delay = self.latency + self._random.random() * self.jitter
+        if draw < self.hang_rate:
+            delay += self.hang
+        time.sleep(delay)
+        if route is None:
+            return 404, {'success': False, 'message': "Not found"}
+        if self.hang_rate <= draw < self.hang_rate + self.fault_rate:
+            return self.fault_status, {'success': False, 'message': "Injected fault"}
+
+        if route == 'auth':
+            token = f'emulator-token-{next(self._sequence)}'
+            with self._lock:
+                self.tokens.add(token)
+            return 200, {'success': True, 'data': {'accessToken': token, 'expiresIn': 3600}}
+        if headers.get('Authorization', '').removeprefix('Bearer ') not in self.tokens:
+            return 401, {'success': False, 'message': "Invalid token"}
+
+        with self._lock:
+            if route in ('payments', 'payments/gateway'):
+                payment = self._create_payment(payload)
+                data = {'transactionId': payment['transactionId'], 'status': 'PENDING'}
+                if route == 'payments/gateway':
+                    data['redirectUrl'] = f'{self.url}checkout/{payment["transactionId"]}'
+                return 201, {'success': True, 'data': data}
+            if route == 'payments/list':
+                query = parse_qs(urlsplit(path).query)
+                page = int(query.get('page', ['0'])[0])
+                size = int(query.get('size', ['100'])[0])
+                payments = list(self.payments.values())[page * size:(page + 1) * size]
+                for payment in payments:
+                    self._refresh(payment)
+                return 200, {'success': True, 'data': {
+                    'content': [dict(payment) for payment in payments],
+                    'last': (page + 1) * size >= len(self.payments),
+                }}
+            if route == 'payments/{id}/status':
+                payment = self.payments.get(params[0])
+                if payment is None:
+                    return 404, {'success': False, 'message': "Payment not found"}
+                self._refresh(payment)
+                return 200, {'success': True, 'data': dict(payment)}
+            if route == 'links':
+                reference = f'LNK-{next(self._sequence):08d}'
+                link = self.links[reference] = {
+                    **payload,
+                    'paymentLinkReference': reference,
+                    'paymentPageUrl': f'{self.url}pay/{reference}',
+                    'status': 'ACTIVE',
+                    'payments': [],
+                }
+                return 201, {'success': True, 'data': dict(link)}
+            link = self.links.get(params[0])
+            if link is None:
+                return 404, {'success': False, 'message': "Link not found"}
+            if route == 'links/{ref}/revoke':
+                link['status'] = 'REVOKED'
+                return 200, {'success': True, 'data': {'paymentLinkReference': params[0]}}
+            # links/{ref}
+            for payment in link['payments']:
+                self._refresh(payment)
+            return 200, {'success': True, 'data': json.loads(json.dumps(link))}
+
+
+ROUTES = [
+    ('POST', re.compile(r'auth'), 'auth'),
+    ('POST', re.compile(r'payments'), 'payments'),
+    ('GET', re.compile(r'payments'), 'payments/list'),
+    ('POST', re.compile(r'payments/gateway'), 'payments/gateway'),
+    ('GET', re.compile(r'payments/([^/]+)/status'), 'payments/{id}/status'),
+    ('POST', re.compile(r'links'), 'links'),
+    ('GET', re.compile(r'links/([^/]+)'), 'links/{ref}'),
+    ('POST', re.compile(r'links/([^/]+)/revoke'), 'links/{ref}/revoke'),
+]
+
+
+def _match_route(method, path):
+    path = path.split('?', 1)[0].strip('/').removeprefix('v1/')
+    for route_method, pattern, route in ROUTES:
+        match = pattern.fullmatch(path)
+        if route_method == method and match:
+            return route, match.groups()
+    return None, ()
+
+
+class DjomyRequestHandler(BaseHTTPRequestHandler):
+    emulator = None
+    protocol_version = 'HTTP/1.1'  # Keep the connections alive, like the real API.
+
+    def do_GET(self):
+        self._answer()
+
+    def do_POST(self):
+        self._answer()
+
+    def _answer(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = {}
+        status, response = self.emulator.handle(self.command, self.path, self.headers, payload)
+        content = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--fault-rate', type=float, default=0.0)
+    parser.add_argument('--fault-status', type=int, default=503)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--settle-after', type=float, default=5.0)
+    args = parser.parse_args()
+    emulator = DjomyEmulator(
+        latency=args.latency, jitter=args.jitter, fault_rate=args.fault_rate,
+        fault_status=args.fault_status, hang_rate=args.hang_rate, settle_after=args.settle_after,
+    )
+    print(f"Djomy API emulator listening on {emulator.start(args.host, args.port)}")
+    try:
+        emulator._thread.join()
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
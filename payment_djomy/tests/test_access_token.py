@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Tests du cache de jetons d'accès Djomy.
+
+Le jeton est servi depuis le cache du process tant qu'il n'est pas sur le
+point d'expirer ; un seul worker le rafraîchit (advisory lock) et les autres
+relisent la valeur stockée sur le provider au lieu d'appeler `auth`.
+"""
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import SUPERUSER_ID, api, fields
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy.models import payment_provider as provider_module
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyAccessToken(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        # Le rafraîchissement se fait dans un curseur dédié : en mode test il
+        # partage la transaction du test au lieu d'ouvrir une connexion.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        self.env.flush_all()
+        provider_module._access_tokens.clear()
+        self.addCleanup(provider_module._access_tokens.clear)
+        self.addCleanup(provider_module._access_token_locks.clear)
+        self.auth_calls = 0
+
+    def _fake_send_api_request(self, provider, method, endpoint, **kwargs):
+        self.assertEqual(endpoint, 'auth')
+        self.auth_calls += 1
+        return {'accessToken': f'token-{self.auth_calls}', 'expiresIn': 3600}
+
+    def _patch_api(self):
+        test = self
+
+        def fake(provider, method, endpoint, **kwargs):
+            return test._fake_send_api_request(provider, method, endpoint, **kwargs)
+
+        return patch.object(type(self.provider), '_send_api_request', fake)
+
+    def test_token_is_fetched_once_then_served_from_cache(self):
+        with self._patch_api():
+            first = self.provider._djomy_get_access_token()
+            second = self.provider._djomy_get_access_token()
+        self.assertEqual(first, 'token-1')
+        self.assertEqual(second, 'token-1')
+        self.assertEqual(self.auth_calls, 1)
+
+    def test_token_is_stored_with_its_expiry(self):
+        with self._patch_api():
+            self.provider._djomy_get_access_token()
+        self.provider.invalidate_recordset()
+        self.assertEqual(self.provider.djomy_access_token, 'token-1')
+        self.assertGreater(
+            self.provider.djomy_access_token_expiry,
+            fields.Datetime.now() + timedelta(minutes=50),
+        )
+
+    def test_token_refreshed_by_another_worker_is_reused(self):
+        """Cache local vide mais jeton valide en base : aucun appel `auth`."""
+        self.provider.write({
+            'djomy_access_token': 'token-from-other-worker',
+            'djomy_access_token_expiry': fields.Datetime.now() + timedelta(hours=1),
+        })
+        self.env.flush_all()
+        with self._patch_api():
+            token = self.provider._djomy_get_access_token()
+        self.assertEqual(token, 'token-from-other-worker')
+        self.assertEqual(self.auth_calls, 0)
+
+    def test_token_is_refreshed_ahead_of_expiry(self):
+        provider_module._access_tokens[(self.cr.dbname, self.provider.id)] = (
+            'almost-expired', time.time() + 10,
+        )
+        with self._patch_api():
+            token = self.provider._djomy_get_access_token()
+        self.assertEqual(token, 'token-1')
+        self.assertEqual(self.auth_calls, 1)
+
+    def test_rejected_token_is_replaced(self):
+        with self._patch_api():
+            first = self.provider._djomy_get_access_token()
+            second = self.provider._djomy_fetch_access_token(stale_token=first)
+        self.assertEqual(second, 'token-2')
+        self.assertEqual(self.auth_calls, 2)
+
+    def test_credentials_change_drops_the_token(self):
+        with self._patch_api():
+            self.provider._djomy_get_access_token()
+            self.provider.djomy_client_secret = 'new_secret'
+            self.env.flush_all()
+            token = self.provider._djomy_get_access_token()
+        self.assertEqual(token, 'token-2')
+
+    def test_slow_refresh_of_another_provider_does_not_block(self):
+        other_key = (self.cr.dbname, self.provider.id + 1)
+        refresh_lock = provider_module._access_token_locks.setdefault(other_key, threading.Lock())
+        # Rafraîchissement en cours (verrou tenu) pour un autre provider.
+        with refresh_lock, self._patch_api():
+            token = self.provider._djomy_get_access_token()
+        self.assertEqual(token, 'token-1')
+
+
+class _WorkerLocks(dict):
+    """Verrous de process distincts à chaque appel, comme dans des workers séparés."""
+
+    def setdefault(self, key, default=None):
+        return default
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyAccessTokenAcrossWorkers(TransactionCase):
+    """Rafraîchissements simultanés, chacun avec sa propre connexion.
+
+    Les curseurs ne sont pas en mode test : chaque « worker » a sa transaction
+    en REPEATABLE READ, et le jeton est réellement validé en base.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        with self.registry.cursor() as cr:
+            cr.execute(
+                "SELECT djomy_access_token, djomy_access_token_expiry"
+                " FROM payment_provider WHERE id = %s",
+                [self.provider.id],
+            )
+            stored_token = cr.fetchone()
+            cr.execute(
+                "UPDATE payment_provider"
+                " SET djomy_access_token = NULL, djomy_access_token_expiry = NULL WHERE id = %s",
+                [self.provider.id],
+            )
+        self.addCleanup(self._restore_token, stored_token)
+        provider_module._access_tokens.clear()
+        self.addCleanup(provider_module._access_tokens.clear)
+        patcher = patch.object(provider_module, '_access_token_locks', _WorkerLocks())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _restore_token(self, stored_token):
+        with self.registry.cursor() as cr:
+            cr.execute(
+                "UPDATE payment_provider"
+                " SET djomy_access_token = %s, djomy_access_token_expiry = %s WHERE id = %s",
+                [*stored_token, self.provider.id],
+            )
+
+    def _is_refresh_awaited(self):
+        with self.registry.cursor() as cr:
+            cr.execute("""
+                SELECT 1
+                  FROM pg_locks
+                 WHERE locktype = 'advisory' AND NOT granted AND classid = %s AND objid = %s
+            """, [const.ADVISORY_LOCK_TOKEN_REFRESH, self.provider.id])
+            return bool(cr.fetchone())
+
+    def test_worker_waiting_on_the_refresh_reuses_its_token(self):
+        auth_calls = []
+        in_auth = threading.Event()
+        results = {}
+
+        def fake_auth(provider, method, endpoint, **kwargs):
+            auth_calls.append(endpoint)
+            in_auth.set()
+            # Le premier worker ne répond qu'une fois le second en attente du verrou.
+            deadline = time.monotonic() + 5
+            while not self._is_refresh_awaited() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            return {'accessToken': f'token-{len(auth_calls)}', 'expiresIn': 3600}
+
+        def worker(name):
+            try:
+                with self.registry.cursor() as cr:
+                    env = api.Environment(cr, SUPERUSER_ID, {})
+                    provider = env['payment.provider'].browse(self.provider.id)
+                    results[name] = provider._djomy_fetch_access_token()
+            except Exception as error:
+                results[name] = error
+
+        with patch.object(type(self.provider), '_send_api_request', fake_auth):
+            first = threading.Thread(target=worker, args=('first',))
+            first.start()
+            self.assertTrue(in_auth.wait(5))
+            second = threading.Thread(target=worker, args=('second',))
+            second.start()
+            first.join(10)
+            second.join(10)
+
+        self.assertEqual(results, {'first': 'token-1', 'second': 'token-1'})
+        self.assertEqual(auth_calls, ['auth'], "Un seul appel `auth` pour les deux workers")
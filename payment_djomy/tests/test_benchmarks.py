@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks des parcours de paiement Djomy (hors suite standard).
+
+Voir `common.py` pour le lancement et les variables d'environnement.
+"""
+import hashlib
+import hmac
+import json
+import time
+
+from odoo.tests.common import tagged
+
+from odoo.addons.payment_djomy.tests.common import DjomyBenchmarkCase
+
+
+@tagged('-standard', 'djomy_benchmark', 'post_install', '-at_install')
+class TestDjomyBenchmarks(DjomyBenchmarkCase):
+
+    def _post_webhook(self, tx):
+        body = json.dumps({
+            'eventType': 'payment.success',
+            'data': {
+                'transactionId': tx.provider_reference,
+                'merchantPaymentReference': tx.reference,
+                'status': 'SUCCESS',
+            },
+        }).encode()
+        signature = hmac.new(b'sec_bench', body, hashlib.sha256).hexdigest()
+        response = self.url_open(
+            '/payment/djomy/webhook',
+            data=body,
+            headers={'Content-Type': 'application/json', 'X-Webhook-Signature': f'v1:{signature}'},
+        )
+        self.assertEqual(response.json().get('status'), 'ok')
+
+    def test_webhook_throughput(self):
+        for mode in ('sync', 'async'):
+            self.env['ir.config_parameter'].sudo().set_param(
+                'djomy.webhook_async', mode == 'async'
+            )
+            txs = self._create_transactions(self.iterations, f'BENCH-WH-{mode}')
+            start = time.perf_counter()
+            samples = self._measure(self._post_webhook, txs)
+            elapsed = time.perf_counter() - start
+            self._report(
+                f'webhook_{mode}', samples, throughput_per_s=round(len(txs) / elapsed, 1)
+            )
+            if mode == 'async':
+                start = time.perf_counter()
+                self.env['djomy.webhook.event']._cron_process_pending_events()
+                elapsed = time.perf_counter() - start
+                self._report(
+                    'webhook_inbox_cron', [elapsed / len(txs)] * len(txs),
+                    throughput_per_s=round(len(txs) / elapsed, 1),
+                )
+            self.env.invalidate_all()
+            self.assertEqual(set(txs.mapped('state')), {'done'})
+
+    def test_return_flow_latency(self):
+        txs = self._create_transactions(self.iterations, 'BENCH-RET')
+        samples = self._measure(
+            lambda tx: self.url_open(tx._djomy_get_return_path(), allow_redirects=False), txs
+        )
+        self._report('return_flow', samples)
+        self.env.invalidate_all()
+        self.assertEqual(set(txs.mapped('state')), {'done'})
+
+    def test_zombie_cleanup_at_scale(self):
+        if 'sale_order_ids' not in self.env['payment.transaction']._fields:
+            self.skipTest("sale is not installed")
+        product = self.env['product.product'].create({'name': 'Forfait Bench', 'type': 'service'})
+        sale_orders = self.env['sale.order'].create([{
+            'partner_id': self.partner.id,
+            'order_line': [(0, 0, {'product_id': product.id, 'product_uom_qty': 1})],
+        } for _i in range(10)])
+        PT = self.env['payment.transaction']
+        for stale_count in (100, 1000, 10_000):
+            PT.create([
+                self._tx_vals(
+                    f'BENCH-ZOMBIE-{stale_count}-{i}',
+                    sale_order_ids=[(6, 0, [sale_orders[i % 10].id])],
+                )
+                for i in range(stale_count)
+            ])
+            self.env.flush_all()
+            queries_before = self.cr.sql_log_count
+            start = time.perf_counter()
+            PT.create([
+                self._tx_vals(
+                    f'BENCH-ZOMBIE-{stale_count}-NEW-{i}', sale_order_ids=[(6, 0, [so.id])]
+                )
+                for i, so in enumerate(sale_orders)
+            ])
+            self.env.flush_all()
+            self._report(
+                f'zombie_cleanup_{stale_count}', [time.perf_counter() - start],
+                queries=self.cr.sql_log_count - queries_before,
+            )
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Tests du disjoncteur et du cloisonnement des appels sortants Djomy.
+
+Après trop d'échecs (5xx, timeouts), le circuit s'ouvre et les appels
+échouent immédiatement ; une seule requête sonde est ensuite autorisée et
+referme le circuit si elle aboutit. Les erreurs 4xx ne comptent pas.
+"""
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest.mock import patch
+
+from psycopg2 import errors
+
+from odoo import fields
+from odoo.tests.common import tagged
+from odoo.tools import mute_logger
+
+from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy.tests.common import DjomyRequestCase
+from odoo.addons.payment_djomy.utils import DjomyAPIError
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyCircuitBreaker(DjomyRequestCase):
+
+    def _request(self):
+        return self.provider._send_api_request('GET', 'payments/tx-1/status', skip_auth=True)
+
+    def _circuit(self):
+        self.env.invalidate_all()
+        return self.env['djomy.endpoint.state'].search([
+            ('provider_id', '=', self.provider.id), ('endpoint_class', '=', 'payments'),
+        ])
+
+    @mute_logger('odoo.addons.payment_djomy.models.payment_provider')
+    def _fail(self, count, status_code=500):
+        self.session.responses = [status_code] * count
+        for _i in range(count):
+            with self.assertRaises(DjomyAPIError):
+                self._request()
+
+    def test_circuit_opens_after_repeated_failures(self):
+        self._fail(const.CIRCUIT_FAILURE_THRESHOLD - 1, status_code=None)
+        self.assertEqual(self._circuit().state, 'closed')
+        self._fail(1)
+        self.assertEqual(self._circuit().state, 'open')
+
+        calls = self.session.calls
+        with self.assertRaises(DjomyAPIError) as error:
+            self._request()
+        self.assertTrue(error.exception.rejected)
+        self.assertEqual(self.session.calls, calls, "le circuit ouvert n'appelle pas Djomy")
+
+    def test_client_errors_do_not_open_the_circuit(self):
+        self._fail(const.CIRCUIT_FAILURE_THRESHOLD, status_code=400)
+        self.assertFalse(self._circuit().filtered(lambda c: c.state != 'closed'))
+
+    def test_half_open_probe_closes_the_circuit(self):
+        self._fail(const.CIRCUIT_FAILURE_THRESHOLD)
+        self._circuit().open_until = fields.Datetime.now() - timedelta(seconds=1)
+        self.env.flush_all()
+
+        self.assertEqual(self._request(), {'status': 'SUCCESS'})
+        circuit = self._circuit()
+        self.assertEqual(circuit.state, 'closed')
+        self.assertEqual(circuit.failure_count, 0)
+
+    def test_failed_probe_reopens_the_circuit(self):
+        self._fail(const.CIRCUIT_FAILURE_THRESHOLD)
+        self._circuit().open_until = fields.Datetime.now() - timedelta(seconds=1)
+        self.env.flush_all()
+
+        self._fail(1, status_code=503)
+        circuit = self._circuit()
+        self.assertEqual(circuit.state, 'open')
+        self.assertGreater(circuit.open_until, fields.Datetime.now())
+
+    @mute_logger('odoo.addons.payment_djomy.models.djomy_endpoint_state')
+    def test_conflicting_circuit_update_does_not_fail_the_request(self):
+        self._fail(1)
+        # Un autre worker met à jour le circuit en même temps : la requête aboutit quand même.
+        with patch.object(
+            type(self.env['djomy.endpoint.state']), '_djomy_state_cursor',
+            side_effect=errors.SerializationFailure,
+        ):
+            self.assertEqual(self._request(), {'status': 'SUCCESS'})
+            self._fail(1)
+        self.assertEqual(self._circuit().failure_count, 1)
+
+    @mute_logger('odoo.addons.payment_djomy.models.payment_provider')
+    def test_expired_token_is_refreshed_on_401(self):
+        self.session.responses = [401, 200]
+        with patch.object(
+            type(self.provider), '_djomy_fetch_access_token', return_value='token'
+        ) as fetch_token:
+            response = self.provider._djomy_send_request_with_retry(
+                'GET', 'payments/tx-1/status', skip_auth=True
+            )
+        self.assertEqual(response, {'status': 'SUCCESS'})
+        fetch_token.assert_called_once()
+
+    def _held_slots(self):
+        self.env.cr.execute("""
+            SELECT count(*)
+              FROM pg_locks
+             WHERE locktype = 'advisory' AND pid = pg_backend_pid()
+               AND classid >= %s AND objid = %s AND objsubid = 2
+        """, [const.ADVISORY_LOCK_BULKHEAD, self.provider.id])
+        return self.env.cr.fetchone()[0]
+
+    def test_slot_is_held_during_the_call_only(self):
+        held_slots = []
+        self.session.on_request = lambda: held_slots.append(self._held_slots())
+        self._request()
+        self.assertEqual(held_slots, [1], "Un créneau est tenu pendant l'appel HTTP")
+        self.assertEqual(self._held_slots(), 0, "Le créneau est libéré après l'appel")
+
+    def test_concurrent_requests_take_one_slot_each(self):
+        self.env['ir.config_parameter'].sudo().set_param('djomy.bulkhead_slots.payments', 2)
+        hold_slots = type(self.provider)._djomy_hold_bulkhead_slots
+        taken_slots = []
+
+        @contextmanager
+        def spy(provider, endpoint_class, count=1):
+            with hold_slots(provider, endpoint_class, count) as taken:
+                taken_slots.append(taken)
+                yield taken
+
+        with patch.object(type(self.provider), '_djomy_hold_bulkhead_slots', spy), \
+                patch.object(type(self.provider), '_djomy_get_access_token', return_value='token'):
+            results = self.provider._djomy_send_concurrent_requests({
+                f'tx-{i}': ('GET', f'payments/tx-{i}/status', None) for i in range(3)
+            }, max_workers=4)
+        self.assertEqual(taken_slots, [2, 1], "Les requêtes au-delà des créneaux attendent")
+        self.assertEqual(self.session.calls, 3)
+        self.assertEqual(list(results.values()), [{'status': 'SUCCESS'}] * 3)
+        self.assertEqual(self._held_slots(), 0)
+
+    def test_full_bulkhead_fails_fast(self):
+        self.env['ir.config_parameter'].sudo().set_param('djomy.bulkhead_slots.payments', 0)
+        with self.assertRaises(DjomyAPIError) as error:
+            self._request()
+        self.assertTrue(error.exception.rejected)
+        self.assertEqual(self.session.calls, 0)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'application concurrente d'un statut à une même transaction.
+
+Le webhook, le retour client et le cron de rapprochement peuvent recevoir le
+même statut au même moment : une seule requête l'applique, les autres
+rendent la main aussitôt au lieu d'attendre le verrou puis d'échouer.
+"""
+import json
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.payment_djomy import const, metrics
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyConcurrentStatus(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        self.tx = self.env['payment.transaction'].create({
+            'reference': 'LOCK-TX',
+            'amount': 5000,
+            'currency_id': self.env.company.currency_id.id,
+            'provider_id': self.provider.id,
+            'payment_method_id': self.env.ref('payment_djomy.payment_method_djomy').id,
+            'partner_id': self.env['res.partner'].create({'name': 'Client Test'}).id,
+            'provider_reference': 'djomy-tx-1',
+        })
+        self.PaymentTransaction = type(self.tx)
+        self.counts = {result: self._count(result) for result in ('applied', 'unchanged', 'locked')}
+
+    def _payment_data(self, status='SUCCESS'):
+        return {
+            'transactionId': 'djomy-tx-1',
+            'merchantPaymentReference': self.tx.reference,
+            'status': status,
+            'paidAmount': 5000,
+            'currency': self.env.company.currency_id.name,
+        }
+
+    def _count(self, result):
+        return sum(
+            value for name, labels, value in metrics.registry.snapshot()['counters']
+            if name == 'djomy_status_updates_total' and labels == [('result', result)]
+        )
+
+    def _new_count(self, result):
+        return self._count(result) - self.counts[result]
+
+    def test_status_is_applied_under_lock(self):
+        self.assertTrue(self.tx._djomy_apply_status(self._payment_data()))
+        self.assertEqual(self.tx.state, 'done')
+        self.assertEqual(self._new_count('applied'), 1)
+        # Le verrou est déjà détenu par la transaction courante : il est repris.
+        self.assertTrue(self.tx._djomy_try_lock())
+
+    def test_locked_transaction_is_skipped(self):
+        with patch.object(self.PaymentTransaction, '_djomy_try_lock', return_value=False):
+            self.assertFalse(self.tx._djomy_apply_status(self._payment_data()))
+        self.assertEqual(self.tx.state, 'draft')
+        self.assertEqual(self._new_count('locked'), 1)
+
+    def test_status_already_applied_is_not_processed_again(self):
+        self.tx._djomy_apply_status(self._payment_data())
+        with patch.object(self.PaymentTransaction, '_process') as process:
+            self.assertTrue(self.tx._djomy_apply_status(self._payment_data()))
+        process.assert_not_called()
+        self.assertEqual(self._new_count('unchanged'), 1)
+
+    def test_webhook_notification_of_a_locked_transaction_is_retried(self):
+        def fetch_status(provider, transaction_id, allow_pending=True):
+            return self._payment_data()
+
+        with patch.object(type(self.provider), '_djomy_fetch_payment_status', fetch_status), \
+                patch.object(self.PaymentTransaction, '_djomy_try_lock', return_value=False):
+            error = self.tx._djomy_process_notification({
+                'eventType': 'payment.success', 'transactionId': 'djomy-tx-1',
+            })
+        self.assertEqual(error, 'locked', "La notification est rejouée une fois le verrou libéré")
+        self.assertEqual(self.tx.state, 'draft')
+
+    def test_locked_event_is_retried_shortly(self):
+        data = {'eventType': 'payment.success', 'transactionId': 'djomy-tx-1'}
+        event = self.env['djomy.webhook.event'].sudo()._enqueue(
+            self.tx, data, json.dumps(data).encode(), process_async=False,
+        )
+
+        def fetch_status(provider, transaction_id, allow_pending=True):
+            return self._payment_data()
+
+        with patch.object(type(self.provider), '_djomy_fetch_payment_status', fetch_status):
+            with patch.object(self.PaymentTransaction, '_djomy_try_lock', return_value=False):
+                event._process()
+            self.assertEqual(event.state, 'pending')
+            self.assertEqual(event.error, 'locked')
+            self.assertLessEqual(
+                event.next_attempt_date,
+                fields.Datetime.now() + timedelta(seconds=const.WEBHOOK_LOCKED_RETRY_DELAY),
+            )
+            event._process()
+        self.assertEqual(event.state, 'done')
+        self.assertEqual(self.tx.state, 'done')
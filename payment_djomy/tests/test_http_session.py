@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Tests de la session HTTP persistante des providers Djomy.
+
+Chaque worker garde une session par provider ; elle est reconstruite quand le
+provider ou la taille du pool changent, sans fermer l'ancienne qu'un autre
+thread peut encore utiliser.
+"""
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.payment_djomy.models import payment_provider as provider_module
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyHttpSession(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        patcher = patch.dict(provider_module._sessions, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertSessionRebuilt(self, change):
+        session = self.provider._djomy_get_session()
+        with patch.object(session, 'close') as close:
+            change()
+            new_session = self.provider._djomy_get_session()
+        self.assertIsNot(new_session, session)
+        close.assert_not_called()
+
+    def test_session_is_reused(self):
+        self.assertIs(self.provider._djomy_get_session(), self.provider._djomy_get_session())
+
+    def test_session_is_rebuilt_when_the_url_changes(self):
+        self.provider.djomy_partner_domain = 'shop.example.com'
+        self.assertSessionRebuilt(lambda: self.provider.write({'state': 'enabled'}))
+        self.assertEqual(
+            provider_module._sessions[self.cr.dbname, self.provider.id][0][0],
+            self.provider._djomy_get_api_url(),
+        )
+
+    def test_session_is_rebuilt_when_the_credentials_change(self):
+        self.assertSessionRebuilt(lambda: self.provider.write({'djomy_client_id': 'ci_other'}))
+        self.assertSessionRebuilt(lambda: self.provider.write({'djomy_client_secret': 'sec_other'}))
+
+    def test_session_is_rebuilt_when_the_pool_size_changes(self):
+        self.assertSessionRebuilt(
+            lambda: self.env['ir.config_parameter'].sudo().set_param('djomy.http_pool_size', 3)
+        )
+        adapter = self.provider._djomy_get_session().get_adapter('https://')
+        self.assertEqual(adapter._pool_maxsize, 3)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""Tests de la génération en masse des liens de paiement des factures.
+
+Les factures sont mises en file par l'action, puis le cron crée les liens
+par lots concurrents ; un lot interrompu ou en échec transitoire reprend au
+passage suivant, sans recréer les liens déjà obtenus. Un paiement reçu par
+le lien d'une facture est enregistré sur celle-ci.
+"""
+from unittest.mock import patch
+
+import requests
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests.common import tagged
+from odoo.tools import mute_logger
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy.utils import DjomyAPIError
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyInvoicePaymentLinks(AccountTestInvoicingCommon):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+            'company_id': self.env.company.id,
+        })
+        self.env['ir.config_parameter'].sudo().set_param('djomy.link_generation_rate', 10000)
+        self.invoices = self.env['account.move'].concat(*(
+            self.init_invoice('out_invoice', amounts=[1000 * (i + 1)], post=True)
+            for i in range(3)
+        ))
+        self.sent = []
+        self.failures = {}  # {invoice id: exception}
+
+        def send_concurrent_requests(provider, requests_by_key, max_workers):
+            self.sent.append(requests_by_key)
+            return {
+                key: self.failures.pop(key, None) or {
+                    'paymentLinkReference': f'LNK-{key}',
+                    'paymentPageUrl': f'https://pay.djomy.test/LNK-{key}',
+                }
+                for key in requests_by_key
+            }
+        self.send_concurrent_requests = type(self.provider)._djomy_send_concurrent_requests
+        patcher = patch.object(
+            type(self.provider), '_djomy_send_concurrent_requests', send_concurrent_requests
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run_cron(self):
+        self.env['account.move']._cron_djomy_generate_payment_links()
+        self.env.invalidate_all()
+
+    def _expire_claims(self):
+        """Simule l'écoulement du délai avant une nouvelle tentative."""
+        self.invoices.write({'djomy_link_claimed_until': fields.Datetime.now()})
+
+    def test_links_are_generated_and_stored(self):
+        self.invoices.action_djomy_generate_payment_links()
+        self.assertEqual(set(self.invoices.mapped('djomy_link_state')), {'pending'})
+        self._run_cron()
+
+        self.assertEqual(len(self.sent), 1, "Les liens d'un lot partent en une seule vague")
+        for invoice in self.invoices:
+            self.assertEqual(invoice.djomy_link_state, 'done')
+            self.assertEqual(invoice.djomy_link_reference, f'LNK-{invoice.id}')
+            self.assertEqual(invoice.djomy_link_amount, int(invoice.amount_residual))
+            payload = self.sent[0][invoice.id][2]
+            self.assertEqual(payload['merchantReference'], invoice.name)
+            self.assertEqual(payload['amountToPay'], int(invoice.amount_residual))
+
+    def test_existing_links_are_not_generated_again(self):
+        self.invoices.action_djomy_generate_payment_links()
+        self._run_cron()
+        new_invoice = self.init_invoice('out_invoice', amounts=[500], post=True)
+        (self.invoices | new_invoice).action_djomy_generate_payment_links()
+        self._run_cron()
+        self.assertEqual(list(self.sent[1]), new_invoice.ids)
+
+    def test_claimed_invoices_are_skipped(self):
+        self.invoices.action_djomy_generate_payment_links()
+        # Un autre passage a réservé la première facture, puis validé sa réservation.
+        self.invoices[0].djomy_link_claimed_until = fields.Datetime.add(
+            fields.Datetime.now(), seconds=const.LINK_GENERATION_CLAIM_DELAY
+        )
+        self._run_cron()
+        self.assertEqual(list(self.sent[0]), self.invoices[1:].ids)
+        self.assertEqual(self.invoices[0].djomy_link_state, 'pending')
+
+    def test_draft_invoices_are_refused(self):
+        draft = self.init_invoice('out_invoice', amounts=[1000])
+        with self.assertRaises(UserError):
+            draft.action_djomy_generate_payment_links()
+
+    @mute_logger('odoo.addons.payment_djomy.models.account_move')
+    def test_transient_failures_are_retried(self):
+        failing, refused = self.invoices[:2]
+        self.failures = {
+            failing.id: requests.exceptions.ConnectTimeout("timeout"),
+            refused.id: DjomyAPIError("Bad request", status_code=400),
+        }
+        self.invoices.action_djomy_generate_payment_links()
+        self._run_cron()
+        self.assertEqual(failing.djomy_link_state, 'pending')
+        self.assertEqual(failing.djomy_link_attempts, 1)
+        self.assertEqual(refused.djomy_link_state, 'error')
+        self.assertEqual(self.invoices[2].djomy_link_state, 'done')
+        self.assertEqual(len(self.sent), 1, "L'échec transitoire attend le passage suivant")
+        self._run_cron()
+        self.assertEqual(len(self.sent), 1, "La nouvelle tentative attend son délai")
+
+        # Reprise : seule la facture en échec est renvoyée.
+        self._expire_claims()
+        self._run_cron()
+        self.assertEqual(list(self.sent[1]), failing.ids)
+        self.assertEqual(failing.djomy_link_state, 'done')
+
+    def test_rejected_requests_do_not_count_as_attempts(self):
+        self.failures = {
+            invoice.id: DjomyAPIError("Circuit open", rejected=True) for invoice in self.invoices
+        }
+        self.invoices.action_djomy_generate_payment_links()
+        self._run_cron()
+        self.assertEqual(set(self.invoices.mapped('djomy_link_state')), {'pending'})
+        self.assertEqual(set(self.invoices.mapped('djomy_link_attempts')), {0})
+
+    @mute_logger('odoo.addons.payment_djomy.models.account_move')
+    def test_attempts_are_capped(self):
+        invoice = self.invoices[0]
+        invoice.action_djomy_generate_payment_links()
+        for _attempt in range(const.LINK_GENERATION_MAX_ATTEMPTS):
+            self.failures = {invoice.id: requests.exceptions.ConnectionError("down")}
+            self._expire_claims()
+            self._run_cron()
+        self.assertEqual(invoice.djomy_link_state, 'error')
+
+    @mute_logger('odoo.addons.payment_djomy.models.payment_provider')
+    def test_auth_failure_reschedules_the_batch(self):
+        # Les requêtes passent par le vrai envoi, dont l'état est écrit dans
+        # des curseurs dédiés : en mode test ils partagent la transaction du test.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        cron = self.env.ref('payment_djomy.cron_generate_invoice_payment_links')
+        triggers = self.env['ir.cron.trigger'].search([('cron_id', '=', cron.id)])
+        self.invoices.action_djomy_generate_payment_links()
+        with patch.object(
+            type(self.provider), '_djomy_send_concurrent_requests', self.send_concurrent_requests
+        ), patch.object(
+            type(self.provider), '_djomy_get_access_token',
+            side_effect=DjomyAPIError("Unauthorized", status_code=401),
+        ):
+            self._run_cron()
+        self.assertEqual(set(self.invoices.mapped('djomy_link_state')), {'pending'})
+        self.assertEqual(set(self.invoices.mapped('djomy_link_attempts')), {0})
+        self.assertGreater(
+            self.env['ir.cron.trigger'].search([('cron_id', '=', cron.id)]), triggers,
+            "Le lot est replanifié",
+        )
+
+    def test_link_payment_is_registered_on_the_invoice(self):
+        invoice = self.invoices[0]
+        invoice.action_djomy_generate_payment_links()
+        self._run_cron()
+        data = {
+            'eventType': 'payment.success',
+            'data': {'paymentLinkReference': f'LNK-{invoice.id}', 'transactionId': 'djomy-lnk-1'},
+        }
+        Transaction = self.env['payment.transaction'].sudo()
+        tx = Transaction._djomy_search_payment_link(data)
+        self.assertEqual(tx.invoice_ids, invoice)
+        self.assertEqual(tx.amount, int(invoice.amount_residual))
+
+        with patch.object(type(self.provider), '_djomy_fetch_payment_status', return_value={
+            'transactionId': 'djomy-lnk-1',
+            'status': 'SUCCESS',
+            'paidAmount': tx.amount,
+            'currency': invoice.currency_id.name,
+        }):
+            self.assertIsNone(tx._djomy_process_notification(data))
+        self.assertEqual(tx.state, 'done')
+        self.assertEqual(
+            Transaction._djomy_search_payment_link(data), tx,
+            "Les notifications suivantes retrouvent la transaction",
+        )
+
+        tx._post_process()
+        self.assertTrue(tx.payment_id)
+        self.assertIn(invoice.payment_state, ('in_payment', 'paid'))
+
+    def test_link_payment_is_for_the_amount_of_the_link(self):
+        invoice = self.invoices[0]
+        invoice.action_djomy_generate_payment_links()
+        self._run_cron()
+        # Le reste dû a changé depuis la création du lien, dont le montant ne change pas.
+        invoice.djomy_link_amount = 400
+        tx = self.env['payment.transaction'].sudo()._djomy_search_payment_link({
+            'eventType': 'payment.success',
+            'data': {
+                'paymentLinkReference': f'LNK-{invoice.id}',
+                'transactionId': 'djomy-lnk-1',
+                'paidAmount': 400,
+            },
+        })
+        self.assertEqual(tx.amount, 400)
+
+    def test_unknown_link_is_not_routed(self):
+        self.assertIsNone(self.env['payment.transaction'].sudo()._djomy_search_payment_link({
+            'eventType': 'payment.success',
+            'data': {'paymentLinkReference': 'LNK-UNKNOWN', 'transactionId': 'djomy-lnk-1'},
+        }))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Tests des métriques Djomy et de leur exposition au format Prometheus.
+
+Les métriques sont enregistrées en mémoire par chaque worker ; la route
+`/payment/djomy/metrics` les agrège et n'est servie qu'avec le jeton
+configuré dans `djomy.metrics_token`.
+"""
+import tempfile
+
+from odoo.tests.common import BaseCase, HttpCase, tagged
+
+from odoo.addons.payment_djomy import metrics
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyMetricsRegistry(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.registry = metrics.MetricsRegistry(directory.name)
+
+    def test_histogram_is_rendered_with_cumulative_buckets(self):
+        self.registry.observe('djomy_api_request_duration_seconds', 0.02, endpoint='links')
+        self.registry.observe('djomy_api_request_duration_seconds', 3, endpoint='links')
+        text = self.registry.render()
+        labels = 'endpoint="links"'
+        self.assertIn(f'djomy_api_request_duration_seconds_bucket{{{labels},le="0.025"}} 1', text)
+        self.assertIn(f'djomy_api_request_duration_seconds_bucket{{{labels},le="5"}} 2', text)
+        self.assertIn(f'djomy_api_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn(f'djomy_api_request_duration_seconds_count{{{labels}}} 2', text)
+
+    def test_counters_are_kept_by_label(self):
+        self.registry.inc('djomy_api_requests_total', endpoint='links', status=200)
+        self.registry.inc('djomy_api_requests_total', endpoint='links', status=200)
+        self.registry.inc('djomy_api_requests_total', endpoint='links', status='timeout')
+        text = self.registry.render()
+        self.assertIn('djomy_api_requests_total{endpoint="links",status="200"} 2', text)
+        self.assertIn('djomy_api_requests_total{endpoint="links",status="timeout"} 1', text)
+
+    def test_timed_counts_the_errors(self):
+        @metrics.timed('djomy_route_duration_seconds', 'djomy_route_errors_total', route='test')
+        def failing_route():
+            raise ValueError()
+
+        before = self._get_counter(metrics.registry, 'djomy_route_errors_total', route='test')
+        with self.assertRaises(ValueError):
+            failing_route()
+        after = self._get_counter(metrics.registry, 'djomy_route_errors_total', route='test')
+        self.assertEqual(after, before + 1)
+
+    def _get_counter(self, registry, name, **labels):
+        return next(
+            (value for counter_name, counter_labels, value in registry.snapshot()['counters']
+             if counter_name == name and dict(counter_labels) == labels),
+            0,
+        )
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyMetricsRoute(HttpCase):
+
+    def test_route_is_disabled_without_token(self):
+        self.env['ir.config_parameter'].sudo().set_param('djomy.metrics_token', False)
+        self.assertEqual(self.url_open('/payment/djomy/metrics').status_code, 404)
+
+    def test_route_requires_the_token(self):
+        self.env['ir.config_parameter'].sudo().set_param('djomy.metrics_token', 's3cret')
+        response = self.url_open('/payment/djomy/metrics', headers={'Authorization': 'Bearer bad'})
+        self.assertEqual(response.status_code, 403)
+
+        response = self.url_open(
+            '/payment/djomy/metrics', headers={'Authorization': 'Bearer s3cret'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE djomy_api_request_duration_seconds histogram', response.text)
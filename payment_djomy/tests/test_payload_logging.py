@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Tests de la journalisation des payloads Djomy.
+
+Les payloads ne sont formatés que s'ils sont journalisés, leurs données
+personnelles sont masquées, et les derniers reçus sont gardés en mémoire
+dans un tampon borné par fournisseur.
+"""
+import logging
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.payment_djomy import const, payload_log
+
+
+_logger = logging.getLogger('odoo.addons.payment_djomy.tests.payload')
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyPayloadLogging(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.payload = {
+            'eventType': 'payment.success',
+            'transactionId': 'djomy-tx-1',
+            'payerNumber': '00224620000012',
+            'customer': {'name': 'Client Test', 'email': 'client@example.com'},
+        }
+        # Tampon propre au test, pour ne pas dépendre des requêtes précédentes.
+        patcher = patch.object(payload_log, '_buffers', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _log(self, payload, sample_rate=0.0):
+        payload_log.log_payload(
+            _logger, 'webhook', payload, self.env.cr.dbname,
+            provider_id=self.provider.id, sample_rate=sample_rate,
+        )
+
+    def test_personal_data_is_redacted(self):
+        redacted = payload_log.redact(self.payload)
+        self.assertEqual(redacted['payerNumber'], '************12')
+        self.assertEqual(redacted['customer'], {'name': '***', 'email': '***'})
+        self.assertEqual(redacted['transactionId'], 'djomy-tx-1')
+        self.assertEqual(self.payload['payerNumber'], '00224620000012', "L'original est intact")
+
+    def test_payload_is_not_formatted_unless_logged(self):
+        _logger.setLevel(logging.INFO)
+        self.addCleanup(_logger.setLevel, logging.NOTSET)
+        with patch.object(payload_log, 'redact') as redact:
+            self._log(self.payload)
+        redact.assert_not_called()
+
+    def test_sampled_payloads_are_logged_redacted(self):
+        with self.assertLogs(_logger, logging.INFO) as logs:
+            self._log(self.payload, sample_rate=1.0)
+        self.assertIn('************12', logs.output[0])
+        self.assertNotIn('00224620000012', logs.output[0])
+
+    def test_buffer_keeps_the_last_payloads_of_the_provider(self):
+        with patch.object(const, 'PAYLOAD_BUFFER_SIZE', 3):
+            for i in range(5):
+                self._log({'transactionId': f'djomy-tx-{i}', 'payerNumber': '620000012'})
+        payloads = self.provider._djomy_get_recent_payloads()
+        self.assertEqual(
+            [payload['transactionId'] for _ts, _source, payload in payloads],
+            ['djomy-tx-4', 'djomy-tx-3', 'djomy-tx-2'],
+        )
+        self.assertEqual(payloads[0][2]['payerNumber'], '*******12')
+        raw = self.provider._djomy_get_recent_payloads(redacted=False)
+        self.assertEqual(raw[0][2]['payerNumber'], '620000012')
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Tests du cron de rapprochement des transactions Djomy en attente.
+
+Le cron réclame par lots les transactions dont la vérification est due,
+interroge Djomy sur leur statut, applique les statuts finaux et replanifie
+les autres avec un back-off exponentiel plafonné.
+"""
+from datetime import timedelta
+from unittest.mock import patch
+
+import requests
+
+from odoo import fields
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy.models import payment_provider as provider_module
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyPendingReconciliation(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        self.partner = self.env['res.partner'].create({'name': 'Client Test'})
+        self.cron = self.env.ref('payment_djomy.cron_reconcile_pending_transactions')
+        self.statuses = {}  # {référence Djomy: statut ou exception}
+        self.sent = []
+
+        def send_concurrent_requests(provider, requests_by_key, max_workers):
+            self.sent.append(sorted(requests_by_key))
+            results = {}
+            for key, (_method, endpoint, _payload) in requests_by_key.items():
+                status = self.statuses.get(endpoint.split('/')[1], 'PENDING')
+                results[key] = status if isinstance(status, Exception) else {
+                    'status': status,
+                    'paidAmount': 5000,
+                    'currency': self.env.company.currency_id.name,
+                }
+            return results
+
+        patcher = patch.object(
+            type(self.provider), '_djomy_send_concurrent_requests', send_concurrent_requests
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Les statuts partagés sont écrits dans des curseurs dédiés : en mode
+        # test ils partagent la transaction du test.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        provider_module._status_cache.clear()
+        self.addCleanup(provider_module._status_cache.clear)
+
+    # --- Helpers --------------------------------------------------------
+
+    def _tx(self, reference, provider_reference=True, **values):
+        return self.env['payment.transaction'].create({
+            'reference': reference,
+            'amount': 5000,
+            'currency_id': self.env.company.currency_id.id,
+            'provider_id': self.provider.id,
+            'payment_method_id': self.env.ref('payment_djomy.payment_method_djomy').id,
+            'partner_id': self.partner.id,
+            'provider_reference': provider_reference and f'djomy-{reference}',
+            'state': 'pending',
+            **values,
+        })
+
+    def _run_cron(self):
+        self.env['payment.transaction']._cron_djomy_reconcile_pending_transactions()
+        self.env.invalidate_all()
+
+    def _make_due(self, txs):
+        txs.write({'djomy_next_check': fields.Datetime.now() - timedelta(seconds=1)})
+
+    def assertNextCheckIn(self, tx, delay):
+        self.assertAlmostEqual(
+            tx.djomy_next_check,
+            fields.Datetime.now() + timedelta(seconds=delay),
+            delta=timedelta(seconds=5),
+        )
+
+    # --- Réclamation ----------------------------------------------------
+
+    def test_only_due_transactions_are_claimed(self):
+        due = self._tx('REC-1') | self._tx('REC-2', state='draft')
+        self._tx('REC-3', djomy_next_check=fields.Datetime.now() + timedelta(hours=1))
+        self._tx('REC-4', provider_reference=False)
+        self._tx('REC-5', state='done')
+        self._run_cron()
+        self.assertEqual(self.sent, [sorted(due.ids)])
+
+    def test_claimed_transactions_are_not_claimed_again(self):
+        tx = self._tx('REC-1')
+        with patch.object(type(tx), '_djomy_try_lock', return_value=False):
+            self._run_cron()
+        # Verrouillée par une autre requête : elle garde sa réclamation.
+        self.assertNextCheckIn(tx, const.RECONCILE_CLAIM_DELAY)
+        self.assertEqual(tx.djomy_check_count, 0)
+        self._run_cron()
+        self.assertEqual(len(self.sent), 1, "La transaction réclamée n'est pas reprise aussitôt")
+
+    # --- Statuts et back-off --------------------------------------------
+
+    def test_final_status_is_applied(self):
+        tx = self._tx('REC-1')
+        self.statuses = {'djomy-REC-1': 'SUCCESS'}
+        self._run_cron()
+        self.assertEqual(tx.state, 'done')
+        self.assertEqual(tx.djomy_check_count, 0, "Une transaction confirmée n'est pas replanifiée")
+        self.assertEqual(
+            self.provider._djomy_fetch_payment_status('djomy-REC-1')['status'], 'SUCCESS',
+            "Le statut est partagé avec le cache",
+        )
+
+    def test_backoff_doubles_at_each_check(self):
+        tx = self._tx('REC-1')
+        for check_count in (1, 2, 3):
+            self._run_cron()
+            self.assertEqual(tx.state, 'pending')
+            self.assertEqual(tx.djomy_check_count, check_count)
+            self.assertNextCheckIn(tx, const.RECONCILE_BACKOFF_MIN * 2 ** (check_count - 1))
+            self._make_due(tx)
+
+    def test_backoff_is_capped(self):
+        tx = self._tx('REC-1', djomy_check_count=30)
+        self._run_cron()
+        self.assertEqual(tx.djomy_check_count, 31)
+        self.assertNextCheckIn(tx, const.RECONCILE_BACKOFF_MAX)
+
+    def test_failed_requests_do_not_hold_back_the_others(self):
+        failed, confirmed, pending = self._tx('REC-1'), self._tx('REC-2'), self._tx('REC-3')
+        self.statuses = {
+            'djomy-REC-1': requests.exceptions.ReadTimeout("timeout"),
+            'djomy-REC-2': 'SUCCESS',
+        }
+        self._run_cron()
+        self.assertEqual(confirmed.state, 'done')
+        for tx in failed | pending:
+            self.assertEqual(tx.state, 'pending')
+            self.assertEqual(tx.djomy_check_count, 1, "Replanifiée avec back-off")
+            self.assertNextCheckIn(tx, const.RECONCILE_BACKOFF_MIN)
+
+    # --- Budget de temps ------------------------------------------------
+
+    def test_cron_reschedules_itself_past_its_time_budget(self):
+        txs = self._tx('REC-1') | self._tx('REC-2')
+        triggers = self.env['ir.cron.trigger'].search([('cron_id', '=', self.cron.id)])
+        with patch.object(const, 'RECONCILE_BATCH_SIZE', 1), \
+                patch.object(const, 'RECONCILE_TIME_BUDGET', -1):
+            self._run_cron()
+        self.assertEqual(self.sent, [[txs[0].id]], "Un seul lot avant l'épuisement du budget")
+        self.assertGreater(
+            self.env['ir.cron.trigger'].search([('cron_id', '=', self.cron.id)]), triggers,
+            "Le cron se redéclenche pour les transactions restantes",
+        )
+        self._run_cron()
+        self.assertEqual(self.sent[-1], [txs[1].id])
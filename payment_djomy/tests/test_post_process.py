@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Tests du post-traitement différé des transactions Djomy confirmées.
+
+Le webhook ne fait plus la comptabilité : la confirmation déclenche un cron
+qui post-traite par lots les transactions confirmées entre-temps.
+"""
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase, tagged
+from odoo.tools import mute_logger
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyPostProcess(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        self.partner = self.env['res.partner'].create({'name': 'Client Test'})
+        self.cron = self.env.ref('payment_djomy.cron_post_process_transactions')
+        self.PaymentTransaction = type(self.env['payment.transaction'])
+        self.post_processed_batches = []
+
+    # --- Helpers --------------------------------------------------------
+
+    def _tx(self, reference):
+        return self.env['payment.transaction'].create({
+            'reference': reference,
+            'amount': 5000,
+            'currency_id': self.env.company.currency_id.id,
+            'provider_id': self.provider.id,
+            'payment_method_id': self.env.ref('payment_djomy.payment_method_djomy').id,
+            'partner_id': self.partner.id,
+        })
+
+    def _confirm(self, tx):
+        tx._process('djomy', {
+            'transactionId': f'djomy-{tx.reference}',
+            'merchantPaymentReference': tx.reference,
+            'status': 'SUCCESS',
+            'paidAmount': 5000,
+            'currency': self.env.company.currency_id.name,
+        })
+
+    def _patch_post_process(self, failing=()):
+        test = self
+        post_process = self.PaymentTransaction._post_process
+
+        def fake(txs):
+            test.post_processed_batches.append(txs.ids)
+            if set(failing) & set(txs.ids):
+                raise ValueError("Accounting failure")
+            return post_process(txs)
+
+        return patch.object(self.PaymentTransaction, '_post_process', fake)
+
+    def _triggers(self):
+        return self.env['ir.cron.trigger'].search([('cron_id', '=', self.cron.id)])
+
+    # --- Cas nominal ----------------------------------------------------
+
+    def test_confirmation_defers_post_processing(self):
+        tx = self._tx('PP-1')
+        triggers = self._triggers()
+        with self._patch_post_process():
+            self._confirm(tx)
+        self.assertEqual(tx.state, 'done')
+        self.assertFalse(tx.is_post_processed)
+        self.assertFalse(self.post_processed_batches, "Rien n'est post-traité en ligne")
+        self.assertGreater(self._triggers(), triggers, "Le cron est déclenché")
+
+    def test_cron_post_processes_in_batches(self):
+        txs = self._tx('PP-1') | self._tx('PP-2') | self._tx('PP-3')
+        for tx in txs:
+            self._confirm(tx)
+        with self._patch_post_process():
+            self.env['payment.transaction']._cron_djomy_post_process()
+        self.assertEqual(self.post_processed_batches, [txs.ids])
+        self.assertTrue(all(txs.mapped('is_post_processed')))
+
+    @mute_logger('odoo.addons.payment_djomy.models.payment_transaction')
+    def test_faulty_transaction_does_not_hold_back_the_batch(self):
+        faulty, healthy = self._tx('PP-1'), self._tx('PP-2')
+        for tx in faulty | healthy:
+            self._confirm(tx)
+        with self._patch_post_process(failing=faulty.ids):
+            self.env['payment.transaction']._cron_djomy_post_process()
+        self.assertTrue(healthy.is_post_processed)
+        self.assertFalse(faulty.is_post_processed)
+        # Le lot, puis chaque transaction ; la fautive n'est pas reprise en boucle.
+        self.assertEqual(
+            self.post_processed_batches, [(faulty | healthy).ids, faulty.ids, healthy.ids]
+        )
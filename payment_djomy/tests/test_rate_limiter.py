@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Tests du limiteur de débit des appels sortants Djomy.
+
+Chaque classe d'endpoints dispose d'un seau de jetons partagé par les
+workers ; les appels de fond (crons) laissent une part du seau aux appels
+interactifs (caisse, paiement en ligne), et une réponse 429 suspend les
+appels pendant le délai `Retry-After` demandé par Djomy.
+"""
+from datetime import timedelta
+from unittest.mock import patch
+
+from psycopg2 import errors
+
+from odoo import fields
+from odoo.tests.common import tagged
+from odoo.tools import mute_logger
+
+from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy.tests.common import DjomyRequestCase
+from odoo.addons.payment_djomy.utils import DjomyAPIError
+
+
+@tagged('post_install', '-at_install')
+@mute_logger('odoo.addons.payment_djomy.models.payment_provider',
+             'odoo.addons.payment_djomy.models.djomy_endpoint_state')
+class TestDjomyRateLimiter(DjomyRequestCase):
+
+    def setUp(self):
+        super().setUp()
+        # 1 requête par seconde : un seau de 2 jetons, dont 1 réservé à l'interactif.
+        self.env['ir.config_parameter'].sudo().set_param('djomy.rate_limit.payments', 1)
+        for patcher in (
+            patch.object(const, 'RATE_LIMIT_MAX_WAIT', 0),
+            patch.object(const, 'RATE_LIMIT_MAX_WAIT_BACKGROUND', 0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _request(self, provider=None):
+        return (provider or self.provider)._send_api_request(
+            'GET', 'payments/tx-1/status', skip_auth=True
+        )
+
+    def _state(self):
+        self.env.invalidate_all()
+        return self.env['djomy.endpoint.state'].search([
+            ('provider_id', '=', self.provider.id), ('endpoint_class', '=', 'payments'),
+        ])
+
+    def test_requests_beyond_the_burst_are_rejected(self):
+        self._request()
+        self._request()
+        with self.assertRaises(DjomyAPIError) as error:
+            self._request()
+        self.assertTrue(error.exception.rejected)
+        self.assertGreater(error.exception.retry_after, 0)
+        self.assertEqual(self.session.calls, 2, "La requête rejetée n'est pas envoyée")
+
+    def test_background_requests_leave_a_share_to_interactive_ones(self):
+        background_provider = self.provider.with_context(djomy_request_priority='background')
+        self._request(background_provider)
+        with self.assertRaises(DjomyAPIError):
+            self._request(background_provider)
+        # Le jeton réservé reste disponible pour une requête interactive.
+        self._request()
+        self.assertEqual(self.session.calls, 2)
+
+    def test_throttled_requests_honour_retry_after(self):
+        self.session.responses = [(429, 120)]
+        with self.assertRaises(DjomyAPIError) as error:
+            self._request()
+        self.assertTrue(error.exception.is_throttled)
+        self.assertGreater(
+            self._state().throttled_until, fields.Datetime.now() + timedelta(seconds=60)
+        )
+        with self.assertRaises(DjomyAPIError) as error:
+            self._request()
+        self.assertTrue(error.exception.rejected)
+        self.assertEqual(self.session.calls, 1, "Rien n'est envoyé avant la fin du délai")
+
+    def test_throttled_request_is_retried_once(self):
+        self.session.responses = [(429, 0), (200, None)]
+        # La 429 vide le seau : la nouvelle tentative attend le jeton suivant.
+        with patch.object(const, 'RATE_LIMIT_MAX_WAIT', 3), \
+                patch.object(type(self.provider), '_build_request_headers', return_value={}):
+            response = self.provider._djomy_send_request_with_retry(
+                'GET', 'payments/tx-1/status'
+            )
+        self.assertEqual(response['status'], 'SUCCESS')
+        self.assertEqual(self.session.calls, 2)
+
+    def test_conflicting_worker_rejects_the_request(self):
+        # Un autre worker a modifié le seau : la requête est rejetée, sans erreur SQL brute.
+        with patch.object(
+            type(self.env['djomy.endpoint.state']), '_djomy_state_cursor',
+            side_effect=errors.SerializationFailure,
+        ), self.assertRaises(DjomyAPIError) as error:
+            self._request()
+        self.assertTrue(error.exception.rejected)
+        self.assertEqual(self.session.calls, 0)
+
+    def test_concurrent_requests_are_only_sent_as_tokens_allow(self):
+        with patch.object(type(self.provider), '_build_request_headers', return_value={}):
+            results = self.provider._djomy_send_concurrent_requests({
+                i: ('GET', f'payments/tx-{i}/status', None) for i in range(4)
+            }, max_workers=4)
+        self.assertEqual(self.session.calls, 2)
+        self.assertEqual(
+            [isinstance(results[i], DjomyAPIError) and results[i].rejected for i in range(4)],
+            [False, False, True, True],
+        )
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'export de rapprochement Djomy / Odoo.
+
+Les paiements listés par Djomy sont fusionnés avec les transactions Odoo
+sur l'identifiant de transaction Djomy ; seuls les écarts sont écrits.
+"""
+import csv
+import io
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.payment_djomy import const
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyReconciliation(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        self.partner = self.env['res.partner'].create({'name': 'Client Test'})
+        self.date_from = fields.Datetime.now() - timedelta(days=1)
+        self.date_to = fields.Datetime.now() + timedelta(days=1)
+        self.payments = []
+        self.pages_requested = []
+
+    # --- Helpers --------------------------------------------------------
+
+    def _tx(self, reference, state='done', amount=5000):
+        tx = self.env['payment.transaction'].create({
+            'reference': reference,
+            'amount': amount,
+            'currency_id': self.env.company.currency_id.id,
+            'provider_id': self.provider.id,
+            'payment_method_id': self.env.ref('payment_djomy.payment_method_djomy').id,
+            'partner_id': self.partner.id,
+            'provider_reference': f'djomy-{reference}',
+        })
+        tx.state = state
+        return tx
+
+    def _payment(self, reference, status='SUCCESS', amount=5000):
+        self.payments.append({
+            'transactionId': f'djomy-{reference}',
+            'merchantPaymentReference': reference,
+            'status': status,
+            'paidAmount': amount,
+            'currency': 'GNF',
+        })
+
+    def _export(self):
+        test = self
+
+        def fake(provider, method, endpoint, params=None, **kwargs):
+            test.pages_requested.append(params['page'])
+            start = params['page'] * params['size']
+            return {'content': test.payments[start:start + params['size']]}
+
+        output = io.StringIO()
+        with patch.object(type(self.provider), '_djomy_send_request_with_retry', fake):
+            counts = self.provider._djomy_export_reconciliation(
+                output, self.date_from, self.date_to
+            )
+        output.seek(0)
+        return counts, {row['djomy_transaction_id'] or row['odoo_reference']: row['issue']
+                        for row in csv.DictReader(output)}
+
+    # --- Cas -------------------------------------------------------------
+
+    def test_only_mismatches_are_exported(self):
+        self._tx('REC-OK')
+        self._payment('REC-OK')
+        self._tx('REC-STATUS', state='pending')
+        self._payment('REC-STATUS')
+        self._tx('REC-AMOUNT')
+        self._payment('REC-AMOUNT', amount=4000)
+        self._payment('REC-REMOTE')
+        self._tx('REC-LOCAL')
+
+        counts, issues = self._export()
+        self.assertEqual(counts, (5, 4))
+        self.assertEqual(issues, {
+            'djomy-REC-STATUS': 'status_mismatch',
+            'djomy-REC-AMOUNT': 'amount_mismatch',
+            'djomy-REC-REMOTE': 'missing_in_odoo',
+            'REC-LOCAL': 'missing_in_djomy',
+        })
+
+    def test_pending_payments_match_draft_transactions(self):
+        self._tx('REC-DRAFT', state='draft')
+        self._payment('REC-DRAFT', status='PENDING')
+        self.assertEqual(self._export(), ((1, 0), {}))
+
+    def test_listing_is_paged(self):
+        with patch.object(const, 'RECONCILIATION_PAGE_SIZE', 2):
+            for i in range(5):
+                self._tx(f'REC-{i}')
+                self._payment(f'REC-{i}')
+            counts, issues = self._export()
+        self.assertEqual(self.pages_requested, [0, 1, 2])
+        self.assertEqual(counts, (5, 0))
+        self.assertFalse(issues)
+
+    def test_transactions_outside_the_period_are_ignored(self):
+        tx = self._tx('REC-OLD')
+        self.env.cr.execute(
+            "UPDATE payment_transaction SET create_date = %s WHERE id = %s",
+            [datetime(2020, 1, 1), tx.id],
+        )
+        self.assertEqual(self._export(), ((0, 0), {}))
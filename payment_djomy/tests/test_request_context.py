@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Tests du cache de résolution du provider Djomy.
+
+Le provider d'une société et la partie statique des requêtes (URL, signature,
+domaine partenaire) sont calculés une fois par worker, puis invalidés quand un
+provider Djomy est modifié.
+"""
+from odoo.tests.common import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyRequestContext(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'djomy_partner_domain': 'shop.example.com',
+            'state': 'test',
+            'company_id': self.env.company.id,
+        })
+        self.Provider = self.env['payment.provider']
+
+    def test_provider_is_resolved_without_query(self):
+        company_id = self.env.company.id
+        self.assertEqual(self.Provider._djomy_get_provider_id(company_id), self.provider.id)
+        with self.assertQueryCount(0):
+            self.assertEqual(self.Provider._djomy_get_provider_id(company_id), self.provider.id)
+
+    def test_request_headers_use_the_cached_context(self):
+        self.provider._djomy_get_request_context()
+        with self.assertQueryCount(0):
+            headers = self.provider._build_request_headers('GET', 'links', None, skip_auth=True)
+        self.assertEqual(headers['X-API-KEY'], self.provider._djomy_generate_signature())
+        self.assertEqual(headers['X-PARTNER-DOMAIN'], 'shop.example.com')
+
+    def test_context_is_invalidated_when_the_provider_changes(self):
+        self.provider._djomy_get_request_context()
+        self.provider.djomy_partner_domain = 'other.example.com'
+        headers = self.provider._build_request_headers('GET', 'links', None, skip_auth=True)
+        self.assertEqual(headers['X-PARTNER-DOMAIN'], 'other.example.com')
+
+    def test_provider_resolution_is_invalidated_on_create(self):
+        company = self.env['res.company'].create({'name': "Djomy Test Company"})
+        self.assertFalse(self.Provider._djomy_get_provider_id(company.id))
+        provider = self.provider.copy({'company_id': company.id})
+        self.assertEqual(self.Provider._djomy_get_provider_id(company.id), provider.id)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Tests des délais de connexion et de lecture par classe d'endpoints.
+
+Chaque classe a ses propres délais, surchargeables par paramètre système,
+pour qu'un appel lent ne retienne pas un worker au-delà de son budget.
+"""
+from odoo.tests.common import tagged
+from odoo.tools import mute_logger
+
+from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy.tests.common import DjomyRequestCase
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyRequestTimeouts(DjomyRequestCase):
+
+    def test_each_endpoint_class_has_its_timeouts(self):
+        self.provider._send_api_request('GET', 'payments/tx-1/status', skip_auth=True)
+        self.provider._send_api_request('GET', 'links/LNK-1', skip_auth=True)
+        self.assertEqual(
+            self.session.timeouts, [const.HTTP_TIMEOUTS['payments'], const.HTTP_TIMEOUTS['links']]
+        )
+
+    def test_timeouts_can_be_overridden(self):
+        self.env['ir.config_parameter'].sudo().set_param('djomy.timeout.links', '2,4.5')
+        self.provider._send_api_request('GET', 'links/LNK-1', skip_auth=True)
+        self.assertEqual(self.session.timeouts, [(2.0, 4.5)])
+
+    @mute_logger('odoo.addons.payment_djomy.models.payment_provider')
+    def test_invalid_timeouts_fall_back_to_the_defaults(self):
+        self.env['ir.config_parameter'].sudo().set_param('djomy.timeout.links', 'fast')
+        self.assertEqual(
+            self.provider._djomy_get_timeout('links'), const.HTTP_TIMEOUTS['links']
+        )
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'URL de retour signée.
+
+L'URL de retour porte l'id de la transaction et un jeton d'accès : le
+contrôleur la résout par clé primaire, sans jamais retomber sur « la tx en
+attente la plus récente », qui pouvait appartenir à un autre client.
+"""
+from unittest.mock import patch
+
+from odoo.tests.common import HttpCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyReturnUrl(HttpCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        partner = self.env['res.partner'].create({'name': 'Client Test'})
+        tx_vals = {
+            'amount': 5000,
+            'currency_id': self.env.company.currency_id.id,
+            'provider_id': self.provider.id,
+            'payment_method_id': self.env.ref('payment_djomy.payment_method_djomy').id,
+            'partner_id': partner.id,
+            'state': 'pending',
+        }
+        self.tx = self.env['payment.transaction'].create({
+            **tx_vals, 'reference': 'RETURN-TX', 'provider_reference': 'djomy-tx-1',
+        })
+        # Tx en attente plus récente d'un autre client : ne doit jamais être touchée.
+        self.other_tx = self.env['payment.transaction'].create({
+            **tx_vals, 'reference': 'OTHER-TX',
+        })
+
+    def _patch_status(self, status):
+        def fake(provider, transaction_id, allow_pending=True):
+            return {'transactionId': transaction_id, 'status': status, 'paidAmount': 5000}
+
+        return patch.object(type(self.provider), '_djomy_fetch_payment_status', fake)
+
+    def test_signed_return_url_resolves_its_transaction(self):
+        with self._patch_status('FAILED'):
+            self.url_open(self.tx._djomy_get_return_path(), allow_redirects=False)
+        self.env.invalidate_all()
+        self.assertEqual(self.tx.state, 'error')
+        self.assertEqual(self.other_tx.state, 'pending')
+
+    def test_forged_token_is_rejected(self):
+        response = self.url_open(
+            f'/payment/djomy/return/{self.tx.id}/forged', allow_redirects=False,
+        )
+        self.assertEqual(response.status_code, 403)
+        self.env.invalidate_all()
+        self.assertEqual(self.tx.state, 'pending')
+
+    def test_unknown_transaction_id_never_falls_back(self):
+        with self._patch_status('FAILED'):
+            self.url_open(
+                '/payment/djomy/return?transactionId=unknown&status=FAILED',
+                allow_redirects=False,
+            )
+        self.env.invalidate_all()
+        self.assertEqual(self.other_tx.state, 'pending')
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Tests du cache des statuts de paiement Djomy.
+
+Un statut final est gardé longtemps, un statut en attente quelques secondes ;
+les requêtes concurrentes sur un même paiement partagent un seul appel. Le
+cache en mémoire de chaque worker est adossé à une table partagée par tous.
+"""
+import threading
+import time
+from unittest.mock import patch
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.payment_djomy.models import payment_provider as provider_module
+from odoo.addons.payment_djomy.tests.common import DjomyRequestCase
+from odoo.addons.payment_djomy.utils import SingleFlightCache
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyStatusCache(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = SingleFlightCache(max_size=3)
+        self.calls = 0
+
+    def _compute(self, status='PENDING', delay=0):
+        def compute():
+            self.calls += 1
+            time.sleep(delay)
+            return {'status': status}
+        return compute
+
+    def test_value_is_served_until_it_expires(self):
+        now = time.monotonic()
+        self.cache.get_or_compute('tx', self._compute(), lambda v: 3)
+        self.cache.get_or_compute('tx', self._compute(), lambda v: 3)
+        self.assertEqual(self.calls, 1)
+        with patch('time.monotonic', return_value=now + 10):
+            self.cache.get_or_compute('tx', self._compute(), lambda v: 3)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.cache.get_stats()['hits'], 1)
+        self.assertEqual(self.cache.get_stats()['misses'], 2)
+
+    def test_unusable_value_is_computed_again(self):
+        self.cache.get_or_compute('tx', self._compute('PENDING'), lambda v: 60)
+        value = self.cache.get_or_compute(
+            'tx', self._compute('SUCCESS'), lambda v: 60,
+            is_usable=lambda v: v['status'] == 'SUCCESS',
+        )
+        self.assertEqual(value['status'], 'SUCCESS')
+        self.assertEqual(self.calls, 2)
+
+    def test_concurrent_lookups_share_one_computation(self):
+        results = []
+
+        def lookup():
+            results.append(self.cache.get_or_compute(
+                'tx', self._compute('SUCCESS', delay=0.2), lambda v: 60, timeout=5,
+            ))
+
+        threads = [threading.Thread(target=lookup) for _i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.cache.get_stats()['coalesced'], 4)
+
+    def test_failure_is_not_cached(self):
+        def fail():
+            self.calls += 1
+            raise ValueError("Djomy down")
+
+        with self.assertRaises(ValueError):
+            self.cache.get_or_compute('tx', fail, lambda v: 60)
+        self.cache.get_or_compute('tx', self._compute(), lambda v: 60)
+        self.assertEqual(self.calls, 2)
+
+    def test_cache_size_is_bounded(self):
+        for key in range(10):
+            self.cache.get_or_compute(key, self._compute(), lambda v: 60)
+        self.assertEqual(self.cache.get_stats()['size'], 3)
+
+
+@tagged('post_install', '-at_install')
+class TestDjomySharedStatusCache(DjomyRequestCase):
+
+    def setUp(self):
+        super().setUp()
+        provider_module._status_cache.clear()
+        self.addCleanup(provider_module._status_cache.clear)
+        patcher = patch.object(type(self.provider), '_build_request_headers', return_value={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_status_is_shared_by_the_workers(self):
+        self.assertEqual(self.provider._djomy_fetch_payment_status('tx-1')['status'], 'SUCCESS')
+        # Un autre worker, dont le cache en mémoire est vide, lit le statut partagé.
+        provider_module._status_cache.clear()
+        self.assertEqual(self.provider._djomy_fetch_payment_status('tx-1')['status'], 'SUCCESS')
+        self.assertEqual(self.session.calls, 1)
+
+    def test_pending_status_does_not_replace_a_final_one(self):
+        self.provider._djomy_cache_payment_status('tx-1', {'status': 'SUCCESS'})
+        PaymentStatus = self.env['djomy.payment.status']
+        PaymentStatus._set_status(self.provider, 'tx-1', {'status': 'PENDING'}, 3)
+        self.assertEqual(PaymentStatus._get_status(self.provider, 'tx-1'), {'status': 'SUCCESS'})
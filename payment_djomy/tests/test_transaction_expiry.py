@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'expiration planifiée des transactions Djomy abandonnées.
+
+Le cron annule par lots les tx Djomy restées `draft`/`pending` au-delà de
+l'âge configuré, sans toucher aux tx récentes, finales ou d'autres
+providers. Les tx transmises à Djomy sont d'abord rapprochées : seules celles
+que Djomy donne encore en attente sont annulées.
+"""
+from datetime import timedelta
+from unittest.mock import patch
+
+import requests
+
+from odoo import fields
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.payment_djomy import const
+from odoo.addons.payment_djomy.models import payment_provider as provider_module
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyTransactionExpiry(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        self.partner = self.env['res.partner'].create({'name': 'Client Test'})
+        self.statuses = {}  # {référence Djomy: statut ou exception}
+        self.checked = []
+
+        def send_concurrent_requests(provider, requests_by_key, max_workers):
+            results = {}
+            for key, (_method, endpoint, _payload) in requests_by_key.items():
+                provider_reference = endpoint.split('/')[1]
+                self.checked.append(provider_reference)
+                status = self.statuses.get(provider_reference, 'PENDING')
+                results[key] = status if isinstance(status, Exception) else {
+                    'status': status,
+                    'paidAmount': 5000,
+                    'currency': self.env.company.currency_id.name,
+                }
+            return results
+
+        patcher = patch.object(
+            type(self.provider), '_djomy_send_concurrent_requests', send_concurrent_requests
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Les statuts partagés sont écrits dans des curseurs dédiés : en mode
+        # test ils partagent la transaction du test.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        provider_module._status_cache.clear()
+        self.addCleanup(provider_module._status_cache.clear)
+
+    def _tx(self, reference, state='draft', age_hours=0, provider=None, provider_reference=None):
+        provider = provider or self.provider
+        tx = self.env['payment.transaction'].create({
+            'reference': reference,
+            'amount': 5000,
+            'currency_id': self.env.company.currency_id.id,
+            'provider_id': provider.id,
+            'payment_method_id': (
+                provider.payment_method_ids[:1]
+                or self.env.ref('payment_djomy.payment_method_djomy')
+            ).id,
+            'partner_id': self.partner.id,
+            'provider_reference': provider_reference,
+            'state': state,
+        })
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE payment_transaction SET create_date = %s WHERE id = %s",
+            [fields.Datetime.now() - timedelta(hours=age_hours), tx.id],
+        )
+        tx.invalidate_recordset(['create_date'])
+        return tx
+
+    def test_abandoned_transactions_are_expired(self):
+        old_draft = self._tx('EXP-1', age_hours=const.TRANSACTION_EXPIRY_HOURS + 1)
+        old_pending = self._tx('EXP-2', 'pending', age_hours=const.TRANSACTION_EXPIRY_HOURS + 1)
+        old_done = self._tx('EXP-3', 'done', age_hours=const.TRANSACTION_EXPIRY_HOURS + 1)
+        recent = self._tx('EXP-4', age_hours=1)
+
+        self.env['payment.transaction']._cron_djomy_expire_abandoned_transactions()
+
+        self.assertEqual(old_draft.state, 'cancel')
+        self.assertEqual(old_pending.state, 'cancel')
+        self.assertEqual(old_done.state, 'done')
+        self.assertEqual(recent.state, 'draft')
+
+    def test_expiry_age_is_configurable(self):
+        tx = self._tx('EXP-1', age_hours=3)
+        self.env['ir.config_parameter'].sudo().set_param('djomy.transaction_expiry_hours', 2)
+        self.env['payment.transaction']._cron_djomy_expire_abandoned_transactions()
+        self.assertEqual(tx.state, 'cancel')
+
+    def test_other_providers_are_untouched(self):
+        other_provider = self.env['payment.provider'].create({'name': 'Autre', 'code': 'none'})
+        other = self._tx(
+            'EXP-OTHER', age_hours=const.TRANSACTION_EXPIRY_HOURS + 1, provider=other_provider,
+        )
+        self.env['payment.transaction']._cron_djomy_expire_abandoned_transactions()
+        self.assertEqual(other.state, 'draft')
+
+    def test_expiry_runs_in_batches(self):
+        txs = self.env['payment.transaction'].concat(*(
+            self._tx(f'EXP-{i}', age_hours=const.TRANSACTION_EXPIRY_HOURS + 1) for i in range(5)
+        ))
+        with patch.object(const, 'EXPIRY_BATCH_SIZE', 2), patch.object(
+            type(txs), '_set_canceled', autospec=True, side_effect=type(txs)._set_canceled,
+        ) as set_canceled:
+            self.env['payment.transaction']._cron_djomy_expire_abandoned_transactions()
+        self.assertEqual([len(call.args[0]) for call in set_canceled.call_args_list], [2, 2, 1])
+        self.assertEqual(set(txs.mapped('state')), {'cancel'})
+
+    def test_transactions_sent_to_djomy_are_checked_before_expiry(self):
+        age_hours = const.TRANSACTION_EXPIRY_HOURS + 1
+        paid = self._tx('EXP-PAID', 'pending', age_hours, provider_reference='djomy-paid')
+        abandoned = self._tx('EXP-OPEN', 'pending', age_hours, provider_reference='djomy-open')
+        never_sent = self._tx('EXP-DRAFT', age_hours=age_hours)
+        self.statuses['djomy-paid'] = 'SUCCESS'
+
+        self.env['payment.transaction']._cron_djomy_expire_abandoned_transactions()
+
+        self.assertCountEqual(self.checked, ['djomy-paid', 'djomy-open'])
+        self.assertEqual(paid.state, 'done', "Un paiement abouti n'est pas annulé")
+        self.assertEqual(abandoned.state, 'cancel')
+        self.assertEqual(never_sent.state, 'cancel')
+
+    def test_transactions_without_status_are_not_expired(self):
+        tx = self._tx(
+            'EXP-1', 'pending', const.TRANSACTION_EXPIRY_HOURS + 1, provider_reference='djomy-1',
+        )
+        self.statuses['djomy-1'] = requests.ConnectionError("Djomy injoignable")
+
+        self.env['payment.transaction']._cron_djomy_expire_abandoned_transactions()
+
+        self.assertEqual(self.checked, ['djomy-1'], "La tx n'est vérifiée qu'une fois")
+        self.assertEqual(tx.state, 'pending')
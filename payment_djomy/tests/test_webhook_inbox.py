@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'inbox des webhooks Djomy (`djomy.webhook.event`).
+
+Le webhook stocke la notification vérifiée puis acquitte ; le cron traite
+l'inbox par lots et rejoue plus tard les événements en échec. Les doublons
+exacts sont écartés à l'insertion et les événements rapprochés d'une même
+transaction sont fusionnés.
+"""
+import json
+from unittest.mock import patch
+
+from odoo.exceptions import ValidationError
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.payment_djomy.models import payment_provider as provider_module
+
+
+@tagged('post_install', '-at_install')
+class TestDjomyWebhookInbox(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+        })
+        self.partner = self.env['res.partner'].create({'name': 'Client Test'})
+        self.tx = self.env['payment.transaction'].create({
+            'reference': 'INBOX-TX',
+            'amount': 5000,
+            'currency_id': self.env.company.currency_id.id,
+            'provider_id': self.provider.id,
+            'payment_method_id': self.env.ref('payment_djomy.payment_method_djomy').id,
+            'partner_id': self.partner.id,
+            'provider_reference': 'djomy-tx-1',
+        })
+        self.api_calls = 0
+        # Les statuts partagés sont écrits dans des curseurs dédiés : en mode
+        # test ils partagent la transaction du test.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        provider_module._status_cache.clear()
+        self.addCleanup(provider_module._status_cache.clear)
+
+    # --- Helpers --------------------------------------------------------
+
+    def _enqueue(self, event_type='payment.success', **extra):
+        data = {
+            'eventType': event_type,
+            'data': {
+                'transactionId': 'djomy-tx-1',
+                'merchantPaymentReference': self.tx.reference,
+                **extra,
+            },
+        }
+        return self.env['djomy.webhook.event'].sudo()._enqueue(
+            self.tx, data, json.dumps(data).encode(),
+        )
+
+    def _patch_status(self, status='SUCCESS', fail=False):
+        test = self
+
+        def fake(provider, method, endpoint, **kwargs):
+            test.api_calls += 1
+            if fail:
+                raise ValidationError("Djomy down")
+            return {
+                'transactionId': 'djomy-tx-1',
+                'status': status,
+                'paidAmount': 5000,
+                'currency': test.env.company.currency_id.name,
+            }
+
+        return patch.object(type(self.provider), '_djomy_send_request_with_retry', fake)
+
+    # --- Traitement par le cron -----------------------------------------
+
+    def test_enqueue_does_not_process(self):
+        event = self._enqueue()
+        self.assertEqual(event.state, 'pending')
+        self.assertEqual(self.tx.state, 'draft')
+        self.assertEqual(self.api_calls, 0)
+
+    def test_cron_processes_pending_events(self):
+        event = self._enqueue()
+        with self._patch_status():
+            self.env['djomy.webhook.event']._cron_process_pending_events()
+        self.assertEqual(event.state, 'done')
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(self.tx.state, 'done')
+
+    def test_failed_event_is_retried_later(self):
+        event = self._enqueue()
+        with self._patch_status(fail=True):
+            self.env['djomy.webhook.event']._cron_process_pending_events()
+        self.assertEqual(event.state, 'pending')
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(event.error, 'api_unreachable')
+        self.assertTrue(event.next_attempt_date)
+        self.assertEqual(self.api_calls, 1, "l'événement ne doit pas être repris dans le même run")
+
+    def test_replay_processes_the_event_again(self):
+        event = self._enqueue()
+        with self._patch_status():
+            self.env['djomy.webhook.event']._cron_process_pending_events()
+            event.action_replay()
+            self.assertEqual(event.state, 'pending')
+            self.env['djomy.webhook.event']._cron_process_pending_events()
+        self.assertEqual(event.state, 'done')
+        self.assertEqual(self.api_calls, 2)
+
+    # --- Déduplication et fusion ----------------------------------------
+
+    def test_exact_duplicate_is_dropped(self):
+        event = self._enqueue()
+        duplicate = self._enqueue()
+        self.assertTrue(event)
+        self.assertFalse(duplicate)
+
+    def test_same_event_with_other_payload_is_kept(self):
+        event = self._enqueue(attempt=1)
+        redelivery = self._enqueue(attempt=2)
+        self.assertTrue(redelivery)
+        self.assertNotEqual(event, redelivery)
+
+    def test_close_events_of_a_transaction_are_merged(self):
+        pending_event = self._enqueue('payment.pending')
+        success_event = self._enqueue('payment.success')
+        with self._patch_status():
+            self.env['djomy.webhook.event']._cron_process_pending_events()
+        self.assertEqual(self.api_calls, 1)
+        self.assertEqual(pending_event.state, 'merged')
+        self.assertEqual(success_event.state, 'done')
+        self.assertEqual(self.tx.state, 'done')
+
+    def test_late_pending_event_does_not_replace_the_final_one(self):
+        """Livraison dans le désordre : le `payment.pending` arrive après le succès."""
+        self.provider._djomy_cache_payment_status('djomy-tx-1', {
+            'transactionId': 'djomy-tx-1', 'status': 'PENDING',
+        })
+        success_event = self._enqueue('payment.success')
+        pending_event = self._enqueue('payment.pending')
+        with self._patch_status():
+            self.env['djomy.webhook.event']._cron_process_pending_events()
+        self.assertEqual(success_event.state, 'done')
+        self.assertEqual(pending_event.state, 'merged')
+        self.assertEqual(self.api_calls, 1, "Le statut en attente du cache est refusé")
+        self.assertEqual(self.tx.state, 'done')
@@ -151,3 +151,81 @@ class TestDjomyZombieCleanup(TransactionCase):
         old.invalidate_recordset()
         self.assertEqual(old.state, 'cancel')
         fake_payment.action_cancel.assert_called_once()
+
+    # --- Création en lot : traitement ensembliste -----------------------
+
+    def _tx_vals(self, ref, so, state='draft'):
+        return {
+            'reference': ref, 'amount': 5000,
+            'currency_id': self.env.company.currency_id.id,
+            'provider_id': self.provider.id,
+            'payment_method_id': (self.provider.payment_method_ids[:1] or self.method_djomy).id,
+            'partner_id': self.partner.id,
+            'state': state,
+            'sale_order_ids': [(6, 0, [so.id])],
+        }
+
+    def test_batch_create_posts_one_note_per_document(self):
+        so_a, so_b = self._so('SO-A'), self._so('SO-B')
+        PT = self.env['payment.transaction']
+        old = PT.create([
+            self._tx_vals('OLD-A1', so_a), self._tx_vals('OLD-A2', so_a, 'pending'),
+            self._tx_vals('OLD-B1', so_b),
+        ])
+        self.assertEqual(set(old.mapped('state')), {'draft', 'pending'},
+                         "les tx d'un même lot ne s'annulent pas entre elles")
+        notes_before = {so: len(so.message_ids) for so in (so_a, so_b)}
+
+        PT.create([self._tx_vals('NEW-A', so_a), self._tx_vals('NEW-B', so_b)])
+
+        old.invalidate_recordset()
+        self.assertEqual(set(old.mapped('state')), {'cancel'})
+        for so, refs in ((so_a, ('OLD-A1', 'OLD-A2')), (so_b, ('OLD-B1',))):
+            so.invalidate_recordset()
+            self.assertEqual(len(so.message_ids), notes_before[so] + 1)
+            for ref in refs:
+                self.assertIn(ref, so.message_ids[0].body)
+
+    def test_stale_transactions_go_through_set_canceled(self):
+        """Les surcharges de `_set_canceled` (autres modules) sont appelées."""
+        so = self._so('SO-A')
+        PT = self.env['payment.transaction']
+        old = PT.create([self._tx_vals('OLD-A1', so), self._tx_vals('OLD-A2', so, 'pending')])
+        with patch.object(
+            type(PT), '_set_canceled', autospec=True, side_effect=type(PT)._set_canceled,
+        ) as set_canceled:
+            PT.create([self._tx_vals('NEW-A', so)])
+        set_canceled.assert_called_once()
+        self.assertEqual(set_canceled.call_args.args[0], old)
+        self.assertEqual(set(old.mapped('state')), {'cancel'})
+
+    def test_query_count_does_not_grow_with_stale_transactions(self):
+        """Annuler 10 000 zombies coûte quasiment autant de requêtes que 10 :
+        seules les écritures sont découpées par paquets de `IN_MAX` ids."""
+        sale_orders = [self._so(f'SO-{i}') for i in range(10)]
+        PT = self.env['payment.transaction']
+
+        # Les zombies sont créés après les nouvelles tx (qu'ils annulent au
+        # passage, sans incidence ici) pour mesurer l'annulation seule.
+        def measure(n_stale, prefix):
+            new = PT.create([
+                self._tx_vals(f'{prefix}-NEW-{i}', so) for i, so in enumerate(sale_orders)
+            ])
+            PT.create([
+                self._tx_vals(f'{prefix}-OLD-{i}', sale_orders[i % 10]) for i in range(n_stale)
+            ])
+            self.env.flush_all()
+            self.env.invalidate_all()
+            before = self.cr.sql_log_count
+            new._djomy_cancel_stale_siblings()
+            self.env.flush_all()
+            count = self.cr.sql_log_count - before
+            self.assertFalse(PT.search_count([
+                ('reference', '=like', f'{prefix}-OLD-%'), ('state', '!=', 'cancel'),
+            ]))
+            return count
+
+        small = measure(10, 'SMALL')
+        large = measure(10_000, 'LARGE')
+        write_chunks = 10_000 // self.cr.IN_MAX
+        self.assertLessEqual(large, small + 3 * write_chunks)
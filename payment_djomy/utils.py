@@ -0,0 +1,171 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+
+from odoo.exceptions import ValidationError
+
+
+class SingleFlightCache:
+    """Thread-safe in-memory cache whose entries each have their own lifetime.
+
+    Concurrent lookups of a same missing key share a single computation: the first caller computes
+    the value while the other ones wait for its result instead of computing it again.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = {}  # {key: (value, expiry)}
+        self._in_flight = {}  # {key: Future}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute, get_ttl, is_usable=None, timeout=None):
+        """Return the cached value of the key, or compute it.
+
+        :param key: The cache key.
+        :param callable compute: The function returning the value of the key.
+        :param callable get_ttl: The function returning the lifetime, in seconds, of a value.
+        :param callable is_usable: The function returning whether a cached value can be returned.
+        :param float timeout: How long to wait, in seconds, for the computation of another caller.
+        :return: The value of the key.
+        :raise Exception: If the computation of the value failed.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic() and (not is_usable or is_usable(entry[0])):
+                self.hits += 1
+                return entry[0]
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._in_flight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            return future.result(timeout=timeout)
+
+        try:
+            value = compute()
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        else:
+            self.set(key, value, get_ttl(value))
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def get(self, key):
+        """Return the cached value of the key, or `None` if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] if entry and entry[1] > time.monotonic() else None
+
+    def set(self, key, value, ttl):
+        """Store the value of the key for the given lifetime, in seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_size:
+                self._evict(now)
+            self._entries[key] = (value, now + ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """Return the hit, miss and coalesced lookup counters, and the number of entries."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'size': len(self._entries),
+        }
+
+    def _evict(self, now):
+        """Drop the expired entries, and the oldest ones if the cache is still full."""
+        for key in [key for key, (_value, expiry) in self._entries.items() if expiry <= now]:
+            del self._entries[key]
+        while len(self._entries) >= self.max_size:
+            del self._entries[next(iter(self._entries))]
+
+
+class DjomyAPIError(ValidationError):
+    """Error of a request to the Djomy API, classified from its HTTP status.
+
+    The error remains a `ValidationError`, so that the callers that do not care about its class
+    keep handling it as before.
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None, rejected=False):
+        """
+        :param str message: The error message.
+        :param int status_code: The HTTP status of the response, or `None` if no response was
+                                received (timeout, connection error...).
+        :param float retry_after: The delay, in seconds, after which Djomy accepts requests again.
+        :param bool rejected: Whether the request was not even sent, because the circuit is open or
+                              all the slots of the bulkhead are in use.
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.rejected = rejected
+
+    @property
+    def is_auth_error(self):
+        """Whether the access token was rejected."""
+        return self.status_code == 401
+
+    @property
+    def is_throttled(self):
+        """Whether Djomy refused the request because too many were sent (HTTP 429)."""
+        return self.status_code == 429
+
+    @property
+    def is_transient(self):
+        """Whether the error is due to Djomy being unreachable or failing, not to the request."""
+        return not self.rejected and (self.status_code is None or self.status_code >= 500)
+
+
+def is_transient_failure(error):
+    """Return whether the error of a request means that Djomy is unreachable or failing.
+
+    :param Exception error: The error raised by `requests` or by the provider.
+    :rtype: bool
+    """
+    if isinstance(error, DjomyAPIError):
+        return error.is_transient
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return response.status_code >= 500
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def is_throttled(error):
+    """Return whether the error of a request means that Djomy refused it as too many were sent.
+
+    :param Exception error: The error raised by `requests` or by the provider.
+    :rtype: bool
+    """
+    if isinstance(error, DjomyAPIError):
+        return error.is_throttled
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code == 429
+
+
+def parse_retry_after(response):
+    """Return the `Retry-After` delay of a response, in seconds, or `None` if it has none."""
+    try:
+        return max(0.0, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
@@ -13,14 +13,16 @@
         2. Popup to enter/confirm payment amount
         3. QR code is generated and displayed
         4. Customer scans QR code to pay via Djomy (Orange Money, MTN MoMo, Kulu)
-        5. Payment is confirmed automatically via polling
+        5. Payment is confirmed automatically (pushed over the bus, with polling as fallback)
     """,
     'depends': ['point_of_sale', 'payment_djomy'],
     'external_dependencies': {
         'python': ['qrcode'],
     },
     'data': [
+        'security/ir.model.access.csv',
         'views/pos_payment_method_views.xml',
+        'data/ir_cron_data.xml',
     ],
     'assets': {
         'point_of_sale._assets_pos': [
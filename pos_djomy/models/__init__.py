@@ -1,3 +1,5 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from . import payment_transaction
+from . import pos_djomy_link
 from . import pos_payment_method
@@ -0,0 +1,13 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import api, models
+
+
+class PaymentTransaction(models.Model):
+    _inherit = 'payment.transaction'
+
+    @api.model
+    def _djomy_search_payment_link(self, data):
+        """Override of `payment_djomy` to route the notifications of the POS payment links."""
+        link = self.env['pos.djomy.link'].sudo()._search_by_notification(data)
+        return link or super()._djomy_search_payment_link(data)
@@ -0,0 +1,373 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import random
+import time
+from datetime import timedelta
+
+from odoo import _, api, fields, models
+from odoo.exceptions import ValidationError
+
+from odoo.addons.payment.logging import get_payment_logger
+from odoo.addons.payment_djomy.utils import DjomyAPIError, SingleFlightCache, is_throttled
+
+_logger = get_payment_logger(__name__)
+
+# Adaptive polling of the link status by the POS: every LINK_POLL_FAST_INTERVAL
+# seconds for the first LINK_POLL_FAST_PERIOD seconds after the QR code is
+# shown, when the customer is most likely to pay, then twice slower every
+# LINK_POLL_FAST_PERIOD seconds, up to LINK_POLL_MAX_INTERVAL seconds. The
+# delays are spread by up to LINK_POLL_JITTER so that the terminals of a shop
+# do not poll in step.
+LINK_POLL_FAST_INTERVAL = 2
+LINK_POLL_FAST_PERIOD = 20
+LINK_POLL_MAX_INTERVAL = 15
+LINK_POLL_JITTER = 0.2
+
+# A status received this many seconds ago, by a poll or from the webhook, is
+# answered to the polls without calling Djomy.
+LINK_STATUS_FRESHNESS = 2
+
+# The statuses received by the worker that changed nothing are not written on
+# the link, so that the polls do not rewrite its row; they are only kept in
+# memory for LINK_STATUS_FRESHNESS seconds: {(dbname, link id): state}.
+LINK_STATUS_CACHE_SIZE = 1000
+_received_statuses = SingleFlightCache(LINK_STATUS_CACHE_SIZE)
+
+# Asynchronous link creation: the links requested by the POS are created by a
+# cron, in batches of LINK_CREATION_BATCH_SIZE with at most
+# LINK_CREATION_MAX_WORKERS requests in flight. The POS asks for the link
+# every LINK_CREATION_POLL_INTERVAL seconds. A run holds the links of a batch
+# for LINK_CREATION_CLAIM_DELAY seconds, after which they are created again if
+# the run crashed. A link rejected by the rate limiter is retried after
+# LINK_CREATION_RETRY_DELAY seconds; one not created within
+# LINK_CREATION_MAX_AGE seconds is given up, the cashier having moved on.
+LINK_CREATION_BATCH_SIZE = 20
+LINK_CREATION_CLAIM_DELAY = 30
+LINK_CREATION_MAX_WORKERS = 8
+LINK_CREATION_POLL_INTERVAL = 0.5
+LINK_CREATION_RETRY_DELAY = 2
+LINK_CREATION_MAX_AGE = 60
+LINK_CREATION_TIME_BUDGET = 60
+
+
+class PosDjomyLink(models.Model):
+    """Payment link created by a POS, kept to route its payment status to the POS that owns it."""
+    _name = 'pos.djomy.link'
+    _description = "POS Djomy Payment Link"
+    _order = 'id desc'
+
+    name = fields.Char(
+        string="Payment Link Reference",
+        help="Set once Djomy created the link.",
+        readonly=True,
+        index=True,
+    )
+    merchant_reference = fields.Char(string="Merchant Reference", readonly=True, index=True)
+    payment_method_id = fields.Many2one(
+        string="Payment Method", comodel_name='pos.payment.method', readonly=True,
+        ondelete='cascade',
+    )
+    provider_id = fields.Many2one(
+        string="Provider", comodel_name='payment.provider', required=True, readonly=True,
+        ondelete='cascade',
+    )
+    config_id = fields.Many2one(
+        string="Point of Sale", comodel_name='pos.config', readonly=True, ondelete='cascade',
+    )
+    amount = fields.Float(string="Amount", readonly=True)
+    payment_url = fields.Char(string="Payment Page URL", readonly=True)
+    state = fields.Selection(
+        string="Status",
+        selection=[
+            ('creating', "Creating"),
+            ('error', "Creation Failed"),
+            ('active', "Active"),
+            ('done', "Paid"),
+            ('failed', "Failed"),
+            ('cancelled', "Cancelled"),
+            ('expired', "Expired"),
+        ],
+        default='active',
+        required=True,
+        readonly=True,
+    )
+    djomy_transaction_ref = fields.Char(string="Djomy Transaction ID", readonly=True)
+    status_date = fields.Datetime(string="Status Changed On", readonly=True)
+    request_payload = fields.Json(
+        string="Request Payload",
+        help="The payload of the `POST links` request, without the phone number once created.",
+        readonly=True,
+    )
+    error = fields.Char(string="Creation Error", readonly=True)
+    claimed_until = fields.Datetime(
+        string="Claimed Until",
+        help="Until when the creation cron holds the link, or waits before retrying it.",
+        readonly=True,
+    )
+
+    def init(self):
+        super().init()
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS pos_djomy_link_creating_index
+                ON pos_djomy_link (id)
+             WHERE state = 'creating'
+        """)
+
+    # === BUSINESS METHODS === #
+
+    @api.model
+    def _cron_create_links(self):
+        """Create the payment links requested by the POS in asynchronous mode.
+
+        The links are claimed in batches with `SKIP LOCKED`, by holding them for
+        LINK_CREATION_CLAIM_DELAY seconds, and the claim is committed right away so that no row
+        stays locked while they are created concurrently. Each batch is committed once done, so
+        that the POS can pick its links up right away. The requests keep the interactive priority
+        of the rate limiter: a cashier is waiting for them.
+        """
+        cron = self.env.ref('pos_djomy.cron_create_payment_links')
+        start = time.monotonic()
+        while True:
+            self.flush_model(['state', 'claimed_until'])
+            now = fields.Datetime.now()
+            self.env.cr.execute("""
+                UPDATE pos_djomy_link
+                   SET claimed_until = %s
+                 WHERE id IN (
+                        SELECT id
+                          FROM pos_djomy_link
+                         WHERE state = 'creating'
+                           AND (claimed_until IS NULL OR claimed_until <= %s)
+                         ORDER BY id
+                         LIMIT %s
+                           FOR UPDATE SKIP LOCKED
+                       )
+             RETURNING id
+            """, [
+                now + timedelta(seconds=LINK_CREATION_CLAIM_DELAY),
+                now,
+                LINK_CREATION_BATCH_SIZE,
+            ])
+            links = self.browse(row[0] for row in self.env.cr.fetchall())
+            if not links:
+                self.env.cr.execute("""
+                    SELECT MIN(claimed_until)
+                      FROM pos_djomy_link
+                     WHERE state = 'creating'
+                """)
+                if next_run := self.env.cr.fetchone()[0]:
+                    cron._trigger(next_run)
+                return
+            links.invalidate_recordset(['claimed_until'])
+            self.env['payment.transaction']._djomy_commit_progress()
+            max_date = fields.Datetime.now() - timedelta(seconds=LINK_CREATION_MAX_AGE)
+            outdated_links = links.filtered(lambda link: link.create_date < max_date)
+            outdated_links.write({
+                'state': 'error',
+                'error': _("The payment link could not be created in time."),
+            })
+            links_by_provider = (links - outdated_links).grouped('provider_id')
+            for provider, provider_links in links_by_provider.items():
+                provider_links._create_links(provider)
+            links.filtered(lambda link: link.state == 'creating').write({
+                'claimed_until': (
+                    fields.Datetime.now() + timedelta(seconds=LINK_CREATION_RETRY_DELAY)
+                ),
+            })
+            self.env['payment.transaction']._djomy_commit_progress()
+            if time.monotonic() - start > LINK_CREATION_TIME_BUDGET:
+                cron._trigger()
+                return
+
+    def _create_links(self, provider):
+        """Create the links of a same provider on Djomy and store them.
+
+        The links rejected without being sent, e.g., by the rate limiter, or throttled by Djomy are
+        left to be created by a later run; the others are created or marked as failed.
+
+        :param payment.provider provider: The provider of the links.
+        """
+        responses = provider._djomy_send_concurrent_requests({
+            link.id: ('POST', 'links', link.request_payload) for link in self
+        }, LINK_CREATION_MAX_WORKERS)
+        for link in self:
+            response = responses.get(link.id)
+            if isinstance(response, dict) and response.get('paymentLinkReference'):
+                link.write({
+                    'name': response['paymentLinkReference'],
+                    'payment_url': response.get('paymentPageUrl'),
+                    'state': 'active',
+                    'request_payload': {
+                        key: value for key, value in link.request_payload.items()
+                        if key != 'phoneNumber'
+                    },
+                    'error': False,
+                })
+                continue
+            if isinstance(response, DjomyAPIError) and response.rejected or is_throttled(response):
+                continue
+            error = str(response) if isinstance(response, Exception) else (
+                (response or {}).get('message') or _("Invalid response from Djomy.")
+            )
+            _logger.warning(
+                "Djomy: Could not create the payment link of %s: %s",
+                link.merchant_reference, error,
+            )
+            link.write({'state': 'error', 'error': error})
+
+    def _get_creation_status(self):
+        """Return the answer to the POS picking up a link created in asynchronous mode.
+
+        :return: `pending` and the `nextPollIn` delay in milliseconds while the link is created,
+                 then the same values as `djomy_create_payment_link` in synchronous mode.
+        :rtype: dict
+        """
+        self.ensure_one()
+        if self.state == 'creating':
+            return {
+                'success': True,
+                'pending': True,
+                'nextPollIn': round(LINK_CREATION_POLL_INTERVAL * 1000),
+            }
+        if self.state == 'error':
+            return {'success': False, 'error': self.error}
+        return self.payment_method_id._get_djomy_link_values(
+            self.name, self.payment_url, self.request_payload
+        )
+
+    @api.model
+    def _search_by_notification(self, data):
+        """Return the active link a Djomy notification is about, if any.
+
+        :param dict data: The notification data.
+        :return: The link, or an empty recordset.
+        :rtype: pos.djomy.link
+        """
+        notification_data = data.get('data', data)
+        link_reference = (
+            data.get('paymentLinkReference') or notification_data.get('paymentLinkReference')
+        )
+        if link_reference:
+            return self.search([('name', '=', link_reference)], limit=1)
+        merchant_reference = (
+            notification_data.get('merchantPaymentReference')
+            or notification_data.get('merchantReference')
+        )
+        if merchant_reference:
+            return self.search([
+                ('merchant_reference', '=', merchant_reference),
+                ('state', '=', 'active'),
+            ], limit=1)
+        return self.browse()
+
+    def _djomy_process_notification(self, data):
+        """Fetch the official status of the link and push it to the POS that owns it.
+
+        As for the transactions, the status is never taken from the notification itself, which
+        could be forged when the signature check is off.
+
+        :param dict data: The notification data.
+        :return: The reason why the notification could not be processed, if any.
+        :rtype: str or None
+        """
+        self.ensure_one()
+        try:
+            response = self.provider_id._djomy_send_request_with_retry('GET', f'links/{self.name}')
+        except ValidationError as error:
+            _logger.warning("Djomy: Could not fetch the status of link %s: %s", self.name, error)
+            return 'api_unreachable'
+        self._update_status(self.env['pos.payment.method']._djomy_parse_link_status(response))
+        return None
+
+    @api.model
+    def _get_state_from_status(self, status):
+        """Return the state of a link from its status.
+
+        :param dict status: The link status, as returned by `_djomy_parse_link_status`.
+        :return: The state of the link.
+        :rtype: str
+        """
+        if status['isDone']:
+            return 'done'
+        if status['isFailed']:
+            return 'failed'
+        if status['isCancelled']:
+            return 'cancelled'
+        if status['isExpired']:
+            return 'expired'
+        return 'active'
+
+    def _update_status(self, status):
+        """Record the status of the link and notify the POS when it changed.
+
+        :param dict status: The link status, as returned by `_djomy_parse_link_status`.
+        """
+        self.ensure_one()
+        state = self._get_state_from_status(status)
+        djomy_transaction_ref = status.get('transactionId') or False
+        _received_statuses.set((self.env.cr.dbname, self.id), state, LINK_STATUS_FRESHNESS)
+        if state == self.state and djomy_transaction_ref == self.djomy_transaction_ref:
+            return
+        self.write({
+            'state': state,
+            'djomy_transaction_ref': djomy_transaction_ref,
+            'status_date': fields.Datetime.now(),
+        })
+        if self.config_id:
+            self.config_id._notify('DJOMY_LINK_STATUS', {
+                'paymentLinkReference': self.name,
+                **{key: value for key, value in status.items() if key not in ('data', 'payments')},
+            })
+
+    def _is_status_stale(self):
+        """Return whether the status of the link must be fetched from Djomy.
+
+        A final status never changes, and a status received a moment ago, by
+        this worker or changed by another one, is still accurate enough for the
+        polls.
+        """
+        self.ensure_one()
+        return self.state == 'active' and not _received_statuses.get(
+            (self.env.cr.dbname, self.id)
+        ) and (
+            not self.status_date
+            or self.status_date < fields.Datetime.now() - timedelta(seconds=LINK_STATUS_FRESHNESS)
+        )
+
+    def _get_poll_status(self, version=None):
+        """Return the slim status of the link answered to the polls of the POS.
+
+        :param str version: The version token of the status the POS already
+                            has; if it is still current, only that is answered.
+        :return: The status flags, the `version` token of the status and the
+                 `nextPollIn` delay before the next poll, in milliseconds.
+        :rtype: dict
+        """
+        self.ensure_one()
+        current_version = f'{self.state}:{self.djomy_transaction_ref or ""}'
+        status = {
+            'success': True,
+            'version': current_version,
+            'nextPollIn': self._get_next_poll_delay(),
+        }
+        if version == current_version:
+            return {**status, 'unchanged': True}
+        return {
+            **status,
+            'isPending': self.state == 'active',
+            'isDone': self.state == 'done',
+            'isFailed': self.state == 'failed',
+            'isCancelled': self.state == 'cancelled',
+            'isExpired': self.state == 'expired',
+            'transactionId': self.djomy_transaction_ref or None,
+        }
+
+    def _get_next_poll_delay(self):
+        """Return the delay before the next poll of the link, in milliseconds."""
+        self.ensure_one()
+        age = (fields.Datetime.now() - self.create_date).total_seconds()
+        interval = min(
+            LINK_POLL_MAX_INTERVAL,
+            LINK_POLL_FAST_INTERVAL * 2 ** max(0, age / LINK_POLL_FAST_PERIOD - 1),
+        )
+        return round(interval * random.uniform(1 - LINK_POLL_JITTER, 1 + LINK_POLL_JITTER) * 1000)
@@ -1,17 +1,19 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-import base64
-import io
 from datetime import datetime, timedelta
 
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError, AccessError
 
-try:
-    import qrcode
-    QRCODE_AVAILABLE = True
-except ImportError:
-    QRCODE_AVAILABLE = False
+from odoo.addons.payment_djomy import metrics
+from odoo.addons.pos_djomy import qr
+
+
+def _timed_rpc(function):
+    """Record the duration of a Djomy POS RPC, and whether it raised an error."""
+    return metrics.timed(
+        'djomy_pos_rpc_duration_seconds', 'djomy_pos_rpc_errors_total', rpc=function.__name__
+    )(function)
 
 
 class PosPaymentMethod(models.Model):
@@ -40,16 +42,17 @@ class PosPaymentMethod(models.Model):
         return params
 
     def _get_djomy_payment_provider(self):
-        """Get the configured Djomy payment provider for the current company."""
-        djomy_payment_provider = self.env['payment.provider'].search([
-            ('code', '=', 'djomy'),
-            ('company_id', '=', self.env.company.id),
-        ], limit=1)
+        """Get the configured Djomy payment provider for the current company.
+
+        The provider is resolved once per worker and company, see
+        `payment.provider._djomy_get_provider_id`.
+        """
+        provider_id = self.env['payment.provider']._djomy_get_provider_id(self.env.company.id)
 
-        if not djomy_payment_provider:
+        if not provider_id:
             raise UserError(_("Djomy payment provider for company %s is missing", self.env.company.name))
 
-        return djomy_payment_provider
+        return self.env['payment.provider'].browse(provider_id)
 
     def _generate_qr_code_base64(self, data):
         """Generate a QR code image as base64 string.
@@ -60,28 +63,36 @@ class PosPaymentMethod(models.Model):
         Returns:
             str: Base64 encoded PNG image with data URI prefix
         """
-        if not QRCODE_AVAILABLE:
+        if not qr.QRCODE_AVAILABLE:
             return None
+        return qr.render_png(data)
 
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_M,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
+    def _get_djomy_qr_code_values(self, payment_page_url):
+        """Render the QR code of a payment link in the configured format.
 
-        img = qr.make_image(fill_color="black", back_color="white")
+        The format is set by the `pos_djomy.qr_format` system parameter:
+        `matrix` (default) sends the bare module matrix, drawn by the POS,
+        which is the smallest payload; `png` and `svg` send a rendered image,
+        the SVG being the largest.
 
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
+        Args:
+            payment_page_url: The URL of the payment page
 
-        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        return f"data:image/png;base64,{img_base64}"
+        Returns:
+            dict: The `qrCodeBase64` image data URI, or the `qrMatrix` matrix
+        """
+        if not qr.QRCODE_AVAILABLE or not payment_page_url:
+            return {'qrCodeBase64': None, 'qrMatrix': None}
+
+        qr_format = self.env['ir.config_parameter'].sudo().get_param('pos_djomy.qr_format', 'matrix')
+        if qr_format == 'png':
+            return {'qrCodeBase64': self._generate_qr_code_base64(payment_page_url), 'qrMatrix': None}
+        if qr_format == 'svg':
+            return {'qrCodeBase64': qr.render_svg(payment_page_url), 'qrMatrix': None}
+        return {'qrCodeBase64': None, 'qrMatrix': qr.render_matrix(payment_page_url)}
 
     @api.model
+    @_timed_rpc
     def djomy_create_payment(self, payment_method_id, amount, phone_number, reference, djomy_method=None):
         """Create a Djomy payment request.
 
@@ -132,26 +143,121 @@ class PosPaymentMethod(models.Model):
             }
 
     @api.model
-    def djomy_create_payment_link(self, payment_method_id, amount, reference, phone_number=None):
+    @_timed_rpc
+    def djomy_create_payment_link(self, payment_method_id, amount, reference, phone_number=None, pos_config_id=None):
         """Create a Djomy payment link for QR code display.
 
+        When the `pos_djomy.async_link_creation` system parameter is set,
+        the link is created in the background and only a ticket is answered
+        right away, so that a slow Djomy does not hold the worker; the POS
+        picks the link up with `djomy_get_payment_link`.
+
         Args:
             payment_method_id: ID of the pos.payment.method
             amount: Payment amount
             reference: Merchant payment reference (POS order reference)
             phone_number: Optional phone number to send SMS with payment link
+            pos_config_id: Optional ID of the pos.config to notify of the payment status
 
         Returns:
-            dict: API response with paymentLink URL and linkId
+            dict: API response with paymentLink URL and linkId, or the
+                `ticket` of the link and the `nextPollIn` delay in
+                milliseconds in asynchronous mode
         """
         if not self.env.user.has_group('point_of_sale.group_pos_user'):
             raise AccessError(_("Do not have access to create Djomy payment links"))
 
         payment_method = self.browse(payment_method_id)
         provider = payment_method.sudo()._get_djomy_payment_provider()
+        payload = payment_method._djomy_prepare_link_payload(amount, reference, phone_number)
+        link_values = {
+            'merchant_reference': reference,
+            'payment_method_id': payment_method.id,
+            'provider_id': provider.id,
+            'config_id': pos_config_id,
+            'amount': amount,
+        }
+
+        if self._is_djomy_link_creation_async():
+            link = self.env['pos.djomy.link'].sudo().create({
+                **link_values,
+                'state': 'creating',
+                'request_payload': payload,
+            })
+            self.env.ref('pos_djomy.cron_create_payment_links').sudo()._trigger()
+            return {
+                'success': True,
+                'ticket': link.id,
+                'nextPollIn': link._get_creation_status()['nextPollIn'],
+            }
+
+        try:
+            response = provider._djomy_send_request_with_retry('POST', 'links', json=payload)
+            payment_page_url = response.get('paymentPageUrl')
+
+            # Keep the link to push its payment status to the POS over the bus
+            if response.get('paymentLinkReference'):
+                self.env['pos.djomy.link'].sudo().create({
+                    **link_values,
+                    'name': response['paymentLinkReference'],
+                    'payment_url': payment_page_url,
+                })
+
+            return {
+                **payment_method._get_djomy_link_values(
+                    response.get('paymentLinkReference'), payment_page_url, payload
+                ),
+                'data': response,
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+            }
 
+    @api.model
+    @_timed_rpc
+    def djomy_get_payment_link(self, payment_method_id, ticket):
+        """Pick up a payment link created in asynchronous mode.
+
+        Args:
+            payment_method_id: ID of the pos.payment.method the link was created with
+            ticket: The ticket answered by `djomy_create_payment_link`
+
+        Returns:
+            dict: `pending` and the `nextPollIn` delay in milliseconds while
+                the link is created, then the same values as
+                `djomy_create_payment_link` in synchronous mode
+        """
+        if not self.env.user.has_group('point_of_sale.group_pos_user'):
+            raise AccessError(_("Do not have access to create Djomy payment links"))
+
+        payment_method = self.browse(payment_method_id)
+        payment_method.check_access('read')
+        link = self.env['pos.djomy.link'].sudo().search([
+            ('id', '=', ticket),
+            ('payment_method_id', '=', payment_method.id),
+        ], limit=1)
+        if not link:
+            return {
+                'success': False,
+                'error': _("Unknown payment link request %s", ticket),
+            }
+        return link._get_creation_status()
+
+    def _djomy_prepare_link_payload(self, amount, reference, phone_number=None):
+        """Return the payload of the `POST links` request creating a POS payment link.
+
+        Args:
+            amount: Payment amount
+            reference: Merchant payment reference (POS order reference)
+            phone_number: Optional phone number to send SMS with payment link
+
+        Returns:
+            dict: The request payload
+        """
         # Get country from company
-        country_code = payment_method.company_id.country_id.code or 'GN'
+        country_code = self.company_id.country_id.code or 'GN'
 
         # Calculate expiration (15 minutes from now)
         expires_at = (datetime.utcnow() + timedelta(minutes=15)).strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -170,25 +276,74 @@ class PosPaymentMethod(models.Model):
         if phone_number:
             payload['phoneNumber'] = phone_number
             payload['sendSms'] = True
+        return payload
 
-        try:
-            response = provider._djomy_send_request_with_retry('POST', 'links', json=payload)
-            payment_page_url = response.get('paymentPageUrl')
+    def _get_djomy_link_values(self, payment_link_reference, payment_page_url, payload):
+        """Return the values of a created payment link sent to the POS.
 
-            # Generate QR code image as base64
-            qr_code_base64 = None
-            if payment_page_url:
-                qr_code_base64 = payment_method._generate_qr_code_base64(payment_page_url)
+        Args:
+            payment_link_reference: The Djomy payment link reference
+            payment_page_url: The URL of the payment page
+            payload: The payload the link was created with
 
+        Returns:
+            dict: The link, its QR code, its expiry and whether an SMS was sent
+        """
+        return {
+            'success': True,
+            'paymentLink': payment_page_url,
+            **self._get_djomy_qr_code_values(payment_page_url),
+            'paymentLinkReference': payment_link_reference,
+            'expiresAt': payload.get('expiresAt'),
+            'smsSent': bool(payload.get('sendSms')),
+        }
+
+    @api.model
+    def _is_djomy_link_creation_async(self):
+        """Return whether the payment links are created in the background."""
+        async_mode = self.env['ir.config_parameter'].sudo().get_param(
+            'pos_djomy.async_link_creation', 'False',
+        )
+        return str(async_mode).lower() in ('true', '1', 'yes')
+
+    @api.model
+    @_timed_rpc
+    def djomy_revoke_payment_link(self, payment_method_id, payment_link_reference):
+        """Revoke a payment link that will not be used.
+
+        The POS creates the link of the default amount while the cashier
+        confirms it, and revokes it if another amount is confirmed.
+
+        Args:
+            payment_method_id: ID of the pos.payment.method the link was created with
+            payment_link_reference: The Djomy payment link reference
+
+        Returns:
+            dict: Whether the link was revoked
+        """
+        if not self.env.user.has_group('point_of_sale.group_pos_user'):
+            raise AccessError(_("Do not have access to revoke Djomy payment links"))
+
+        payment_method = self.browse(payment_method_id)
+        payment_method.check_access('read')
+        link = self.env['pos.djomy.link'].sudo().search([
+            ('name', '=', payment_link_reference),
+            ('payment_method_id', '=', payment_method.id),
+            ('state', '=', 'active'),
+        ], limit=1)
+        if not link:
             return {
-                'success': True,
-                'paymentLink': payment_page_url,
-                'qrCodeBase64': qr_code_base64,
-                'paymentLinkReference': response.get('paymentLinkReference'),
-                'expiresAt': expires_at,
-                'smsSent': bool(phone_number),
-                'data': response,
+                'success': False,
+                'error': _("No active payment link %s", payment_link_reference),
             }
+
+        try:
+            link.provider_id._djomy_send_request_with_retry(
+                'POST', f'links/{payment_link_reference}/revoke'
+            )
+            # No status is pushed to the POS: it already moved on to another link
+            link.state = 'cancelled'
+            return {'success': True}
         except Exception as e:
             return {
                 'success': False,
@@ -196,6 +351,7 @@ class PosPaymentMethod(models.Model):
             }
 
     @api.model
+    @_timed_rpc
     def djomy_check_payment_status(self, transaction_id):
         """Check the status of a Djomy payment.
 
@@ -211,7 +367,7 @@ class PosPaymentMethod(models.Model):
         provider = self.sudo()._get_djomy_payment_provider()
 
         try:
-            response = provider._djomy_send_request_with_retry('GET', f'payments/{transaction_id}/status')
+            response = provider._djomy_fetch_payment_status(transaction_id)
             status = response.get('status', '').upper()
 
             return {
@@ -230,42 +386,45 @@ class PosPaymentMethod(models.Model):
             }
 
     @api.model
-    def djomy_check_link_status(self, payment_link_reference):
+    @_timed_rpc
+    def djomy_check_link_status(self, payment_link_reference, version=None):
         """Check the status of a Djomy payment link.
 
+        The answer is slim: only the status flags, a version token and the
+        delay before the next poll. When the status did not change since the
+        `version` the POS already has, only that is answered. Djomy is not
+        called when the status is final or was received a moment ago, e.g.
+        from the webhook.
+
         Args:
             payment_link_reference: The Djomy payment link reference
+            version: The version token of the status the POS already has
 
         Returns:
-            dict: Status information including payment details if paid
+            dict: Status information, with the `version` token and the
+                `nextPollIn` delay in milliseconds
         """
         if not self.env.user.has_group('point_of_sale.group_pos_user'):
             raise AccessError(_("Do not have access to check Djomy payment status"))
 
+        link = self.env['pos.djomy.link'].sudo().search(
+            [('name', '=', payment_link_reference)], limit=1
+        )
+        if link and not link._is_status_stale():
+            return link._get_poll_status(version)
+
         provider = self.sudo()._get_djomy_payment_provider()
 
         try:
-            response = provider._djomy_send_request_with_retry('GET', f'links/{payment_link_reference}')
-            link_status = response.get('status', '').upper()
-            payments = response.get('payments', [])
-
-            # Check if any payment succeeded
-            successful_payment = next(
-                (p for p in payments if p.get('status', '').upper() == 'SUCCESS'),
-                None
+            response = provider._djomy_send_request_with_retry(
+                'GET', f'links/{payment_link_reference}'
             )
-
+            status = self._djomy_parse_link_status(response)
+            if link:
+                link._update_status(status)
+                return link._get_poll_status(version)
             return {
-                'success': True,
-                'linkStatus': link_status,
-                'isPending': link_status == 'ACTIVE' and not successful_payment,
-                'isDone': bool(successful_payment),
-                'isFailed': any(p.get('status', '').upper() == 'FAILED' for p in payments),
-                'isCancelled': link_status == 'REVOKED',
-                'isExpired': link_status == 'EXPIRED',
-                'transactionId': successful_payment.get('transactionId') if successful_payment else None,
-                'payments': payments,
-                'data': response,
+                key: value for key, value in status.items() if key not in ('data', 'payments')
             }
         except Exception as e:
             return {
@@ -273,6 +432,83 @@ class PosPaymentMethod(models.Model):
                 'error': str(e),
             }
 
+    @api.model
+    @_timed_rpc
+    def djomy_check_link_statuses(self, payment_link_references):
+        """Check the status of many Djomy payment links at once.
+
+        This is how a client watching many links, e.g. a shop dashboard,
+        batches its polls. Only the links of the payment methods the user can
+        access, in the allowed companies, are checked; the other references
+        are left out of the answer.
+
+        Args:
+            payment_link_references: The Djomy payment link references, e.g. of
+                all the terminals of a shop
+
+        Returns:
+            dict: The state of each link (active, done, failed, cancelled,
+                expired or error) by payment link reference
+        """
+        if not self.env.user.has_group('point_of_sale.group_pos_user'):
+            raise AccessError(_("Do not have access to check Djomy payment status"))
+
+        Link = self.env['pos.djomy.link'].sudo()
+        links = Link.search([('name', 'in', list(set(payment_link_references)))])
+        payment_methods = self.with_context(active_test=False).search([
+            ('id', 'in', links.payment_method_id.ids),
+            ('company_id', 'in', self.env.companies.ids),
+        ])
+        links_by_reference = {
+            link.name: link for link in links if link.payment_method_id in payment_methods
+        }
+        if not links_by_reference:
+            return {}
+
+        provider = self.sudo()._get_djomy_payment_provider()
+        responses = provider._djomy_fetch_link_statuses(list(links_by_reference))
+        states = {}
+        for reference, response in responses.items():
+            if isinstance(response, Exception):
+                states[reference] = 'error'
+                continue
+            status = self._djomy_parse_link_status(response)
+            states[reference] = Link._get_state_from_status(status)
+            links_by_reference[reference]._update_status(status)
+        return states
+
+    @api.model
+    def _djomy_parse_link_status(self, response):
+        """Build the status of a payment link from the Djomy API response.
+
+        Args:
+            response: The response of `GET links/{payment_link_reference}`
+
+        Returns:
+            dict: Status information including payment details if paid
+        """
+        link_status = response.get('status', '').upper()
+        payments = response.get('payments', [])
+
+        # Check if any payment succeeded
+        successful_payment = next(
+            (p for p in payments if p.get('status', '').upper() == 'SUCCESS'),
+            None
+        )
+
+        return {
+            'success': True,
+            'linkStatus': link_status,
+            'isPending': link_status == 'ACTIVE' and not successful_payment,
+            'isDone': bool(successful_payment),
+            'isFailed': any(p.get('status', '').upper() == 'FAILED' for p in payments),
+            'isCancelled': link_status == 'REVOKED',
+            'isExpired': link_status == 'EXPIRED',
+            'transactionId': successful_payment.get('transactionId') if successful_payment else None,
+            'payments': payments,
+            'data': response,
+        }
+
     def action_djomy_config(self):
         """Open the Djomy payment provider configuration."""
         res_id = self._get_djomy_payment_provider().id
@@ -0,0 +1,127 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+"""QR code rendering of the payment links.
+
+The QR code can be rendered as the bare matrix of modules, which the POS draws itself, as a PNG
+image (legacy) or as an SVG image. The matrix is by far the smallest payload, hence the default.
+The SVG scales without blurring but is the largest: its path takes a few bytes per run of dark
+modules, where the PNG is compressed. The renderings of each URL are kept in bounded LRU caches.
+"""
+
+import base64
+import io
+from functools import lru_cache
+
+try:
+    import qrcode
+    QRCODE_AVAILABLE = True
+except ImportError:
+    QRCODE_AVAILABLE = False
+
+QR_FORMATS = ('png', 'svg', 'matrix')
+QR_CACHE_SIZE = 256
+QR_BORDER = 4  # Quiet zone around the QR code, in modules
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def get_matrix(data):
+    """Return the module matrix of the QR code of the data, without its quiet zone.
+
+    :param str data: The data to encode, e.g. the URL of a payment link.
+    :return: The rows of the matrix, True for the dark modules.
+    :rtype: tuple
+    """
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        border=0,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_png(data, box_size=10):
+    """Return the QR code of the data as a PNG data URI.
+
+    :param str data: The data to encode.
+    :param int box_size: The size of a module, in pixels.
+    :return: The PNG image, as a data URI.
+    :rtype: str
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=box_size,
+        border=QR_BORDER,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return f"data:image/png;base64,{img_base64}"
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_svg(data):
+    """Return the QR code of the data as an SVG data URI.
+
+    The dark modules of each row are merged into horizontal runs, stroked by a single path with
+    relative moves, which keeps the image sharp whatever the size it is displayed at.
+
+    :param str data: The data to encode.
+    :return: The SVG image, as a data URI.
+    :rtype: str
+    """
+    matrix = get_matrix(data)
+    size = len(matrix) + 2 * QR_BORDER
+    path = []
+    for y, row in enumerate(matrix):
+        cursor = None  # End of the previous run of the row
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            run = 1
+            while x + run < len(row) and row[x + run]:
+                run += 1
+            if cursor is None:
+                path.append(f'M{x + QR_BORDER} {y + QR_BORDER}.5h{run}')
+            else:
+                path.append(f'm{x - cursor} 0h{run}')
+            cursor = x + run
+            x += run
+    svg = (
+        f"<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 {size} {size}'"
+        f" shape-rendering='crispEdges'><rect width='{size}' height='{size}' fill='%23fff'/>"
+        f"<path stroke='%23000' d='{''.join(path)}'/></svg>"
+    )
+    return f"data:image/svg+xml,{svg.replace('<', '%3C').replace('>', '%3E')}"
+
+
+def render_matrix(data):
+    """Return the module matrix of the QR code of the data, as drawn by the POS.
+
+    Each row is packed into a hexadecimal string, 4 modules per digit, most significant bit first.
+
+    :param str data: The data to encode.
+    :return: The size of the matrix and its packed rows.
+    :rtype: dict
+    """
+    matrix = get_matrix(data)
+    return {'size': len(matrix), 'rows': list(_pack_rows(matrix))}
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def _pack_rows(matrix):
+    rows = []
+    for row in matrix:
+        bits = ''.join('1' if module else '0' for module in row)
+        bits += '0' * (-len(bits) % 4)
+        rows.append(''.join(f'{int(bits[i:i + 4], 2):x}' for i in range(0, len(bits), 4)))
+    return tuple(rows)
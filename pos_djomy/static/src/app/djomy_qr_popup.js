@@ -4,6 +4,39 @@ import { _t } from "@web/core/l10n/translation";
 import { Component, useState } from "@odoo/owl";
 import { Dialog } from "@web/core/dialog/dialog";
 
+const QR_BORDER = 4; // Quiet zone around the QR code, in modules
+
+/**
+ * Draw the QR code matrix sent by the server as an SVG data URI.
+ *
+ * Each row is packed into a hexadecimal string, 4 modules per digit, most
+ * significant bit first. The dark modules of a row are merged into runs.
+ */
+export function qrMatrixToDataUri(matrix) {
+    const size = matrix.size + 2 * QR_BORDER;
+    const path = [];
+    matrix.rows.forEach((row, y) => {
+        const isDark = (x) => (parseInt(row[x >> 2], 16) >> (3 - (x & 3))) & 1;
+        let x = 0;
+        while (x < matrix.size) {
+            if (!isDark(x)) {
+                x++;
+                continue;
+            }
+            let run = 1;
+            while (x + run < matrix.size && isDark(x + run)) {
+                run++;
+            }
+            path.push(`M${x + QR_BORDER} ${y + QR_BORDER}h${run}v1h-${run}z`);
+            x += run;
+        }
+    });
+    const svg =
+        `<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 ${size} ${size}" shape-rendering="crispEdges">` +
+        `<rect width="${size}" height="${size}" fill="#fff"/><path d="${path.join("")}"/></svg>`;
+    return `data:image/svg+xml;charset=utf-8,${encodeURIComponent(svg)}`;
+}
+
 export class DjomyQRPopup extends Component {
     static template = "pos_djomy.DjomyQRPopup";
     static components = { Dialog };
@@ -11,6 +44,7 @@ export class DjomyQRPopup extends Component {
         title: { type: String, optional: true },
         paymentLink: { type: [String, { value: null }], optional: true },
         qrCodeBase64: { type: [String, { value: null }], optional: true },
+        qrMatrix: { type: [Object, { value: null }], optional: true },
         amount: { type: Number },
         currency: { type: Object },
         smsSent: { type: Boolean, optional: true },
@@ -22,6 +56,7 @@ export class DjomyQRPopup extends Component {
         smsSent: false,
         paymentLink: null,
         qrCodeBase64: null,
+        qrMatrix: null,
     };
 
     setup() {
@@ -41,7 +76,17 @@ export class DjomyQRPopup extends Component {
     }
 
     get hasQRCode() {
-        return !!this.props.qrCodeBase64;
+        return !!(this.props.qrCodeBase64 || this.props.qrMatrix);
+    }
+
+    get qrCodeSrc() {
+        if (this.props.qrCodeBase64) {
+            return this.props.qrCodeBase64;
+        }
+        if (!this._qrCodeSrc) {
+            this._qrCodeSrc = qrMatrixToDataUri(this.props.qrMatrix);
+        }
+        return this._qrCodeSrc;
     }
 
     updateStatus(status, message) {
@@ -8,8 +8,16 @@ import { DjomyQRPopup } from "@pos_djomy/app/djomy_qr_popup";
 import { makeAwaitable } from "@point_of_sale/app/utils/make_awaitable_dialog";
 import { register_payment_method } from "@point_of_sale/app/services/pos_store";
 
-const POLLING_INTERVAL = 3000; // 3 seconds
+// The payment status is pushed over the bus; polling is only a fallback
+// in case a notification is lost. The server sets the delay between two
+// polls; this one is only used when it could not be reached.
+const INITIAL_POLLING_DELAY = 2000; // 2 seconds
+const FALLBACK_POLLING_INTERVAL = 15000; // 15 seconds
 const PAYMENT_TIMEOUT = 120000; // 2 minutes
+// In asynchronous mode, the link is created in the background and picked up
+// with a ticket, as the server tells when to ask next
+const LINK_CREATION_POLLING_DELAY = 500; // 0.5 second
+const LINK_CREATION_TIMEOUT = 60000; // 1 minute
 
 export class PaymentDjomy extends PaymentInterface {
     setup() {
@@ -18,16 +26,30 @@ export class PaymentDjomy extends PaymentInterface {
         this.paymentTimeout = null;
         this.currentPaymentLinkReference = null;
         this.qrPopupClose = null;
+        this.pendingPayment = null;
+        this.statusVersion = null;
     }
 
     async sendPaymentRequest(uuid) {
         await super.sendPaymentRequest(...arguments);
         const line = this.pos.getOrder().getSelectedPaymentline();
         const order = this.pos.getOrder();
+        const reference = order.name || `POS-${Date.now()}`;
+
+        // Create the link of the default amount while the cashier confirms
+        // it, so that the QR code is ready as soon as the popup closes
+        const prefetchedLink = {
+            amount: line.amount,
+            response: this._createPaymentLink(line.amount, reference, null).catch((error) => ({
+                success: false,
+                error: String(error),
+            })),
+        };
 
         // Step 1: Show popup for amount and optional phone number
         const paymentDetails = await this._getPaymentDetails(line.amount, order, line);
         if (!paymentDetails) {
+            this._revokePaymentLink(prefetchedLink.response);
             line.setPaymentStatus("retry");
             return false;
         }
@@ -40,10 +62,9 @@ export class PaymentDjomy extends PaymentInterface {
         line.setPaymentStatus("waiting");
 
         try {
-            // Step 2: Generate payment link (with optional phone for SMS)
-            const reference = order.name || `POS-${Date.now()}`;
-
-            const linkResponse = await this._createPaymentLink(
+            // Step 2: Get the payment link (with optional phone for SMS)
+            const linkResponse = await this._getPaymentLink(
+                prefetchedLink,
                 line.amount,
                 reference,
                 paymentDetails.phoneNumber
@@ -65,7 +86,8 @@ export class PaymentDjomy extends PaymentInterface {
                 linkResponse.paymentLink,
                 linkResponse.qrCodeBase64,
                 line,
-                linkResponse.smsSent
+                linkResponse.smsSent,
+                linkResponse.qrMatrix
             );
 
         } catch (error) {
@@ -120,20 +142,79 @@ export class PaymentDjomy extends PaymentInterface {
     }
 
     async _createPaymentLink(amount, reference, phoneNumber) {
-        return await this.pos.data.silentCall(
+        const response = await this.pos.data.silentCall(
             "pos.payment.method",
             "djomy_create_payment_link",
-            [this.payment_method_id.id, amount, reference, phoneNumber]
+            [this.payment_method_id.id, amount, reference, phoneNumber, this.pos.config.id]
         );
+        if (response.success && response.ticket) {
+            return await this._waitForPaymentLink(response.ticket, response.nextPollIn);
+        }
+        return response;
+    }
+
+    /**
+     * Pick up a link created in the background, once it is ready.
+     */
+    async _waitForPaymentLink(ticket, delay) {
+        const deadline = Date.now() + LINK_CREATION_TIMEOUT;
+        while (Date.now() < deadline) {
+            await new Promise((resolve) => setTimeout(resolve, delay || LINK_CREATION_POLLING_DELAY));
+            const response = await this.pos.data.silentCall(
+                "pos.payment.method",
+                "djomy_get_payment_link",
+                [this.payment_method_id.id, ticket]
+            );
+            if (!response.success || !response.pending) {
+                return response;
+            }
+            delay = response.nextPollIn;
+        }
+        return { success: false, error: _t("Delai expire lors de la generation du lien de paiement") };
+    }
+
+    /**
+     * Return the prefetched link if it matches what the cashier confirmed,
+     * and otherwise revoke it and create the right one.
+     */
+    async _getPaymentLink(prefetchedLink, amount, reference, phoneNumber) {
+        // The SMS is only sent when the link is created with the phone number
+        if (amount === prefetchedLink.amount && !phoneNumber) {
+            const response = await prefetchedLink.response;
+            if (response.success) {
+                return response;
+            }
+        } else {
+            this._revokePaymentLink(prefetchedLink.response);
+        }
+        return await this._createPaymentLink(amount, reference, phoneNumber);
+    }
+
+    /**
+     * Revoke a link that will not be shown, without waiting for it.
+     */
+    _revokePaymentLink(linkResponsePromise) {
+        linkResponsePromise
+            .then((response) => {
+                if (response.success && response.paymentLinkReference) {
+                    return this.pos.data.silentCall(
+                        "pos.payment.method",
+                        "djomy_revoke_payment_link",
+                        [this.payment_method_id.id, response.paymentLinkReference]
+                    );
+                }
+            })
+            .catch((error) => console.error("Error revoking payment link:", error));
     }
 
-    async _showQRCodeAndPoll(paymentLink, qrCodeBase64, line, smsSent = false) {
+    async _showQRCodeAndPoll(paymentLink, qrCodeBase64, line, smsSent = false, qrMatrix = null) {
         return new Promise((resolve) => {
             // Show QR popup
             this.qrPopupClose = this.env.services.dialog.add(DjomyQRPopup, {
                 title: _t("Scannez le QR Code"),
                 paymentLink: paymentLink,
                 qrCodeBase64: qrCodeBase64,
+                qrMatrix: qrMatrix,
                 amount: line.amount,
                 currency: this.pos.currency,
                 smsSent: smsSent,
@@ -150,13 +231,16 @@ export class PaymentDjomy extends PaymentInterface {
     }
 
     _startPolling(line, resolve) {
-        let elapsedTime = 0;
-
-        this.pollingInterval = setInterval(async () => {
-            elapsedTime += POLLING_INTERVAL;
-
+        const startTime = Date.now();
+        const pendingPayment = { line, resolve };
+        this.pendingPayment = pendingPayment;
+        this.statusVersion = null;
+
+        // The server tells when to poll next: fast right after the QR code is
+        // shown, then slower and slower
+        const poll = async () => {
             // Check for timeout
-            if (elapsedTime >= PAYMENT_TIMEOUT) {
+            if (Date.now() - startTime >= PAYMENT_TIMEOUT) {
                 this._stopPolling();
                 if (this.qrPopupClose) {
                     this.qrPopupClose();
@@ -168,43 +252,71 @@ export class PaymentDjomy extends PaymentInterface {
                 return;
             }
 
+            let nextPollIn = FALLBACK_POLLING_INTERVAL;
             try {
                 const status = await this._checkPaymentStatus();
-
-                if (status.isDone) {
-                    this._stopPolling();
-                    if (this.qrPopupClose) {
-                        this.qrPopupClose();
-                        this.qrPopupClose = null;
-                    }
-                    line.setPaymentStatus("done");
-                    resolve(true);
-                    return;
+                nextPollIn = status.nextPollIn || nextPollIn;
+                if (this.pendingPayment === pendingPayment && status.success && !status.unchanged) {
+                    this.statusVersion = status.version;
+                    this._handlePaymentStatus(status);
                 }
-
-                if (status.isFailed || status.isCancelled) {
-                    this._stopPolling();
-                    if (this.qrPopupClose) {
-                        this.qrPopupClose();
-                        this.qrPopupClose = null;
-                    }
-                    const message = status.isCancelled
-                        ? _t("Paiement annule par le client")
-                        : _t("Le paiement a echoue");
-                    this._showError(message);
-                    line.setPaymentStatus("retry");
-                    resolve(false);
-                    return;
-                }
-
-                // Still pending, continue polling
-                line.setPaymentStatus("waitingCard");
-
             } catch (error) {
                 console.error("Error checking payment status:", error);
                 // Continue polling on error, don't fail immediately
             }
-        }, POLLING_INTERVAL);
+            // Unless the payment ended meanwhile, e.g. from the bus
+            if (this.pendingPayment === pendingPayment) {
+                this.pollingInterval = setTimeout(poll, nextPollIn);
+            }
+        };
+        this.pollingInterval = setTimeout(poll, INITIAL_POLLING_DELAY);
+    }
+
+    /**
+     * Called by the POS store when the server pushes the status of a payment
+     * link on the bus.
+     */
+    handleDjomyLinkStatus(status) {
+        if (status.paymentLinkReference !== this.currentPaymentLinkReference) {
+            return;
+        }
+        this._handlePaymentStatus(status);
+    }
+
+    _handlePaymentStatus(status) {
+        if (!this.pendingPayment || !status.success) {
+            return;
+        }
+        const { line, resolve } = this.pendingPayment;
+
+        if (status.isDone) {
+            this._stopPolling();
+            if (this.qrPopupClose) {
+                this.qrPopupClose();
+                this.qrPopupClose = null;
+            }
+            line.setPaymentStatus("done");
+            resolve(true);
+            return;
+        }
+
+        if (status.isFailed || status.isCancelled) {
+            this._stopPolling();
+            if (this.qrPopupClose) {
+                this.qrPopupClose();
+                this.qrPopupClose = null;
+            }
+            const message = status.isCancelled
+                ? _t("Paiement annule par le client")
+                : _t("Le paiement a echoue");
+            this._showError(message);
+            line.setPaymentStatus("retry");
+            resolve(false);
+            return;
+        }
+
+        // Still pending, keep waiting
+        line.setPaymentStatus("waitingCard");
     }
 
     async _checkPaymentStatus() {
@@ -215,13 +327,13 @@ export class PaymentDjomy extends PaymentInterface {
         return await this.pos.data.silentCall(
             "pos.payment.method",
             "djomy_check_link_status",
-            [this.currentPaymentLinkReference]
+            [this.currentPaymentLinkReference, this.statusVersion]
         );
     }
 
     _stopPolling() {
         if (this.pollingInterval) {
-            clearInterval(this.pollingInterval);
+            clearTimeout(this.pollingInterval);
             this.pollingInterval = null;
         }
         if (this.paymentTimeout) {
@@ -229,6 +341,7 @@ export class PaymentDjomy extends PaymentInterface {
             this.paymentTimeout = null;
         }
         this.currentPaymentLinkReference = null;
+        this.pendingPayment = null;
     }
 
     _showError(message, title) {
@@ -0,0 +1,16 @@
+/** @odoo-module */
+
+import { patch } from "@web/core/utils/patch";
+import { PosStore } from "@point_of_sale/app/services/pos_store";
+
+patch(PosStore.prototype, {
+    async setup() {
+        await super.setup(...arguments);
+        // Payment status of the Djomy payment links, pushed by the server
+        // when the webhook (or a status check) reports a change.
+        this.data.connectWebSocket("DJOMY_LINK_STATUS", (status) => {
+            const line = this.getPendingPaymentLine("djomy");
+            line?.payment_method_id.payment_terminal?.handleDjomyLinkStatus(status);
+        });
+    },
+});
@@ -0,0 +1,6 @@
+from . import test_async_link_creation
+from . import test_benchmarks
+from . import test_link_notifications
+from . import test_link_polling
+from . import test_link_revocation
+from . import test_qr
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Tests de la création asynchrone des liens de paiement du POS.
+
+En mode asynchrone, le POS reçoit un ticket aussitôt ; un cron crée le lien
+chez Djomy, et le POS le récupère avec son QR code une fois prêt, sans
+qu'une réponse lente de Djomy n'immobilise un worker HTTP.
+"""
+from datetime import datetime
+from unittest.mock import patch
+
+import requests
+
+from odoo import fields
+from odoo.tests.common import TransactionCase, tagged
+from odoo.tools import mute_logger
+
+from odoo.addons.base.tests.common import new_test_user
+from odoo.addons.payment_djomy.utils import DjomyAPIError
+
+
+@tagged('post_install', '-at_install')
+class TestPosDjomyAsyncLinkCreation(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+            'company_id': self.env.company.id,
+        })
+        self.env.registry.clear_cache()
+        self.env['ir.config_parameter'].sudo().set_param('pos_djomy.async_link_creation', 'True')
+        journal = self.env['account.journal'].search([
+            ('type', '=', 'bank'), ('company_id', '=', self.env.company.id),
+        ], limit=1)
+        self.payment_method = self.env['pos.payment.method'].create({
+            'name': 'Djomy',
+            'journal_id': journal.id,
+            'use_payment_terminal': 'djomy',
+        })
+        cashier = new_test_user(
+            self.env, login='djomy_async_cashier', groups='point_of_sale.group_pos_user',
+        )
+        self.PosPaymentMethod = self.env['pos.payment.method'].with_user(cashier)
+        self.sent = []
+        self.failures = {}  # {link id: exception}
+
+        def send_concurrent_requests(provider, requests_by_key, max_workers):
+            self.sent.append(requests_by_key)
+            return {
+                key: self.failures.pop(key, None) or {
+                    'paymentLinkReference': f'LNK-{key}',
+                    'paymentPageUrl': f'https://pay.djomy.test/LNK-{key}',
+                }
+                for key in requests_by_key
+            }
+        patcher = patch.object(
+            type(self.provider), '_djomy_send_concurrent_requests', send_concurrent_requests
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create(self, phone_number=None):
+        return self.PosPaymentMethod.djomy_create_payment_link(
+            self.payment_method.id, 5000, 'Order 0001', phone_number
+        )
+
+    def _get(self, ticket):
+        return self.PosPaymentMethod.djomy_get_payment_link(self.payment_method.id, ticket)
+
+    def _run_cron(self):
+        self.env['pos.djomy.link']._cron_create_links()
+        self.env.invalidate_all()
+
+    def test_ticket_is_answered_without_calling_djomy(self):
+        result = self._create()
+        self.assertTrue(result['success'])
+        self.assertTrue(result['ticket'])
+        self.assertFalse(self.sent, "Djomy n'est pas appelé pendant la requête du POS")
+        self.assertEqual(self._get(result['ticket'])['pending'], True)
+
+    def test_link_is_picked_up_once_created(self):
+        ticket = self._create(phone_number='00224620000012')['ticket']
+        self._run_cron()
+
+        result = self._get(ticket)
+        self.assertTrue(result['success'])
+        self.assertFalse(result.get('pending'))
+        self.assertEqual(result['paymentLinkReference'], f'LNK-{ticket}')
+        self.assertEqual(result['paymentLink'], f'https://pay.djomy.test/LNK-{ticket}')
+        self.assertTrue(result['smsSent'])
+        link = self.env['pos.djomy.link'].browse(ticket)
+        self.assertEqual(link.state, 'active')
+        self.assertNotIn('phoneNumber', link.request_payload, "Le numéro n'est pas conservé")
+
+    @mute_logger('odoo.addons.pos_djomy.models.pos_djomy_link')
+    def test_failed_creation_is_reported(self):
+        ticket = self._create()['ticket']
+        self.failures = {ticket: requests.exceptions.ReadTimeout("timeout")}
+        self._run_cron()
+        result = self._get(ticket)
+        self.assertFalse(result['success'])
+        self.assertIn('timeout', result['error'])
+
+    def test_rejected_creation_is_retried(self):
+        ticket = self._create()['ticket']
+        self.failures = {ticket: DjomyAPIError("Rate limited", rejected=True)}
+        self._run_cron()
+        self.assertEqual(len(self.sent), 1, "Le lien rejeté attend le passage suivant")
+        self.assertTrue(self._get(ticket)['pending'])
+        self._run_cron()
+        self.assertEqual(len(self.sent), 1, "La nouvelle tentative attend son délai")
+        # Le délai avant la nouvelle tentative est écoulé.
+        self.env['pos.djomy.link'].browse(ticket).claimed_until = fields.Datetime.now()
+        self._run_cron()
+        self.assertEqual(self.env['pos.djomy.link'].browse(ticket).state, 'active')
+
+    def test_claimed_links_are_skipped(self):
+        ticket = self._create()['ticket']
+        # Un autre passage a réservé le lien, puis validé sa réservation.
+        self.env['pos.djomy.link'].browse(ticket).claimed_until = fields.Datetime.add(
+            fields.Datetime.now(), minutes=1
+        )
+        self._run_cron()
+        self.assertFalse(self.sent)
+        self.assertTrue(self._get(ticket)['pending'])
+
+    def test_outdated_requests_are_given_up(self):
+        ticket = self._create()['ticket']
+        self.env.cr.execute(
+            "UPDATE pos_djomy_link SET create_date = %s WHERE id = %s",
+            [datetime(2020, 1, 1), ticket],
+        )
+        self.env.invalidate_all()
+        self._run_cron()
+        self.assertFalse(self.sent)
+        self.assertFalse(self._get(ticket)['success'])
+
+    def test_synchronous_mode_is_the_default(self):
+        self.env['ir.config_parameter'].sudo().set_param('pos_djomy.async_link_creation', False)
+        with patch.object(
+            type(self.provider), '_djomy_send_request_with_retry',
+            return_value={'paymentLinkReference': 'LNK-SYNC', 'paymentPageUrl': 'https://x'},
+        ):
+            result = self._create()
+        self.assertEqual(result['paymentLinkReference'], 'LNK-SYNC')
+        self.assertNotIn('ticket', result)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks du paiement Djomy au POS (hors suite standard).
+
+Simule N terminaux qui créent chacun un lien de paiement puis interrogent
+son statut, un par un (`djomy_check_link_status`) ou en lot
+(`djomy_check_link_statuses`), pendant que les clients paient, et compare
+la taille du QR code envoyé au POS dans chaque format. Voir
+`payment_djomy/tests/common.py` pour le lancement ; le nombre de terminaux
+est fixé par ``DJOMY_BENCH_TERMINALS`` (20 par défaut).
+"""
+import json
+import os
+import time
+import unittest
+
+from odoo.addons.base.tests.common import new_test_user
+from odoo.tests.common import tagged
+
+from odoo.addons.payment_djomy.tests.common import DjomyBenchmarkCase
+from odoo.addons.pos_djomy import qr
+
+
+@tagged('-standard', 'djomy_benchmark', 'post_install', '-at_install')
+class TestPosDjomyBenchmarks(DjomyBenchmarkCase):
+
+    terminals = int(os.environ.get('DJOMY_BENCH_TERMINALS', 20))
+    polling_rounds = 5
+
+    def setUp(self):
+        super().setUp()
+        journal = self.env['account.journal'].search([
+            ('type', '=', 'bank'), ('company_id', '=', self.env.company.id),
+        ], limit=1)
+        self.payment_method = self.env['pos.payment.method'].create({
+            'name': 'Djomy Bench',
+            'journal_id': journal.id,
+            'use_payment_terminal': 'djomy',
+        })
+        cashier = new_test_user(
+            self.env, login='djomy_bench_cashier', groups='point_of_sale.group_pos_user',
+        )
+        self.PosPaymentMethod = self.env['pos.payment.method'].with_user(cashier)
+
+    def test_link_creation_and_polling(self):
+        create_samples, references = [], []
+        for terminal in range(self.terminals):
+            start = time.perf_counter()
+            result = self.PosPaymentMethod.djomy_create_payment_link(
+                self.payment_method.id, 5000, f'BENCH-POS-{terminal}',
+            )
+            create_samples.append(time.perf_counter() - start)
+            self.assertTrue(result['success'], result.get('error'))
+            references.append(result['paymentLinkReference'])
+        self._report(f'pos_link_create_{self.terminals}', create_samples)
+
+        poll_samples, batch_samples = [], []
+        for polling_round in range(self.polling_rounds):
+            # Les clients paient au fil des tours.
+            for reference in references[polling_round::self.polling_rounds]:
+                self.emulator.pay_link(reference)
+            for reference in references:
+                start = time.perf_counter()
+                self.PosPaymentMethod.djomy_check_link_status(reference)
+                poll_samples.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            states = self.PosPaymentMethod.djomy_check_link_statuses(references)
+            batch_samples.append(time.perf_counter() - start)
+
+        self._report(f'pos_link_poll_{self.terminals}', poll_samples)
+        self._report(f'pos_link_poll_batch_{self.terminals}', batch_samples)
+        self.assertEqual(set(states.values()), {'done'})
+
+    @unittest.skipUnless(qr.QRCODE_AVAILABLE, "qrcode n'est pas installé")
+    def test_qr_code_payload_sizes(self):
+        sizes = {}
+        for qr_format in ('png', 'svg', 'matrix'):
+            self.env['ir.config_parameter'].sudo().set_param('pos_djomy.qr_format', qr_format)
+            urls = [f'https://pay.djomy.africa/l/BENCH-{qr_format}-{i}' for i in range(100)]
+            samples = self._measure(self.payment_method._get_djomy_qr_code_values, urls)
+            sizes[qr_format] = len(json.dumps(
+                self.payment_method._get_djomy_qr_code_values(urls[-1])
+            ))
+            self._report(f'pos_qr_{qr_format}', samples, bytes=sizes[qr_format])
+        self.assertEqual(
+            sorted(sizes, key=sizes.get), ['matrix', 'png', 'svg'],
+            "La matrice, envoyée par défaut, est la plus légère",
+        )
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Tests du routage des webhooks vers les liens de paiement du POS.
+
+Une notification qui ne correspond à aucune transaction est rapprochée du
+lien de paiement qu'elle concerne, dont le statut officiel est récupéré puis
+poussé sur le bus au seul POS qui l'a créé.
+"""
+import json
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestPosDjomyLinkNotifications(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+            'company_id': self.env.company.id,
+        })
+        self.config, self.other_config = self.env['pos.config'].create([
+            {'name': 'Djomy Shop'}, {'name': 'Other Shop'},
+        ])
+        self.link = self.env['pos.djomy.link'].create({
+            'name': 'LNK-1',
+            'merchant_reference': 'Order 0001',
+            'provider_id': self.provider.id,
+            'config_id': self.config.id,
+            'amount': 5000,
+        })
+        self.notifications = []  # [(pos.config, type, message)]
+
+        def notify(config, notification_type, message):
+            self.notifications.append((config, notification_type, message))
+
+        self.link_response = {
+            'status': 'ACTIVE',
+            'payments': [{'status': 'SUCCESS', 'transactionId': 'djomy-tx-1'}],
+        }
+        for patcher in (
+            patch.object(type(self.config), '_notify', notify),
+            patch.object(
+                type(self.provider), '_djomy_send_request_with_retry',
+                lambda provider, method, endpoint, **kwargs: self.link_response,
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _notify_webhook(self, data):
+        link = self.env['payment.transaction'].sudo()._djomy_search_payment_link(data)
+        self.assertEqual(link, self.link)
+        return link._djomy_process_notification(data)
+
+    def test_link_reference_routes_the_notification_to_its_pos(self):
+        error = self._notify_webhook({
+            'eventType': 'payment.success',
+            'data': {'paymentLinkReference': 'LNK-1', 'transactionId': 'djomy-tx-1'},
+        })
+        self.assertIsNone(error)
+        self.assertEqual(self.link.state, 'done')
+        self.assertEqual(self.link.djomy_transaction_ref, 'djomy-tx-1')
+        self.assertEqual(len(self.notifications), 1)
+        config, notification_type, message = self.notifications[0]
+        self.assertEqual(config, self.config, "Seul le POS du lien est notifié")
+        self.assertEqual(notification_type, 'DJOMY_LINK_STATUS')
+        self.assertEqual(message['paymentLinkReference'], 'LNK-1')
+        self.assertTrue(message['isDone'])
+        self.assertNotIn('data', message)
+
+    def test_link_notification_goes_through_the_inbox(self):
+        data = {
+            'eventType': 'payment.success',
+            'data': {'paymentLinkReference': 'LNK-1', 'transactionId': 'djomy-tx-1'},
+        }
+        link = self.env['payment.transaction'].sudo()._djomy_search_payment_link(data)
+        Event = self.env['djomy.webhook.event'].sudo()
+        event = Event._enqueue(link, data, json.dumps(data).encode())
+        self.assertEqual(event._get_notified_record(), self.link)
+        self.assertFalse(event.transaction_id)
+
+        Event._cron_process_pending_events()
+        self.assertEqual(event.state, 'done')
+        self.assertEqual(self.link.state, 'done')
+        self.assertEqual(len(self.notifications), 1)
+
+    def test_merchant_reference_routes_the_notification(self):
+        self._notify_webhook({
+            'eventType': 'payment.success',
+            'data': {'merchantPaymentReference': 'Order 0001', 'transactionId': 'djomy-tx-1'},
+        })
+        self.assertEqual(self.link.state, 'done')
+
+    def test_unchanged_status_is_not_pushed(self):
+        self.link_response = {'status': 'ACTIVE', 'payments': []}
+        self._notify_webhook({
+            'eventType': 'payment.pending', 'data': {'paymentLinkReference': 'LNK-1'},
+        })
+        self.assertEqual(self.link.state, 'active')
+        self.assertFalse(self.notifications)
+
+    def test_unknown_link_is_not_routed(self):
+        self.assertIsNone(self.env['payment.transaction'].sudo()._djomy_search_payment_link({
+            'eventType': 'payment.success', 'data': {'paymentLinkReference': 'LNK-UNKNOWN'},
+        }))
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Tests du protocole de suivi des liens de paiement par le POS.
+
+Les réponses sont allégées, versionnées (« inchangé » en quelques octets) et
+fixent le délai du prochain appel ; Djomy n'est pas rappelé pour un statut
+final ou reçu à l'instant.
+"""
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.base.tests.common import new_test_user
+from odoo.addons.pos_djomy.models import pos_djomy_link
+
+
+@tagged('post_install', '-at_install')
+class TestPosDjomyLinkPolling(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+            'company_id': self.env.company.id,
+        })
+        self.env.registry.clear_cache()
+        self.link = self.env['pos.djomy.link'].create({
+            'name': 'LNK-1',
+            'merchant_reference': 'Order 0001',
+            'provider_id': self.provider.id,
+            'amount': 5000,
+        })
+        cashier = new_test_user(
+            self.env, login='djomy_cashier', groups='point_of_sale.group_pos_user',
+        )
+        self.PosPaymentMethod = self.env['pos.payment.method'].with_user(cashier)
+        self.link_status = 'ACTIVE'
+        self.payments = []
+        self.djomy_calls = 0
+
+        def send_request(provider, method, endpoint, **kwargs):
+            self.djomy_calls += 1
+            return {'status': self.link_status, 'payments': self.payments}
+        patcher = patch.object(
+            type(self.provider), '_djomy_send_request_with_retry', send_request
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pos_djomy_link._received_statuses.clear()
+        self.addCleanup(pos_djomy_link._received_statuses.clear)
+
+    def _forget_status(self):
+        """Oublie le statut reçu : le prochain appel interroge Djomy."""
+        self.link.status_date = False
+        pos_djomy_link._received_statuses.clear()
+
+    def _poll(self, version=None):
+        self._forget_status()
+        return self.PosPaymentMethod.djomy_check_link_status('LNK-1', version)
+
+    def test_status_is_slim_and_versioned(self):
+        status = self._poll()
+        self.assertTrue(status['isPending'])
+        self.assertNotIn('data', status)
+        self.assertNotIn('payments', status)
+
+        unchanged = self._poll(status['version'])
+        self.assertEqual(set(unchanged), {'success', 'version', 'nextPollIn', 'unchanged'})
+
+        self.payments = [{'status': 'SUCCESS', 'transactionId': 'djomy-tx-1'}]
+        changed = self._poll(status['version'])
+        self.assertTrue(changed['isDone'])
+        self.assertEqual(changed['transactionId'], 'djomy-tx-1')
+        self.assertNotEqual(changed['version'], status['version'])
+
+    def test_djomy_is_not_called_for_fresh_or_final_status(self):
+        self.PosPaymentMethod.djomy_check_link_status('LNK-1')
+        self.PosPaymentMethod.djomy_check_link_status('LNK-1')
+        self.assertEqual(self.djomy_calls, 1, "Statut reçu à l'instant")
+
+        self.link.write({'state': 'done', 'status_date': fields.Datetime.now() - timedelta(hours=1)})
+        status = self.PosPaymentMethod.djomy_check_link_status('LNK-1')
+        self.assertTrue(status['isDone'])
+        self.assertEqual(self.djomy_calls, 1, "Statut final")
+
+    def test_unchanged_status_is_not_written(self):
+        self.PosPaymentMethod.djomy_check_link_status('LNK-1')
+        status_date = fields.Datetime.now() - timedelta(hours=1)
+        self.link.status_date = status_date
+        self.env.flush_all()
+        pos_djomy_link._received_statuses.clear()
+
+        with patch.object(type(self.link), 'write', autospec=True) as write:
+            self.PosPaymentMethod.djomy_check_link_status('LNK-1')
+        self.assertEqual(self.djomy_calls, 2)
+        write.assert_not_called()
+        self.assertEqual(self.link.status_date, status_date)
+
+        self.PosPaymentMethod.djomy_check_link_status('LNK-1')
+        self.assertEqual(self.djomy_calls, 2, "Le statut inchangé reste frais pour ce worker")
+
+        self.payments = [{'status': 'SUCCESS', 'transactionId': 'djomy-tx-1'}]
+        self._forget_status()
+        self.PosPaymentMethod.djomy_check_link_status('LNK-1')
+        self.assertEqual(self.link.state, 'done')
+        self.assertGreater(self.link.status_date, status_date, "Le changement est enregistré")
+
+    def _age(self, seconds):
+        self.env.cr.execute(
+            "UPDATE pos_djomy_link SET create_date = %s WHERE id = %s",
+            [fields.Datetime.now() - timedelta(seconds=seconds), self.link.id],
+        )
+        self.link.invalidate_recordset(['create_date'])
+
+    def test_polling_slows_down(self):
+        with patch.object(pos_djomy_link, 'LINK_POLL_JITTER', 0):
+            self.assertEqual(self.link._get_next_poll_delay(), 2000)
+            self._age(60)
+            self.assertEqual(self.link._get_next_poll_delay(), 8000)
+            self._age(3600)
+            self.assertEqual(self.link._get_next_poll_delay(), 15000)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Tests de la révocation des liens préchargés et de leur appartenance.
+
+Le POS précharge le lien du montant par défaut pendant que le caissier le
+confirme, et le révoque si un autre montant est confirmé. Un lien ne peut être
+récupéré ou révoqué qu'avec le moyen de paiement qui l'a créé, et son statut
+n'est consulté que par les utilisateurs de la société de ce moyen de paiement.
+"""
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.base.tests.common import new_test_user
+
+
+@tagged('post_install', '-at_install')
+class TestPosDjomyLinkRevocation(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = self.env.ref('payment_djomy.payment_provider_djomy')
+        self.provider.write({
+            'djomy_client_id': 'ci_test',
+            'djomy_client_secret': 'sec_test',
+            'state': 'test',
+            'company_id': self.env.company.id,
+        })
+        self.env.registry.clear_cache()
+        journal = self.env['account.journal'].search([
+            ('type', '=', 'bank'), ('company_id', '=', self.env.company.id),
+        ], limit=1)
+        other_journal = self.env['account.journal'].create({
+            'name': 'Djomy Other Shop', 'type': 'bank', 'code': 'DJOS',
+        })
+        self.payment_method, self.other_payment_method = self.env['pos.payment.method'].create([
+            {'name': name, 'journal_id': journal.id, 'use_payment_terminal': 'djomy'}
+            for name, journal in (('Djomy', journal), ('Djomy Other', other_journal))
+        ])
+        cashier = new_test_user(
+            self.env, login='djomy_revoke_cashier', groups='point_of_sale.group_pos_user',
+        )
+        self.PosPaymentMethod = self.env['pos.payment.method'].with_user(cashier)
+        self.requests = []  # [(méthode, endpoint)]
+
+        def send_request(provider, method, endpoint, **kwargs):
+            self.requests.append((method, endpoint))
+            if endpoint == 'links':
+                return {'paymentLinkReference': 'LNK-1', 'paymentPageUrl': 'https://pay.djomy.test'}
+            return {}
+
+        patcher = patch.object(type(self.provider), '_djomy_send_request_with_retry', send_request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _prefetch(self):
+        result = self.PosPaymentMethod.djomy_create_payment_link(
+            self.payment_method.id, 5000, 'Order 0001'
+        )
+        self.assertEqual(result['paymentLinkReference'], 'LNK-1')
+        return self.env['pos.djomy.link'].search([('name', '=', 'LNK-1')])
+
+    def test_prefetched_link_is_revoked(self):
+        link = self._prefetch()
+        self.assertEqual(link.state, 'active')
+        result = self.PosPaymentMethod.djomy_revoke_payment_link(self.payment_method.id, 'LNK-1')
+        self.assertTrue(result['success'])
+        self.assertEqual(self.requests[-1], ('POST', 'links/LNK-1/revoke'))
+        self.assertEqual(link.state, 'cancelled')
+
+    def test_revoked_link_is_not_revoked_again(self):
+        self._prefetch()
+        self.PosPaymentMethod.djomy_revoke_payment_link(self.payment_method.id, 'LNK-1')
+        result = self.PosPaymentMethod.djomy_revoke_payment_link(self.payment_method.id, 'LNK-1')
+        self.assertFalse(result['success'])
+        self.assertEqual(len(self.requests), 2, "Djomy n'est appelé qu'une fois pour révoquer")
+
+    def test_link_of_another_payment_method_is_not_revoked(self):
+        link = self._prefetch()
+        result = self.PosPaymentMethod.djomy_revoke_payment_link(
+            self.other_payment_method.id, 'LNK-1'
+        )
+        self.assertFalse(result['success'])
+        self.assertEqual(len(self.requests), 1, "Djomy n'est pas appelé")
+        self.assertEqual(link.state, 'active')
+
+    def test_link_of_another_payment_method_is_not_picked_up(self):
+        self.env['ir.config_parameter'].sudo().set_param('pos_djomy.async_link_creation', 'True')
+        ticket = self.PosPaymentMethod.djomy_create_payment_link(
+            self.payment_method.id, 5000, 'Order 0001'
+        )['ticket']
+        self.assertTrue(
+            self.PosPaymentMethod.djomy_get_payment_link(self.payment_method.id, ticket)['pending']
+        )
+        self.assertFalse(
+            self.PosPaymentMethod.djomy_get_payment_link(
+                self.other_payment_method.id, ticket
+            )['success']
+        )
+
+    def test_statuses_of_links_of_other_companies_are_not_checked(self):
+        self._prefetch()
+        other_company = self.env['res.company'].create({'name': 'Djomy Other Company'})
+        other_company_method = self.env['pos.payment.method'].create({
+            'name': 'Djomy Elsewhere', 'company_id': other_company.id,
+        })
+        self.env['pos.djomy.link'].create({
+            'name': 'LNK-2',
+            'merchant_reference': 'Order 0002',
+            'provider_id': self.provider.id,
+            'payment_method_id': other_company_method.id,
+            'amount': 5000,
+        })
+        fetched = []
+
+        def fetch_link_statuses(provider, references):
+            fetched.extend(references)
+            return {reference: {'status': 'ACTIVE', 'payments': []} for reference in references}
+
+        with patch.object(type(self.provider), '_djomy_fetch_link_statuses', fetch_link_statuses):
+            states = self.PosPaymentMethod.djomy_check_link_statuses(['LNK-1', 'LNK-2', 'LNK-X'])
+        self.assertEqual(states, {'LNK-1': 'active'})
+        self.assertEqual(fetched, ['LNK-1'], "Djomy n'est appelé que pour les liens accessibles")
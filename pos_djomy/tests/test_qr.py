@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Tests du rendu des QR codes des liens de paiement.
+
+Le POS dessine lui-même la matrice compacte : ses lignes hexadécimales
+doivent redonner exactement la matrice du QR code, et le chemin SVG couvrir
+exactement ses modules sombres.
+"""
+import base64
+import re
+import unittest
+from urllib.parse import unquote
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.pos_djomy import qr
+
+URL = 'https://pay.djomy.africa/link/LNK-20260916-0001?ref=Order%200001'
+
+
+@tagged('post_install', '-at_install')
+@unittest.skipUnless(qr.QRCODE_AVAILABLE, "qrcode n'est pas installé")
+class TestPosDjomyQr(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        self.matrix = qr.get_matrix(URL)
+
+    def _dark_modules(self):
+        return {
+            (x, y) for y, row in enumerate(self.matrix) for x, module in enumerate(row) if module
+        }
+
+    def test_packed_rows_decode_to_the_matrix(self):
+        packed = qr.render_matrix(URL)
+        self.assertEqual(packed['size'], len(self.matrix))
+        self.assertEqual(len(packed['rows']), len(self.matrix))
+        for row, hex_row in zip(self.matrix, packed['rows']):
+            self.assertEqual(len(hex_row), -(-len(row) // 4), "4 modules par chiffre")
+            bits = bin(int(hex_row, 16))[2:].zfill(len(hex_row) * 4)
+            self.assertEqual(tuple(bit == '1' for bit in bits[:len(row)]), row)
+            self.assertNotIn('1', bits[len(row):], "Le bourrage est à zéro")
+
+    def test_svg_path_covers_exactly_the_dark_modules(self):
+        svg = unquote(qr.render_svg(URL).removeprefix('data:image/svg+xml,'))
+        size = len(self.matrix) + 2 * qr.QR_BORDER
+        self.assertIn(f"viewBox='0 0 {size} {size}'", svg)
+        path = re.search(r" d='([^']*)'", svg).group(1)
+
+        covered = set()
+        x = y = None
+        for command, dx, dy, run in re.findall(r'([Mm])(-?\d+) (\d+)(?:\.5)?h(\d+)', path):
+            if command == 'M':
+                x, y = int(dx) - qr.QR_BORDER, int(dy) - qr.QR_BORDER
+            else:
+                self.assertEqual(dy, '0', "Déplacement relatif sur la même ligne")
+                x += int(dx)
+            for _i in range(int(run)):
+                self.assertNotIn((x, y), covered, "Aucun module n'est tracé deux fois")
+                covered.add((x, y))
+                x += 1
+        self.assertEqual(covered, self._dark_modules())
+
+    def test_png_has_the_size_of_the_matrix(self):
+        png = base64.b64decode(qr.render_png(URL, box_size=3).removeprefix('data:image/png;base64,'))
+        self.assertEqual(png[:8], b'\x89PNG\r\n\x1a\n')
+        width, height = int.from_bytes(png[16:20], 'big'), int.from_bytes(png[20:24], 'big')
+        expected = (len(self.matrix) + 2 * qr.QR_BORDER) * 3
+        self.assertEqual((width, height), (expected, expected))
+
+    def test_renderings_are_cached(self):
+        self.assertIs(qr.render_svg(URL), qr.render_svg(URL))
+        self.assertIs(qr.render_matrix(URL)['rows'][0], qr.render_matrix(URL)['rows'][0])